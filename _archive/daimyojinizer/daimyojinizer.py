@@ -5,8 +5,19 @@
 3音以上離れていたら↑/↓
 5音以上離れていたら↑↑/↓↓
 """
+import sys
+from os.path import abspath, dirname
+
+import numpy as np
 import utaupy
 
+# リポジトリ直下の _common を使う
+sys.path.append(dirname(dirname(dirname(abspath(__file__)))))
+from _common.columns import NoteColumns  # noqa: E402 pylint: disable=wrong-import-position
+
+# 音程差の区分ごとの記号。上から順に当てはまるものを使う。
+MARKS = ('', '↑↑', '↑', '↓', '↓↓')
+
 
 def daimyojinize(plugin: utaupy.utauplugin.UtauPlugin):
     """
@@ -16,26 +27,26 @@ def daimyojinize(plugin: utaupy.utauplugin.UtauPlugin):
     # [#PREV] のノートがあるとき
     if plugin.previous_note is not None:
         notes.insert(0, plugin.previous_note)
-    # 音程差を調べて、それに応じて歌詞を変える
+    # 音程差をまとめて調べて、区分ごとの記号を決める
+    notenum_difference = np.diff(NoteColumns(notes).notenum)
+    conditions = [
+        # 音程差が小さいとき
+        (-3 < notenum_difference) & (notenum_difference < 3),
+        # 音程差が大きいとき
+        notenum_difference >= 5,
+        (3 <= notenum_difference) & (notenum_difference < 5),
+        (-5 < notenum_difference) & (notenum_difference <= 3),
+        notenum_difference <= -5,
+    ]
+    marks = np.select(conditions, range(len(MARKS)), default=-1)
+    if np.any(marks < 0):
+        raise Exception('音程差の区分に関するエラーです。開発者に連絡してください。')
+    # 音程差に応じて歌詞を変える
     for idx, note in enumerate(notes[1:], 1):
-        notenum_difference = note.notenum - notes[idx - 1].notenum
         note.lyric = note.lyric.strip('↑↓')
         if note.lyric == 'R' or notes[idx - 1].lyric == 'R':
             continue
-        # 音程差が小さいとき
-        if -3 < notenum_difference < 3:
-            pass
-        # 音程差が大きいとき
-        elif notenum_difference >= 5:
-            note.lyric += '↑↑'
-        elif 3 <= notenum_difference < 5:
-            note.lyric += '↑'
-        elif -5 < notenum_difference <= 3:
-            note.lyric += '↓'
-        elif notenum_difference <= -5:
-            note.lyric += '↓↓'
-        else:
-            raise Exception('音程差の区分に関するエラーです。開発者に連絡してください。')
+        note.lyric += MARKS[marks[idx - 1]]
 
 
 if __name__ == '__main__':
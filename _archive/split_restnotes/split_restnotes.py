@@ -17,30 +17,34 @@ r"""
     5. 音符→休符の流れをまた探す
 """
 
+import sys
+from os.path import abspath, dirname
 
 import utaupy as up
 
+# リポジトリ直下の _common を使う
+sys.path.append(dirname(dirname(dirname(abspath(__file__)))))
+from _common.edit import NoteEditBuffer  # noqa: E402 pylint: disable=wrong-import-position
+
 
 def split_restnotes(plugin):
     """
     ノートを分割する。
+    分割したノートは最後にまとめて挿入するので、たどっている途中でインデックスがずれない。
     """
     notes = plugin.notes
-    for i, note in enumerate(notes[1:]):
-        n1 = notes[i-1]
+    buffer = NoteEditBuffer(notes)
+    for i in range(1, len(notes)):
+        n1 = notes[i - 1]
         n2 = notes[i]
         if ('R' not in n1.lyric) and (n2.lyric == 'R'):
             n2.notenum = n1.notenum
-            new_note = plugin.insert_note(i+1)
-            new_note.lyric = 'R'
             tmp = n2.length
             if tmp > 960:
-                n2.length = 480
-                new_note.length = tmp - 480
+                buffer.split(i, (480, tmp - 480))
             else:
-                n2.length = tmp // 2
-                new_note.length = tmp - (tmp // 2)
-        print(note)
+                buffer.split(i, (tmp // 2, tmp - (tmp // 2)))
+    plugin.notes = buffer.apply()
     print('---')
 
 
@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+複数のプラグインで共有する処理
+
+install.py がインストールするときに、各プラグインのフォルダに複製する。
+"""
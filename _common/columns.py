@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+ノートの数値項目を NumPy の配列としてまとめて扱う
+
+ノートを1つずつ処理する代わりに、項目ごとの配列に対してまとめて計算し、
+値が変わったノートの、変わった項目だけをノートに書き戻す。
+"""
+
+from _common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# 休符の歌詞
+REST_LYRIC = 'R'
+# 子音速度がないときの値 (UTAU の初期値)
+DEFAULT_VELOCITY = 100
+
+
+def _read_tempo(note) -> float:
+    tempo = note.get('Tempo', note._hidden_dict.get('Tempo'))  # pylint: disable=protected-access
+    return np.nan if tempo is None else float(tempo)
+
+
+# 項目名: (ノートから値を読む関数, dtype, ノートに書き込む関数)
+COLUMNS = {
+    'length': (lambda note: note.length, int,
+               lambda note, value: setattr(note, 'length', int(value))),
+    'notenum': (lambda note: note.notenum, int,
+                lambda note, value: setattr(note, 'notenum', int(value))),
+    'velocity': (lambda note: int(note.get('Velocity', DEFAULT_VELOCITY)), int,
+                 lambda note, value: setattr(note, 'velocity', int(value))),
+    'tempo': (_read_tempo, float,
+              lambda note, value: setattr(note, 'tempo', float(value))),
+    'is_rest': (lambda note: note.lyric == REST_LYRIC, bool, None),
+}
+
+
+class NoteColumns:
+    """ノートの数値項目を項目ごとの NumPy 配列にしたもの
+
+    columns.length, columns.notenum, columns.velocity, columns.tempo, columns.is_rest
+    のように使う。配列は初めて使うときに作る。
+    配列を書き換えてから write_back() すると、値が変わったところだけノートに書き戻す。
+    is_rest は読み取り専用。
+    """
+
+    def __init__(self, notes: list):
+        self.notes = notes
+        self.arrays = {}
+        self.originals = {}
+
+    def __getattr__(self, name):
+        if name not in COLUMNS:
+            raise AttributeError(name)
+        if name not in self.arrays:
+            read, dtype, _ = COLUMNS[name]
+            array = np.fromiter((read(note) for note in self.notes), dtype=dtype,
+                                count=len(self.notes))
+            self.arrays[name] = array
+            self.originals[name] = array.copy()
+        return self.arrays[name]
+
+    def __setattr__(self, name, value):
+        if name in COLUMNS:
+            if len(value) != len(self.notes):
+                raise ValueError(f'{name} の長さがノート数と一致しません。')
+            # 読み込んでいない項目は、変更を調べるために先に読み込んでおく
+            getattr(self, name)
+            self.arrays[name] = np.asarray(value, dtype=COLUMNS[name][1])
+        else:
+            super().__setattr__(name, value)
+
+    def changed(self, name: str):
+        """値が変わったノートのインデックスを返す
+        """
+        if name not in self.arrays:
+            return np.array([], dtype=int)
+        array, original = self.arrays[name], self.originals[name]
+        if name == 'tempo':
+            return np.flatnonzero((array != original) & ~(np.isnan(array) & np.isnan(original)))
+        return np.flatnonzero(array != original)
+
+    def write_back(self) -> int:
+        """値が変わった項目だけノートに書き戻す。書き戻したノートの数を返す。
+        """
+        written = set()
+        for name, array in self.arrays.items():
+            write = COLUMNS[name][2]
+            indices = self.changed(name)
+            if write is None:
+                if len(indices) > 0:
+                    raise ValueError(f'{name} は書き換えられません。')
+                continue
+            for i in indices:
+                write(self.notes[i], array[i])
+            self.originals[name] = array.copy()
+            written.update(indices.tolist())
+        return len(written)
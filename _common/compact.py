@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+メモリを節約するノート
+
+utaupy のノートは項目ごとに辞書のキーと値の文字列を持つので、
+1時間のメドレーや学習用の UST のように全ノートを読み込むと、メモリと GC の時間が目立ってくる。
+ここでは、よく使う項目 (Lyric, Length, NoteNum, Velocity, Tempo, Flags, PBS, PBW, PBY, PBM) を
+__slots__ に型付きの値で持ち、ピッチの数値は array に入れる。それ以外の項目は値のタプルで持ち、
+項目名の並びは同じ並びのノート同士で共有する。短い値の文字列も読み込むときに共有する。
+
+CompactNote は utaupy.ust.Note を継承していて、同じように使える。
+元の文字列に戻せない値 (Tempo=120.00 など) は文字列のまま持つので、書き出した内容は変わらない。
+
+python compact.py で、10万ノートを読み込んだときのメモリ使用量を utaupy と比べる。
+"""
+
+import re
+from array import array
+from decimal import ROUND_HALF_EVEN, ROUND_HALF_UP, Decimal
+from os.path import splitext
+from sys import argv
+from typing import Callable
+
+from utaupy.ust import Note
+from utaupy.utauplugin import UtauPlugin
+
+# ノート以外の区切り
+SPECIAL_TAGS = ('[#VERSION]', '[#SETTING]', '[#PREV]', '[#NEXT]', '[#TRACKEND]')
+# 共有する値の文字列の最大の長さ
+MAX_POOLED_LENGTH = 32
+PBS_SEPARATOR = re.compile('[;,]')
+# ノートの最初に並ぶ項目 (utaupy のノートと同じ)
+FIRST_KEYS = ('Tag', 'Length', 'NoteNum')
+
+
+def _format_number(value) -> str:
+    """整数になる値は整数で、それ以外は repr で文字列にする
+    """
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _parse_int(text: str):
+    try:
+        value = int(text)
+    except ValueError:
+        return text
+    return value if str(value) == text else text
+
+
+def _parse_float(text: str):
+    try:
+        value = float(text)
+    except ValueError:
+        return text
+    return value if _format_number(value) == text else text
+
+
+def _parse_floats(text: str, separator: str):
+    """数値の列を array にする。元の文字列に戻せないときは文字列のまま返す。
+
+    整数を '50' と書く形式と、utaupy の setter と同じく '50.0' と書く形式のどちらかなら戻せる。
+    後者の形式は ('.', array) のタプルにして区別する。
+    """
+    try:
+        values = array('d', map(float, PBS_SEPARATOR.split(text)))
+    except ValueError:
+        return text
+    if separator.join(map(_format_number, values)) == text:
+        return values
+    if separator.join(map(str, values)) == text:
+        return ('.', values)
+    return text
+
+
+def _format_floats(value, separator: str) -> str:
+    if isinstance(value, tuple):
+        return separator.join(map(str, value[1]))
+    return separator.join(map(_format_number, value))
+
+
+# 項目名: (スロット名, 文字列から読む関数, 値を返すときの関数)。読む関数が文字列を返したときはそのまま持つ。
+# utaupy で読み込んだノートと同じく、Length と NoteNum は整数で、ほかは文字列で返す。
+FIELDS = {
+    'Tag': ('_tag', str, str),
+    'Lyric': ('_lyric', str, str),
+    'Length': ('_length', _parse_int, int),
+    'NoteNum': ('_notenum', _parse_int, int),
+    'Velocity': ('_velocity', _parse_int, str),
+    'Tempo': ('_tempo', _parse_float, _format_number),
+    'Flags': ('_flags', str, str),
+    'PBS': ('_pbs', lambda text: _parse_floats(text, ';'), lambda value: _format_floats(value, ';')),
+    'PBW': ('_pbw', lambda text: _parse_floats(text, ','), lambda value: _format_floats(value, ',')),
+    'PBY': ('_pby', lambda text: _parse_floats(text, ','), lambda value: _format_floats(value, ',')),
+    'PBM': ('_pbm', str, str),
+}
+# 項目名の並び: {項目名: その他の項目の値のタプルでの位置 (スロットに持つ項目は -1)}
+_LAYOUTS = {}
+
+
+def _layout(keys: tuple) -> tuple:
+    """項目名の並びを共有するものに置き換え、位置の辞書と一緒に返す
+    """
+    layout = _LAYOUTS.get(keys)
+    if layout is None:
+        positions, n_extras = {}, 0
+        for key in keys:
+            if key in FIELDS:
+                positions[key] = -1
+            else:
+                positions[key] = n_extras
+                n_extras += 1
+        layout = _LAYOUTS[keys] = (keys, positions)
+    return layout
+
+
+class CompactNote(Note):
+    """よく使う項目を __slots__ に、それ以外を値のタプルに持つノート
+
+    utaupy.ust.Note と同じように使える。値は utaupy で読み込んだノートと同じく文字列
+    (Length と NoteNum は整数) で返し、length, notenum, pbw などのプロパティは文字列を経由しない。
+    _hidden_dict は Tempo と $TimeSignatures を持つ (書き換えるときは辞書ごと代入する)。
+    """
+    __slots__ = tuple(slot for slot, _, _ in FIELDS.values()) + (
+        '_keys', '_positions', '_extras', '_hidden_tempo', '_hidden_timesignatures')
+
+    def __init__(self, tag: str = '[#INSERT]'):  # pylint: disable=super-init-not-called
+        self._clear()
+        self._hidden_tempo = self._hidden_timesignatures = None
+        self['Tag'] = tag
+        self.length = 480
+        self.notenum = 60
+
+    def _clear(self):
+        """すべての項目を消す
+        """
+        for slot, _, _ in FIELDS.values():
+            setattr(self, slot, None)
+        self._keys, self._positions = _layout(())
+        self._extras = ()
+
+    @classmethod
+    def from_lines(cls, tag: str, lines, pool: dict):
+        """タグと 'Key=Value' の行から作る。pool は行ごとの読み込み結果を共有するための辞書。
+
+        値は書き換えずに置き換えるので、同じ行から読んだ値 (array も) はノート同士で共有する。
+        持っていない項目のスロットは空のままにする (読むときは None として扱う)。
+        """
+        note = cls.__new__(cls)
+        note._tag = tag
+        note._hidden_tempo = note._hidden_timesignatures = None
+        # utaupy と同じく、Length と NoteNum は初期値を入れて先頭に並べる
+        note._length, note._notenum = 480, 60
+        keys, extras = ['Tag', 'Length', 'NoteNum'], []
+        for line in lines:
+            entry = pool.get(line)
+            if entry is None:
+                key, value = line.split('=', 1)
+                field = FIELDS.get(key)
+                entry = (key, None, value) if field is None else (key, field[0], field[1](value))
+                if len(value) <= MAX_POOLED_LENGTH:
+                    pool[line] = entry
+            key, slot, value = entry
+            if slot is None:
+                extras.append(value)
+                keys.append(key)
+            else:
+                setattr(note, slot, value)
+                if key not in FIRST_KEYS:
+                    keys.append(key)
+        note._keys, note._positions = _layout(tuple(keys))
+        note._extras = tuple(extras)
+        return note
+
+    # 辞書としての操作 --------------------------------------------------------
+
+    def __getitem__(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            raise KeyError(key)
+        if position >= 0:
+            return self._extras[position]
+        slot, _, render = FIELDS[key]
+        value = getattr(self, slot, None)
+        return value if isinstance(value, str) else render(value)
+
+    def __setitem__(self, key, value):
+        value = str(value)
+        if key in FIELDS:
+            slot, parse, _ = FIELDS[key]
+            setattr(self, slot, parse(value))
+            if key not in self._positions:
+                self._keys, self._positions = _layout(self._keys + (key,))
+            return
+        position = self._positions.get(key)
+        if position is None:
+            self._keys, self._positions = _layout(self._keys + (key,))
+            self._extras += (value,)
+        else:
+            self._extras = self._extras[:position] + (value,) + self._extras[position + 1:]
+
+    def __delitem__(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            raise KeyError(key)
+        if position >= 0:
+            self._extras = self._extras[:position] + self._extras[position + 1:]
+        else:
+            setattr(self, FIELDS[key][0], None)
+        self._keys, self._positions = _layout(tuple(k for k in self._keys if k != key))
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def data(self) -> dict:
+        """項目の辞書 (新しく作ったもの)。代入すると、すべての項目を入れ替える。
+        """
+        return {key: self[key] for key in self._keys}
+
+    @data.setter
+    def data(self, value):
+        self._clear()
+        for key in value:
+            self[key] = value[key]
+
+    @property
+    def _hidden_dict(self) -> dict:
+        return {'Tempo': self._hidden_tempo, '$TimeSignatures': self._hidden_timesignatures}
+
+    @_hidden_dict.setter
+    def _hidden_dict(self, value: dict):
+        self._hidden_tempo = value.get('Tempo')
+        self._hidden_timesignatures = value.get('$TimeSignatures')
+
+    def __copy__(self):
+        # 値はすべて書き換えずに置き換えるので、共有してよい
+        note = self.__class__.__new__(self.__class__)
+        for slot in self.__slots__:
+            setattr(note, slot, getattr(self, slot, None))
+        return note
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    def copy(self):
+        return self.__copy__()
+
+    # よく使うプロパティ ------------------------------------------------------
+
+    @property
+    def length(self) -> int:
+        value = getattr(self, '_length', None)
+        return value if isinstance(value, int) else int(self['Length'])
+
+    @length.setter
+    def length(self, x):
+        self['Length'] = x
+
+    @property
+    def notenum(self) -> int:
+        value = getattr(self, '_notenum', None)
+        return value if isinstance(value, int) else int(self['NoteNum'])
+
+    @notenum.setter
+    def notenum(self, x):
+        self['NoteNum'] = x
+
+    @property
+    def lyric(self) -> str:
+        value = getattr(self, '_lyric', None)
+        if value is None:
+            raise KeyError('Lyric')
+        return value
+
+    @lyric.setter
+    def lyric(self, x):
+        self['Lyric'] = x
+
+    @property
+    def velocity(self) -> int:
+        value = getattr(self, '_velocity', None)
+        return value if isinstance(value, int) else int(self.get('Velocity', 100))
+
+    @velocity.setter
+    def velocity(self, x: int):
+        self['Velocity'] = int(x)
+
+    @property
+    def tempo(self) -> float:
+        value = getattr(self, '_tempo', None)
+        if value is None:
+            value = self._hidden_tempo
+        return float(value)
+
+    @tempo.setter
+    def tempo(self, x):
+        self['Tempo'] = x
+
+    def _get_floats(self, key: str):
+        value = getattr(self, FIELDS[key][0], None)
+        if isinstance(value, array):
+            return list(value)
+        if isinstance(value, tuple):
+            return list(value[1])
+        return getattr(Note, key.lower()).fget(self)
+
+    @property
+    def pbw(self):
+        return self._get_floats('PBW')
+
+    @pbw.setter
+    def pbw(self, list_pbw):
+        Note.pbw.fset(self, list_pbw)
+
+    @property
+    def pby(self):
+        return self._get_floats('PBY')
+
+    @pby.setter
+    def pby(self, list_pby):
+        Note.pby.fset(self, list_pby)
+
+
+def load(path: str, encoding: str = 'cp932') -> UtauPlugin:
+    """プラグイン一時ファイルを、ノートを CompactNote にして読み込む (utaupy.utauplugin.load と同じ)
+    """
+    try:
+        with open(path, encoding=encoding) as f:
+            s = f.read().strip()
+    except UnicodeDecodeError:
+        with open(path, encoding='utf-8_sig') as f:
+            s = f.read().strip()
+    plugin = UtauPlugin()
+    pool = {}
+    for section in s.split('[#')[1:]:
+        lines = f'[#{section.strip()}'.split('\n')
+        tag = lines[0]
+        if tag == '[#VERSION]':
+            plugin.version = lines[1].replace(' ', '').lower().replace('ustversion', '')
+            continue
+        if tag not in SPECIAL_TAGS:
+            note = CompactNote.from_lines(tag, lines[1:], pool)
+            # ノート長と音程を整数にする (utaupy と同じ丸め方)
+            for key, rounding in (('Length', ROUND_HALF_EVEN), ('NoteNum', ROUND_HALF_UP)):
+                if isinstance(getattr(note, FIELDS[key][0], None), str):
+                    note[key] = int(Decimal(note[key]).quantize(Decimal(0), rounding=rounding))
+            plugin.notes.append(note)
+            continue
+        # ノート以外は utaupy と同じように読む
+        note = Note(tag=tag)
+        if tag == '[#SETTING]':
+            del note['Length']
+            del note['NoteNum']
+            note.update(plugin.setting)
+            plugin.setting = note
+        elif tag == '[#PREV]':
+            plugin.previous_note = note
+        elif tag == '[#NEXT]':
+            plugin.next_note = note
+        elif tag == '[#TRACKEND]':
+            del note['Length']
+            del note['NoteNum']
+            plugin.trackend = note
+        for line in lines[1:]:
+            key, value = line.split('=', 1)
+            note[key] = value
+    # 各ノートのテンポと拍子 (utaupy と同じく、途中で変わらなければ前のノートの値にする)
+    # pylint: disable=protected-access
+    for key, slot in (('Tempo', '_hidden_tempo'), ('$TimeSignatures', '_hidden_timesignatures')):
+        if not plugin.notes:
+            break
+        if key in plugin.notes[0]:
+            plugin.setting[key] = plugin.notes[0][key]
+        current = plugin.setting.get(key)
+        if plugin.previous_note is not None:
+            plugin.previous_note._hidden_dict[key] = plugin.previous_note.get(key, current)
+        for note in plugin.notes:
+            current = note.get(key, current)
+            setattr(note, slot, current)
+        if plugin.next_note is not None:
+            plugin.next_note._hidden_dict[key] = plugin.next_note.get(key, current)
+    return plugin
+
+
+def run(your_function: Callable, option=None, path=None):
+    """utaupy.utauplugin.run と同じように、ノートを CompactNote にして実行する
+    """
+    if path is None:
+        path = argv[1]
+    plugin = load(path)
+    if option is None:
+        your_function(plugin)
+    else:
+        your_function(plugin, option)
+    # 拡張子がustの時は、プラグインとしてではなくUSTとして上書き保存する。
+    if splitext(path)[1] in ['.ust', '.UST']:
+        plugin.as_ust().write(path)
+    else:
+        # ノートを複製せずに書き出す
+        with open(path, 'w', encoding='cp932') as f:
+            f.write(str(plugin) + '\n')
+
+
+def _benchmark(n_notes: int = 100000):
+    """n_notes ノートの一時ファイルを読み込んだときのメモリ使用量と時間を utaupy と比べる
+    """
+    # pylint: disable=import-outside-toplevel
+    import gc
+    import time
+    import tracemalloc
+    from os import remove
+    from tempfile import NamedTemporaryFile
+
+    from utaupy import utauplugin
+
+    lines = ['[#VERSION]', 'UST Version1.2', '[#SETTING]', 'Tempo=120.00', 'Mode2=True']
+    for i in range(n_notes):
+        lines += [f'[#{i:04d}]', f'Length={(i % 4 + 1) * 120}', f'Lyric={"あいうえおR"[i % 6]}',
+                  f'NoteNum={60 + i % 12}', 'PreUtterance=', 'VoiceOverlap=', 'Intensity=100',
+                  'Modulation=0', 'PBS=-40;0', f'PBW=50,{i % 80}', 'PBY=-3.5,0', 'PBM=,s',
+                  'Flags=g-5B50', 'Envelope=0,5,35,0,100,100,0', 'StartPoint=0']
+    with NamedTemporaryFile('w', encoding='cp932', suffix='.tmp', delete=False) as f:
+        f.write('\n'.join(lines) + '\n')
+    for name, loader in (('utaupy', utauplugin.load), ('compact', load)):
+        gc.collect()
+        t_start = time.perf_counter()
+        plugin = loader(f.name)
+        elapsed = time.perf_counter() - t_start
+        del plugin
+        gc.collect()
+        tracemalloc.start()
+        plugin = loader(f.name)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{name:8s}: {current / 2**20:6.1f} MiB (peak {peak / 2**20:6.1f} MiB), '
+              f'load {elapsed:.2f} s, {len(plugin.notes)} notes')
+        del plugin
+    remove(f.name)
+
+
+if __name__ == '__main__':
+    _benchmark()
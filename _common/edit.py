@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+ノートの挿入・削除・分割をまとめて反映する
+
+ノート列をたどりながら挿入すると、そのたびに後ろのノートがずれて O(ノート数^2) になり、
+インデックスもずれてしまう。そこで編集内容は編集前のインデックスで記録だけしておき、
+最後に1回たどって新しいノート列を作る。
+"""
+
+from _common.note import clone_note
+
+# 新規ノートのタグ
+INSERT_TAG = '[#INSERT]'
+
+
+class NoteEditBuffer:
+    """ノート列への挿入・削除・分割を記録しておき、apply() でまとめて反映する
+
+    位置はすべて編集前のノート列のインデックスで指定する。apply() するまでノート列の並びは変わらない。
+    同じ位置への挿入は記録した順に並ぶ。
+    """
+
+    def __init__(self, notes: list):
+        self.notes = notes
+        self.inserted_before = {}
+        self.inserted_after = {}
+        self.deleted = set()
+
+    def insert_before(self, i: int, *new_notes):
+        """i 番目のノートの前にノートを挿入する
+        """
+        for note in new_notes:
+            note.tag = INSERT_TAG
+        self.inserted_before.setdefault(i, []).extend(new_notes)
+
+    def insert_after(self, i: int, *new_notes):
+        """i 番目のノートの後ろにノートを挿入する
+        """
+        for note in new_notes:
+            note.tag = INSERT_TAG
+        self.inserted_after.setdefault(i, []).extend(new_notes)
+
+    def delete(self, i: int):
+        """i 番目のノートを [#DELETE] にする
+        """
+        self.deleted.add(i)
+
+    def split(self, i: int, lengths) -> list:
+        """i 番目のノートを lengths の長さに分割する
+
+        最初の部分は元のノートの長さを変えて使い、残りは clone_note() で複製して後ろに挿入する。
+        長さはすぐに変わる。分割後のノートを返すので、歌詞などは呼び出し側で変える。
+        """
+        note = self.notes[i]
+        lengths = list(lengths)
+        new_notes = []
+        for length in lengths[1:]:
+            new_note = clone_note(note)
+            new_note.length = length
+            new_notes.append(new_note)
+        note.length = lengths[0]
+        self.insert_after(i, *new_notes)
+        return [note] + new_notes
+
+    def apply(self) -> list:
+        """記録した編集を反映したノート列を返す。記録は空にする。
+        """
+        new_notes = []
+        for i, note in enumerate(self.notes):
+            if i in self.inserted_before:
+                new_notes += self.inserted_before[i]
+            if i in self.deleted:
+                note.delete()
+            new_notes.append(note)
+            if i in self.inserted_after:
+                new_notes += self.inserted_after[i]
+        self.inserted_before = {}
+        self.inserted_after = {}
+        self.deleted = set()
+        return new_notes
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+ENUNU で歌わせるための前処理
+
+ノートごとの変換 (歌詞すっぴんなど) を順に適用しながら、
+促音の結合・休符の連結・最後の休符の追加を同じループの中で行う。
+結果は、それぞれの処理を全ノートに1つずつ順番に適用したときと同じになる。
+
+同じ曲を少しずつ直しながら何度も実行することが多いので、休符で区切ったフレーズごとに
+処理結果をファイルに保存しておき、変更がなかったフレーズは保存した結果を使う。
+"""
+
+import json
+from hashlib import sha1
+from os import replace
+from os.path import exists
+
+import utaupy
+
+from _common.lyric import LyricNormalizer
+
+# ブレスや語尾音素などの特殊歌詞の置換表
+D_REPLACE = {
+    'ゔ': 'ヴ',
+    ' n': 'ん', ' s': ' す', ' t': ' っ', ' k': ' っ', ' p': ' っ',
+    ' h': ' R', ' -': ' R',
+    '息': 'R', 'ぶれす': 'R', 'br': 'R',
+    'づ': 'ず', 'を': 'お'
+}
+NORMALIZER = LyricNormalizer(D_REPLACE)
+
+# 最後に追加する休符の長さ
+APPENDED_REST_LENGTH = 480
+# フレーズごとの処理結果を保存するときの形式。処理内容を変えたら増やす。
+CACHE_VERSION = 1
+# 保存しておくフレーズ数の上限。超えたら使われていない順に消す。
+MAX_CACHED_PHRASES = 10000
+
+
+def suppin_lyric(note):
+    """
+    歌詞を全角ひらがなにしてから特殊歌詞を置換し、平仮名以外の文字を削除する。
+    """
+    note.lyric = NORMALIZER.normalize(note.lyric)
+
+
+def join_cl(note, previous_note):
+    """
+    歌詞が「っ」だった場合、次の処理を行う。
+    1. そのノートを [#DELETE] にする
+    2. そのノート長を 直前のノート長に加算する
+    3. 直前のノートの歌詞に「っ」を追加する
+    """
+    note.delete()
+    previous_note.length += note.length
+    previous_note.lyric += 'っ'
+
+
+def join_R(note, next_note):
+    """
+    休符が連続しているときに、前の休符を後ろの休符に結合する。
+    """
+    if note.lyric == 'R' and next_note.lyric == 'R':
+        # 直後の休符を伸ばす
+        next_note.length += note.length
+        # 今の休符を削除 ([#DELETE] にする)
+        note.delete()
+
+
+def preprocess(notes: list, transforms=(suppin_lyric,), cl=False, rests=True, append=True):
+    """
+    ノートを1回たどるだけで前処理をする。破壊的処理。
+
+    transforms: ノートごとに順に適用する変換
+    cl        : 促音を前の音符に結合するかどうか
+    rests     : 休符を連結するかどうか
+    append    : 最後に休符がなかったら休符を追加するかどうか
+    """
+    n = len(notes)
+    # 先頭の促音は最後のノートに結合される (notes[-1] が直前のノートになるため)。
+    # 最後のノートの変換が終わるまで、結合する長さを覚えておく。
+    carried_length = None
+    for i, note in enumerate(notes):
+        for transform in transforms:
+            transform(note)
+        if i == n - 1 and carried_length is not None:
+            note.length += carried_length
+            note.lyric += 'っ'
+        if cl and note.lyric == 'っ':
+            if i == 0 and n > 1:
+                note.delete()
+                carried_length = note.length
+            else:
+                join_cl(note, notes[i - 1])
+        # 後ろのノートの促音結合が終わると歌詞と長さが確定するので、2つ前の組から休符を連結する
+        if rests and i >= 2:
+            join_R(notes[i - 2], notes[i - 1])
+    if rests and n >= 2:
+        join_R(notes[n - 2], notes[n - 1])
+    if append:
+        append_R(notes)
+
+
+def append_R(notes: list):
+    """
+    最後が休符じゃなかったら追加
+    """
+    if notes[-1].lyric != 'R':
+        new_note = utaupy.ust.Note()
+        new_note.lyric = 'R'
+        new_note.length = APPENDED_REST_LENGTH
+        notes.append(new_note)
+
+
+def split_phrases(lyrics: list) -> list:
+    """
+    すっぴん化したあとの歌詞をもとに、休符の手前でノート列を区切る。
+    (開始位置, 終了位置) のリストを返す。
+
+    最初のフレーズ以外は休符 (の連続) で始まるので、促音の結合と休符の連結はフレーズをまたがない。
+    """
+    bounds = [i for i in range(1, len(lyrics)) if lyrics[i] == 'R' and lyrics[i - 1] != 'R']
+    bounds = [0] + bounds + [len(lyrics)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def fingerprint(notes: list, salt: str) -> str:
+    """
+    フレーズの歌詞・ノート長・音高・テンポから、変更を検出するための値を作る。
+    """
+    h = sha1(salt.encode('utf-8'))
+    for note in notes:
+        h.update(json.dumps([note.lyric, note.length, note.notenum, note.get('Tempo')],
+                            ensure_ascii=False).encode('utf-8'))
+    return h.hexdigest()
+
+
+def load_cache(path_cache: str) -> dict:
+    """
+    保存したフレーズごとの処理結果を読み込む。読めないときは空にする。
+    """
+    if not exists(path_cache):
+        return {}
+    try:
+        with open(path_cache, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(path_cache: str, cache: dict):
+    """
+    フレーズごとの処理結果を保存する。上限を超えた分は使われていない順に消す。
+    """
+    keys = list(cache)[-MAX_CACHED_PHRASES:]
+    path_temp = f'{path_cache}.tmp'
+    with open(path_temp, 'w', encoding='utf-8') as f:
+        json.dump({key: cache[key] for key in keys}, f, ensure_ascii=False)
+    # 書き込み中に止まっても壊れないように、書き終わってから置き換える
+    replace(path_temp, path_cache)
+
+
+def preprocess_cached(notes: list, path_cache: str, cl=False) -> int:
+    """
+    preprocess() と同じ処理を、変更があったフレーズだけ行う。破壊的処理。
+
+    休符で区切ったフレーズごとに、処理前のノートから作った値をキーにして処理結果を保存しておく。
+    処理結果を使いまわしたフレーズの数を返す。
+    """
+    lyrics = [NORMALIZER.normalize(note.lyric) for note in notes]
+    # 先頭の促音は最後のノートに結合されるので、フレーズに分けずに処理する
+    if len(notes) == 0 or (cl and lyrics[0] == 'っ'):
+        preprocess(notes, cl=cl)
+        return 0
+    cache = load_cache(path_cache)
+    salt = json.dumps([CACHE_VERSION, cl, D_REPLACE], ensure_ascii=False)
+    n_hits = 0
+    for start, end in split_phrases(lyrics):
+        phrase = notes[start:end]
+        key = fingerprint(phrase, salt)
+        if key in cache:
+            # 使われた順に並ぶように、いったん取り出して最後に入れなおす
+            results = cache.pop(key)
+            for note, (lyric, length, deleted) in zip(phrase, results):
+                note.lyric = lyric
+                note.length = length
+                if deleted:
+                    note.delete()
+            n_hits += 1
+        else:
+            preprocess(phrase, cl=cl, append=False)
+            results = [[note.lyric, note.length, note.tag == '[#DELETE]'] for note in phrase]
+        cache[key] = results
+    append_R(notes)
+    save_cache(path_cache, cache)
+    return n_hits
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+使うときまで読み込まないモジュール
+
+プラグインによっては、メニューを出して入力を待つだけの間にも utaupy や numpy を読み込んでいる。
+lazy_import で読み込んだモジュールは、最初に属性を使ったときに実行される。
+from-import や、関数定義時に評価される型注釈で属性を使うと、その時点で読み込まれるので注意。
+"""
+
+import sys
+from importlib.util import LazyLoader, find_spec, module_from_spec
+
+
+def lazy_import(name: str):
+    """モジュールを、最初に属性を使ったときに読み込むようにして返す
+
+    すでに読み込まれているときはそのまま返す。見つからなければ ModuleNotFoundError にする。
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    spec.loader = LazyLoader(spec.loader)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
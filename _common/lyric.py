@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+歌詞すっぴん化の処理
+
+次の処理を1つの関数にまとめる。結果は従来の処理と完全に一致する。
+    1. 半角カタカナを全角にしてから、カタカナをひらがなにする (jaconv.h2z, jaconv.kata2hira)
+    2. ブレスや語尾音素などの特殊歌詞を置換する
+    3. 平仮名以外の文字を削除する
+
+文字の変換は変換表 (str.translate) と正規表現にあらかじめまとめておく。
+1曲の中で歌詞の種類は少ないので、同じ歌詞の結果は使いまわす。
+"""
+
+import re
+from functools import lru_cache
+
+import jaconv
+
+# 結果を覚えておく歌詞の種類の数
+CACHE_SIZE = 4096
+
+# すっぴん化で残す文字 (ぁ～ん)
+HIRAGANA_PATTERN = re.compile('[^ぁ-ん]')
+
+# 変換表を作るときに調べる文字の範囲 (全角のカタカナとひらがな、半角カタカナ)
+KANA_RANGES = (range(0x3000, 0x3100), range(0xFF00, 0xFFF0))
+HANKAKU_DAKUTEN = ('ﾞ', 'ﾟ')
+
+
+def _h2z_kata2hira(text: str) -> str:
+    """従来の処理と同じ変換。変換表を作るときに使う。
+    """
+    return jaconv.kata2hira(jaconv.h2z(text, kana=True, ascii=False, digit=False))
+
+
+def _overlaps(left: str, right: str) -> bool:
+    """left の末尾と right の先頭が重なりうるかどうか
+    """
+    return any(left.endswith(right[:i]) for i in range(1, len(right)))
+
+
+def _is_single_pass_safe(items) -> bool:
+    """置換を1回の正規表現でまとめて行っても、順番に str.replace するのと結果が同じかどうか
+
+    置換前の文字列同士が重なるときや、置換後の文字列が後の置換の対象になりうるときは False。
+    """
+    keys = [key for key, _ in items]
+    for a in keys:
+        for b in keys:
+            if a != b and (a in b or _overlaps(a, b)):
+                return False
+    for i, (_, value) in enumerate(items):
+        for key, _ in items[i + 1:]:
+            if value == '' and len(key) > 1:
+                return False
+            if value != '' and (key in value or value in key
+                                or _overlaps(value, key) or _overlaps(key, value)):
+                return False
+    return True
+
+
+class LyricNormalizer:
+    """歌詞を全角ひらがなにしてからすっぴん化する
+
+    replacements: 特殊歌詞の置換表。従来どおり、辞書の順に置換したのと同じ結果になる。
+    normalize(lyric) ですべての処理を行う。同じ歌詞の結果は覚えておく。
+    """
+
+    def __init__(self, replacements: dict):
+        # 半角の濁音・半濁音は2文字で1文字になるので、先に正規表現でまとめて変換する
+        self.dakuten = {}
+        for code in range(0xFF61, 0xFFA0):
+            for mark in HANKAKU_DAKUTEN:
+                pair = chr(code) + mark
+                converted = jaconv.h2z(pair, kana=True, ascii=False, digit=False)
+                if len(converted) == 1:
+                    self.dakuten[pair] = converted
+        self.dakuten_pattern = re.compile('|'.join(map(re.escape, self.dakuten)))
+        # 残りの半角→全角とカタカナ→ひらがなは、1文字ずつの変換表にまとめる
+        self.kana_table = {}
+        for kana_range in KANA_RANGES:
+            for code in kana_range:
+                converted = _h2z_kata2hira(chr(code))
+                if converted != chr(code):
+                    self.kana_table[code] = converted
+        # 特殊歌詞の置換
+        self.replacements = dict(replacements)
+        items = list(self.replacements.items())
+        self.single_pass = _is_single_pass_safe(items)
+        self.replace_pattern = re.compile('|'.join(re.escape(key) for key, _ in items))
+        self.normalize = lru_cache(maxsize=CACHE_SIZE)(self._normalize)
+
+    def to_hiragana(self, lyric: str) -> str:
+        """半角カタカナを全角にしてから、カタカナをひらがなにする
+        """
+        lyric = self.dakuten_pattern.sub(lambda m: self.dakuten[m.group()], lyric)
+        return lyric.translate(self.kana_table)
+
+    def replace_special(self, lyric: str) -> str:
+        """ブレスや語尾音素などの特殊歌詞を置換する
+        """
+        if len(self.replacements) == 0:
+            return lyric
+        if self.single_pass:
+            return self.replace_pattern.sub(lambda m: self.replacements[m.group()], lyric)
+        # 置換の結果が後の置換に影響するときは、従来どおり順番に置換する
+        for key, value in self.replacements.items():
+            lyric = lyric.replace(key, value)
+        return lyric
+
+    @staticmethod
+    def suppin(lyric: str) -> str:
+        """平仮名以外の文字を削除する。休符は R にする。消えてしまったときは元の歌詞を返す。
+        """
+        if 'R' in lyric:
+            return 'R'
+        return HIRAGANA_PATTERN.sub('', lyric) or lyric
+
+    def _normalize(self, lyric: str) -> str:
+        return self.suppin(self.replace_special(self.to_hiragana(lyric)))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+ノートの複製
+
+deepcopy はノートのすべての項目を複製するので、分割や連打のためにノートを大量に増やすと重い。
+ここでは複製元と複製先で変更前の項目を共有し、書き換えた項目だけをそれぞれが持つようにする。
+項目の値はすべて文字列なので、共有していても片方の変更がもう片方に影響することはない。
+"""
+
+from collections.abc import MutableMapping
+from copy import copy
+
+
+# 削除した項目の印
+_DELETED = object()
+
+
+class CopyOnWriteDict(MutableMapping):
+    """共有する辞書 base の上に、書き換えた項目だけを持つ辞書
+
+    base は書き換えない。書き換えた項目の辞書は、書き換えるまで作らない。
+    項目の順番は普通の辞書と同じになる (書き換えた項目は元の位置のまま、追加した項目は最後)。
+    """
+    __slots__ = ('base', 'overlay', 'added')
+
+    def __init__(self, base: dict, overlay=None, added=None):
+        self.base = base
+        # base にある項目を書き換えたもの。削除した項目は _DELETED にする。
+        self.overlay = overlay
+        # base にない項目と、削除してから追加しなおした項目 (普通の辞書と同じく最後に並ぶ)
+        self.added = added
+
+    def _in_base(self, key) -> bool:
+        if self.overlay is not None and self.overlay.get(key) is _DELETED:
+            return False
+        return key in self.base
+
+    def __getitem__(self, key):
+        if self.added is not None and key in self.added:
+            return self.added[key]
+        if not self._in_base(key):
+            raise KeyError(key)
+        if self.overlay is not None and key in self.overlay:
+            return self.overlay[key]
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        if self.added is not None and key in self.added:
+            self.added[key] = value
+        elif self._in_base(key):
+            if self.overlay is None:
+                self.overlay = {}
+            self.overlay[key] = value
+        else:
+            if self.added is None:
+                self.added = {}
+            self.added[key] = value
+
+    def __delitem__(self, key):
+        if self.added is not None and key in self.added:
+            del self.added[key]
+        elif self._in_base(key):
+            if self.overlay is None:
+                self.overlay = {}
+            self.overlay[key] = _DELETED
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.base:
+            if self.overlay is None or self.overlay.get(key) is not _DELETED:
+                yield key
+        if self.added is not None:
+            yield from self.added
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def copy(self):
+        """base を共有したまま、書き換えた項目だけを複製する
+        """
+        return CopyOnWriteDict(
+            self.base,
+            None if self.overlay is None else dict(self.overlay),
+            None if self.added is None else dict(self.added))
+
+
+def clone_note(note):
+    """ノートを複製する。複製元と複製先は、それぞれを書き換えてもお互いに影響しない。
+
+    変更前の項目は共有し、書き換えた項目だけをそれぞれが持つ。
+    """
+    # 複製元も書き換えた項目だけを持つようにして、今の項目を共有できるようにする
+    if not isinstance(note.data, CopyOnWriteDict):
+        note.data = CopyOnWriteDict(note.data)
+    # UserDict の copy は data.copy() を使う
+    new_note = copy(note)
+    new_note._hidden_dict = dict(note._hidden_dict)  # pylint: disable=protected-access
+    return new_note
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+Mode2 ピッチ点をまとめて処理する
+
+選択範囲の全ノートの PBW, PBY, PBM をそれぞれ1本の配列につなげ、ノートごとの区切り (offsets) と
+一緒に持つ。丸めや置換、不要な点の削除は配列に対してまとめて行い、最後にノートへ書き戻す。
+書き戻すときの文字列は utaupy の setter と同じ形式にする。
+
+ピッチ点同士は PBM で指定された形状でつながる。
+    ''  : 曲線 (S字)
+    's' : 直線
+    'r' : R型
+    'j' : J型
+"""
+
+import re
+
+from _common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# PBS の区切り文字 (utaupy と同じ)
+PBS_SEPARATOR = re.compile('[;,]')
+# PBS, PBY の高さ 1 あたりの cent
+CENTS_PER_HEIGHT = 10
+PBM_TO_SHAPE = {'': 0, 's': 1, 'r': 2, 'j': 3}
+
+
+class PitchPoints:
+    """全ノートのピッチ点の1項目 (PBW, PBY, PBM のどれか) をつなげた配列
+
+    values[offsets[k]:offsets[k + 1]] が notes[indices[k]] の値。
+    項目がない (または空の) ノートは含めない。PBM は文字列の配列になる。
+    """
+
+    def __init__(self, notes: list, key: str):
+        self.notes = notes
+        self.key = key
+        indices = [i for i, note in enumerate(notes) if note.get(key)]
+        strings = [notes[i][key] for i in indices]
+        self.indices = np.array(indices, dtype=int)
+        counts = [s.count(',') + 1 for s in strings]
+        self.offsets = np.concatenate([[0], np.cumsum(counts, dtype=int)])
+        items = ','.join(strings).split(',') if strings else []
+        if key == 'PBM':
+            self.values = np.array(items, dtype=str)
+        else:
+            # 空欄は 0 にする (utaupy と同じ)
+            if '' in items:
+                items = [x or '0' for x in items]
+            self.values = np.array(list(map(float, items)), dtype=float)
+
+    @property
+    def counts(self):
+        """ノートごとの点の数
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def owners(self):
+        """各点が何番目のノート (indices の位置) のものか
+        """
+        return np.repeat(np.arange(len(self.indices)), self.counts)
+
+    def counts_by_note(self):
+        """全ノートについての点の数。項目がないノートは 0 にする。
+        """
+        counts = np.zeros(len(self.notes), dtype=int)
+        counts[self.indices] = self.counts
+        return counts
+
+    def select(self, note_mask):
+        """note_mask が True のノートだけを残す。note_mask は全ノートについての真偽値。
+        """
+        keep = np.asarray(note_mask)[self.indices]
+        self.values = self.values[np.repeat(keep, self.counts)]
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts[keep], dtype=int)])
+        self.indices = self.indices[keep]
+
+    def keep_points(self, point_mask):
+        """point_mask が True の点だけを残す
+        """
+        owners = self.owners[point_mask]
+        self.values = self.values[point_mask]
+        counts = np.bincount(owners, minlength=len(self.indices))
+        self.offsets = np.concatenate([[0], np.cumsum(counts, dtype=int)])
+
+    def write_back(self):
+        """ノートに書き戻す
+        """
+        values = self.values.tolist()
+        for i, start, end in zip(self.indices.tolist(), self.offsets[:-1].tolist(),
+                                 self.offsets[1:].tolist()):
+            self.notes[i][self.key] = ','.join(map(str, values[start:end]))
+
+
+def read_pbs(notes: list):
+    """PBS をもつノートのインデックスと、(ノート数, 2) の配列を返す。2項目目がないときは 0 にする。
+    """
+    indices = [i for i, note in enumerate(notes) if note.get('PBS')]
+    pbs = np.zeros((len(indices), 2))
+    for row, i in enumerate(indices):
+        items = PBS_SEPARATOR.split(notes[i]['PBS'])
+        pbs[row, 0] = float(items[0])
+        if len(items) > 1 and items[1] != '':
+            pbs[row, 1] = float(items[1])
+    return np.array(indices, dtype=int), pbs
+
+
+def round_to_grid(values, units):
+    """values を units の倍数に丸める (round() と同じく偶数丸め)。-0.0 は 0.0 にする。
+    """
+    return np.round(values / units) * units + 0.0
+
+
+def shape_ratio(shapes, u):
+    """区間内の位置 u (0～1) での、始点から終点までの変化の割合を形状ごとに返す
+    """
+    ratio = np.array(u, dtype=float)
+    mask = shapes == 0
+    ratio[mask] = (1 - np.cos(np.pi * ratio[mask])) / 2
+    mask = shapes == 2
+    ratio[mask] = np.sin(np.pi / 2 * ratio[mask])
+    mask = shapes == 3
+    ratio[mask] = 1 - np.cos(np.pi / 2 * ratio[mask])
+    return ratio
+
+
+def interpolate(x, y, shapes, t):
+    """ピッチ点を形状どおりにつないだ曲線を時刻 t[ms] で評価する
+
+    shapes[i] は i 番目の点から始まる区間の形状番号。範囲外は最初か最後の点の高さにする。
+    """
+    t = np.asarray(t, dtype=float)
+    if len(x) == 1:
+        return np.full(t.shape, y[0])
+    idx = np.clip(np.searchsorted(x, t, side='right') - 1, 0, len(x) - 2)
+    x_start, x_end = x[idx], x[idx + 1]
+    width = x_end - x_start
+    # 区間内の位置を0～1にする。幅0の区間は終点の高さにする。
+    u = np.divide(t - x_start, width, out=np.ones_like(t), where=width > 0)
+    u = np.clip(u, 0, 1)
+    return y[idx] + (y[idx + 1] - y[idx]) * shape_ratio(shapes[idx], u)
+
+
+def segment_values(x, y, shapes, a, b, t):
+    """点 a から点 b までを1つの区間としてつないだ曲線を時刻 t[ms] で評価する
+
+    区間の形状は、点 b で終わる区間の形状 shapes[b - 1] を使う。a, b, t は同じ長さの配列。
+    範囲外は端の点の高さにする。
+    """
+    width = x[b] - x[a]
+    u = np.divide(t - x[a], width, out=np.ones_like(t), where=width > 0)
+    u = np.clip(u, 0, 1)
+    return y[a] + (y[b] - y[a]) * shape_ratio(shapes[b - 1], u)
+
+
+def simplify_curves(x, y, shapes, firsts, lasts, t, curve,
+                    tolerance: float, ms_tolerance: float):
+    """複数の曲線のピッチ点を、曲線の形がほとんど変わらない範囲で間引く (Ramer-Douglas-Peucker)
+
+    x, y, shapes : 全曲線のピッチ点の時刻[ms]、高さ、各点から始まる区間の形状番号。
+                   時刻は曲線ごとにずらして、全体で単調増加にしておく。
+    firsts, lasts: 各曲線の最初と最後の点のインデックス
+    t, curve     : 全曲線の、ずれを調べる時刻 (x と同じくずらしたもの。ピッチ点の時刻を含む) と元の曲線の値
+    tolerance    : 高さの許容誤差 (PBY と同じ単位)
+    ms_tolerance : 時間方向の許容誤差[ms]。この範囲でずらせば tolerance に収まる点は許容する。
+    残す点を True にした配列を返す。最初と最後の点は必ず残す。
+
+    分けた区間は1つずつではなく、段ごとに全曲線の分をまとめて調べる。
+    1つの区間は単調なので、時間方向にずらしたときの値の範囲は前後の端だけで分かる。
+    """
+    keep = np.zeros(len(x), dtype=bool)
+    keep[firsts] = keep[lasts] = True
+    a, b = firsts, lasts
+    while len(a) > 0:
+        # 中間の点がない区間はそれ以上分けられない
+        inner = b - a >= 2
+        a, b = a[inner], b[inner]
+        if len(a) == 0:
+            break
+        # 各区間に含まれる時刻を並べる
+        lo = np.searchsorted(t, x[a], side='left')
+        counts = np.searchsorted(t, x[b], side='right') - lo
+        starts = np.cumsum(counts) - counts
+        seg = np.repeat(np.arange(len(a)), counts)
+        idx = np.arange(len(seg)) - starts[seg] + lo[seg]
+        ts, original = t[idx], curve[idx]
+        # 点 a から点 b までを1つの区間にしたときの、時間方向にずらした範囲の値と比べる
+        before = segment_values(x, y, shapes, a[seg], b[seg], ts - ms_tolerance)
+        after = segment_values(x, y, shapes, a[seg], b[seg], ts + ms_tolerance)
+        excess = np.maximum(np.minimum(before, after) - original,
+                            original - np.maximum(before, after))
+        worst = np.maximum.reduceat(excess, starts)
+        # 区間ごとに最初に最大になった時刻
+        positions = np.flatnonzero(excess == worst[seg])
+        _, first_positions = np.unique(seg[positions], return_index=True)
+        worst_t = ts[positions[first_positions]]
+        split = worst > tolerance
+        a, b, worst_t = a[split], b[split], worst_t[split]
+        # 一番ずれたところに近い中間の点で分ける
+        j = np.clip(np.searchsorted(x, worst_t), a + 1, b - 1)
+        left = np.maximum(j - 1, a + 1)
+        k = np.where(np.abs(x[left] - worst_t) <= np.abs(x[j] - worst_t), left, j)
+        keep[k] = True
+        a, b = np.concatenate([a, k]), np.concatenate([k, b])
+    return keep
+
+
+def simplify_notes(notes: list, cent_tolerance: float, ms_tolerance: float, step_ms: float):
+    """各ノートのピッチ点を、許容誤差の範囲で間引く
+
+    PBS の点は残し、PBW は間引いた点の分を次に残る点に足す。PBY と PBM は残る点のものを使う。
+    PBY や PBM が PBW より少ないときは、足りない点を高さ 0、形状 '' として扱う。
+    削除した点の数と、間引く前後の曲線の高さのずれの最大値[cent]を返す。
+    """
+    pbw, pby, pbm = (PitchPoints(notes, key) for key in ('PBW', 'PBY', 'PBM'))
+    pby_counts, pbm_counts = pby.counts_by_note(), pbm.counts_by_note()
+    pby_starts, pbm_starts = np.zeros(len(notes), dtype=int), np.zeros(len(notes), dtype=int)
+    pby_starts[pby.indices], pbm_starts[pbm.indices] = pby.offsets[:-1], pbm.offsets[:-1]
+    pbs_indices, pbs = read_pbs(notes)
+    pbs_by_note = dict(zip(pbs_indices.tolist(), pbs.tolist()))
+    # 全ノートのピッチ点を、ノートごとに時刻をずらしてつなげる
+    targets, widths_list, xs, ys, shapes_list, ts, curves, pbm_notes = [], [], [], [], [], [], [], []
+    offset = 0.0
+    for i, start, end in zip(pbw.indices.tolist(), pbw.offsets[:-1].tolist(),
+                             pbw.offsets[1:].tolist()):
+        m = end - start
+        if m < 2:
+            continue
+        x0, y0 = pbs_by_note.get(i, (0.0, 0.0))
+        widths = pbw.values[start:end]
+        x = np.concatenate([[0.0], np.cumsum(widths)])
+        y = np.zeros(m + 1)
+        y[0] = y0
+        n = min(m, pby_counts[i])
+        y[1:n + 1] = pby.values[pby_starts[i]:pby_starts[i] + n]
+        n = min(m, pbm_counts[i])
+        pbm_note = pbm.values[pbm_starts[i]:pbm_starts[i] + n].tolist() + [''] * (m + 1 - n)
+        shapes = np.array([PBM_TO_SHAPE.get(v, 0) for v in pbm_note])
+        t = np.union1d(np.arange(0, x[-1], step_ms), x)
+        targets.append(i)
+        widths_list.append(widths)
+        xs.append(x + offset)
+        ys.append(y)
+        shapes_list.append(shapes)
+        ts.append(t + offset)
+        curves.append(interpolate(x, y, shapes, t))
+        pbm_notes.append(pbm_note)
+        # 時間方向にずらしても、となりのノートと重ならないようにあける
+        offset += x[-1] + 2 * ms_tolerance + step_ms + 1
+    if len(targets) == 0:
+        return 0, 0.0
+    lasts = np.cumsum([len(x) for x in xs]) - 1
+    firsts = np.concatenate([[0], lasts[:-1] + 1])
+    x, y, shapes = np.concatenate(xs), np.concatenate(ys), np.concatenate(shapes_list)
+    t, curve = np.concatenate(ts), np.concatenate(curves)
+    keep = simplify_curves(x, y, shapes, firsts, lasts, t, curve,
+                           cent_tolerance / CENTS_PER_HEIGHT, ms_tolerance)
+    # 間引いたあとの曲線とのずれ
+    kept = np.flatnonzero(keep)
+    seg = np.searchsorted(x[kept], t, side='right') - 1
+    seg -= np.isin(kept[seg], lasts)
+    deviation = np.max(np.abs(curve - segment_values(x, y, shapes, kept[seg], kept[seg + 1], t)))
+    # 点を削除したノートだけ書き換える
+    for i, widths, first, last, pbm_note in zip(targets, widths_list, firsts.tolist(),
+                                                lasts.tolist(), pbm_notes):
+        kept_note = np.flatnonzero(keep[first:last + 1])
+        if len(kept_note) == last - first + 1:
+            continue
+        # 残った点の間にあった PBW をまとめる
+        notes[i]['PBW'] = ','.join(map(str, np.add.reduceat(widths, kept_note[:-1]).tolist()))
+        notes[i]['PBY'] = ','.join(map(str, y[first + kept_note[1:]].tolist()))
+        notes[i]['PBM'] = ','.join(pbm_note[k - 1] for k in kept_note[1:].tolist())
+    n_removed = len(x) - len(kept)
+    return n_removed, float(deviation) * CENTS_PER_HEIGHT
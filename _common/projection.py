@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+必要な項目だけを読むプラグイン一時ファイル (UST) の読み書き
+
+utaupy.utauplugin.load はすべてのノートのすべての項目を文字列にしてから処理するので、
+1項目しか使わないプラグインでもノート数 × 項目数の分だけ時間がかかる。
+ここではファイルをメモリマップして、ノートごとには区切りの位置だけを覚えておき、
+プラグインが宣言した項目の行だけをデコードする。それ以外の項目は使われたときにデコードする。
+書き込むときは、変更がないノートは読み込んだバイト列をそのまま使い、
+変更があったノートも変更した項目の行だけを作りなおす。
+
+プラグイン一時ファイルには、項目の値だけが変わったときは変更があったノートだけを書き戻す。
+UTAU はノート番号で対応をとるので、書かなかったノートはそのまま残る。
+ノートの削除や挿入 ([#DELETE], [#INSERT]) や並べ替えをしたときは、ノート番号を失ったノートの位置を
+前後のノートで示す必要があるので、すべてのノートを書き戻す。
+何も変更がなければファイルには書き込まない。
+
+[#SETTING] はすべて読み込むが、書き戻さない。[#VERSION], [#PREV], [#NEXT], [#TRACKEND] もそのまま書き戻す。
+"""
+
+import mmap
+from copy import deepcopy
+from decimal import ROUND_HALF_EVEN, ROUND_HALF_UP, Decimal
+from os.path import splitext
+from sys import argv
+from typing import Callable
+
+from utaupy.ust import Note, Ust
+
+# ノート以外の区切り
+SPECIAL_TAGS = ('[#VERSION]', '[#SETTING]', '[#PREV]', '[#NEXT]', '[#TRACKEND]')
+# 読み込むときに整数に丸める項目 (utaupy と同じ丸め方)
+ROUNDINGS = {'Length': ROUND_HALF_EVEN, 'NoteNum': ROUND_HALF_UP}
+DELETE_TAG = '[#DELETE]'
+
+
+def _decode(value: bytes, encoding: str) -> str:
+    """文字コード encoding でデコードする。できなければ UTF-8 にする (utaupy と同じ)。
+    """
+    try:
+        return value.decode(encoding)
+    except UnicodeDecodeError:
+        return value.decode('utf-8')
+
+
+class ProjectedNote(Note):
+    """ファイル中の区切りの位置だけを持ち、使う項目だけをデコードするノート
+
+    utaupy.ust.Note と同じように使える。宣言した項目は読み込むときにデコードし、
+    それ以外の項目は初めて使うときにデコードする。
+    すべての項目を使う操作 (項目の一覧、複製、data の置き換えなど) をすると、残りの項目もデコードする。
+    """
+
+    def __init__(self, source, start: int, end: int, keys, encoding: str):
+        # Note.__init__ は初期値を入れてしまうので使わない
+        self._full = False
+        self._data = {}
+        self._source = source
+        self._encoding = encoding
+        header_end = source.find(b'\n', start, end)
+        self._header_end = end if header_end == -1 else header_end
+        self._start, self._end = start, end
+        self._newline = b'\r\n' if source[self._header_end - 1:self._header_end] == b'\r' else b'\n'
+        tag = _decode(source[start:self._header_end], encoding).strip()
+        self._data['Tag'] = tag
+        # 読み込んだ時点の項目の値
+        self._original = {'Tag': tag}
+        self._hidden_dict = {'Tempo': None}
+        for key in keys:
+            self._load(key)
+
+    @property
+    def data(self):
+        """項目の辞書。置き換えるときは、先に残りの項目をすべてデコードしておく。
+        """
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._load_all()
+        self._data = value
+
+    def _find(self, key: str):
+        """項目の値の位置 (開始位置, 終了位置) を返す。同じ項目が複数あるときは最後のものにする。
+        """
+        pattern = b'\n' + key.encode(self._encoding) + b'='
+        position = self._source.rfind(pattern, self._header_end, self._end)
+        if position == -1:
+            return None
+        start = position + len(pattern)
+        end = self._source.find(b'\n', start, self._end)
+        end = self._end if end == -1 else end
+        if self._source[end - 1:end] == b'\r':
+            end -= 1
+        return start, end
+
+    def _load(self, key: str) -> bool:
+        """まだデコードしていない項目をデコードする。ファイルにその項目があれば True を返す。
+        """
+        if key in self._data:
+            return True
+        if self._full or key in self._original:
+            return False
+        span = self._find(key)
+        if span is None:
+            return False
+        value = _decode(self._source[span[0]:span[1]], self._encoding)
+        self._original[key] = value
+        if key in ROUNDINGS:
+            value = str(int(Decimal(value).quantize(Decimal(0), rounding=ROUNDINGS[key])))
+        self._data[key] = value
+        return True
+
+    def _raw_lines(self):
+        """タグ以外の行を (項目名, 行) で返す。行は改行文字を含まない。
+        """
+        body = self._source[self._header_end + 1:self._end]
+        for line in body.split(b'\n'):
+            line = line.rstrip(b'\r')
+            if line.strip():
+                yield _decode(line.split(b'=', 1)[0], self._encoding), line
+
+    def _load_all(self):
+        """残りの項目をすべてデコードする。項目はファイルと同じ順に並べる。
+        """
+        if self._full:
+            return
+        data = {'Tag': self._data['Tag']}
+        for key, _ in self._raw_lines():
+            if key in data:
+                continue
+            if self._load(key):
+                data[key] = self._data[key]
+        for key, value in self._data.items():
+            if key not in data:
+                data[key] = value
+        self._data = data
+        self._full = True
+
+    def __getitem__(self, key):
+        self._load(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        return self._load(key)
+
+    def __setitem__(self, key, value):
+        self._load(key)
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        self._load(key)
+        del self._data[key]
+
+    def __iter__(self):
+        self._load_all()
+        return iter(self._data)
+
+    def __len__(self):
+        self._load_all()
+        return len(self._data)
+
+    def __copy__(self):
+        # 複製は普通のノートにする (項目の辞書の copy() を使うので、clone_note() の共有もそのまま働く)
+        self._load_all()
+        note = Note.__new__(Note)
+        note.data = self._data.copy()
+        note._hidden_dict = self._hidden_dict  # pylint: disable=protected-access
+        return note
+
+    def __deepcopy__(self, memo):
+        self._load_all()
+        note = Note.__new__(Note)
+        note.data = deepcopy(dict(self._data), memo)
+        note._hidden_dict = deepcopy(self._hidden_dict, memo)  # pylint: disable=protected-access
+        return note
+
+    def __str__(self):
+        self._load_all()
+        return super().__str__()
+
+    def is_modified(self) -> bool:
+        """読み込んだときから変わった項目があるかどうか
+        """
+        if self._full and len(self._data) != len(self._original):
+            return True
+        for key, value in self._data.items():
+            if key not in self._original or str(value) != self._original[key]:
+                return True
+        return any(key not in self._data for key in self._original)
+
+    def to_bytes(self) -> bytes:
+        """ファイルに書き込むバイト列にする。変更がなければ読み込んだものをそのまま返す。
+        """
+        newline = self._newline
+        if not self.is_modified():
+            raw = self._source[self._start:self._end]
+            return raw if raw.endswith(b'\n') else raw + newline
+        lines = [self._data['Tag'].replace('\n', newline.decode()).encode(self._encoding)]
+        if self._full:
+            lines += [f'{key}={value}'.encode(self._encoding)
+                      for key, value in self._data.items() if key != 'Tag']
+        else:
+            # デコードしていない行はそのまま使い、デコードした項目の行だけ作りなおす
+            written = {'Tag'}
+            for key, line in self._raw_lines():
+                if key in written or (key in self._original and key not in self._data):
+                    continue
+                if key in self._data:
+                    line = f'{key}={self._data[key]}'.encode(self._encoding)
+                    written.add(key)
+                lines.append(line)
+            lines += [f'{key}={value}'.encode(self._encoding)
+                      for key, value in self._data.items() if key not in written]
+        return newline.join(lines) + newline
+
+
+class ProjectedPlugin:
+    """必要な項目だけを読んだプラグイン一時ファイル (UST)
+
+    notes, setting, previous_note, next_note は utaupy.utauplugin.UtauPlugin と同じように使える。
+    notes は入れ替えてもよく、utaupy のノートを入れてもよい。
+    """
+    voicedir = Ust.voicedir
+
+    def __init__(self, path: str, keys, encoding: str = 'cp932'):
+        self.keys = tuple(keys)
+        self.encoding = encoding
+        self.version = None
+        self.setting = Note(tag='[#SETTING]')
+        self.setting['Tempo'] = 120
+        del self.setting['Length']
+        del self.setting['NoteNum']
+        self.previous_note = None
+        self.next_note = None
+        self.notes = []
+        with open(path, 'rb') as f:
+            try:
+                self._source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # 空のファイルはメモリマップできない
+                self._source = b''
+        self._parse()
+
+    def _sections(self):
+        """各区切りの (開始位置, 終了位置) を返す。終了位置は次の区切りの開始位置。
+        """
+        source = self._source
+        start = source.find(b'[#')
+        while start != -1:
+            end = source.find(b'\n[#', start)
+            end = len(source) if end == -1 else end + 1
+            yield start, end
+            start = -1 if end == len(source) else end
+
+    def _parse(self):
+        self._head_end = self._tail_start = None
+        for start, end in self._sections():
+            note = ProjectedNote(self._source, start, end, self.keys, self.encoding)
+            tag = note.tag
+            if tag not in SPECIAL_TAGS:
+                self.notes.append(note)
+                if self._head_end is None:
+                    self._head_end = start
+                self._tail_start = end
+            elif tag == '[#VERSION]':
+                lines = _decode(self._source[start:end], self.encoding).strip().splitlines()
+                self.version = lines[-1].replace(' ', '').lower().replace('ustversion', '')
+            elif tag == '[#SETTING]':
+                for key, value in note.items():
+                    if key not in ('Tag', 'Length', 'NoteNum'):
+                        self.setting[key] = value
+            elif tag == '[#PREV]':
+                self.previous_note = note
+            elif tag == '[#NEXT]':
+                self.next_note = note
+        if self._head_end is None:
+            self._head_end = self._tail_start = len(self._source)
+        # ノートの並びが変わったかを調べるために覚えておく
+        self._loaded_notes = list(self.notes)
+        if 'Tempo' in self.keys:
+            self._reload_tempo()
+
+    def _reload_tempo(self):
+        """各ノートのテンポを _hidden_dict['Tempo'] に入れる (utaupy と同じ)
+        """
+        # pylint: disable=protected-access
+        current = self.setting.get('Tempo')
+        if self.previous_note is not None:
+            self.previous_note._hidden_dict['Tempo'] = self.previous_note.get('Tempo', current)
+        for note in self.notes:
+            current = note.get('Tempo', current)
+            note._hidden_dict['Tempo'] = current
+        if self.next_note is not None:
+            self.next_note._hidden_dict['Tempo'] = self.next_note.get('Tempo', current)
+
+    def is_restructured(self) -> bool:
+        """読み込んだときから、ノートの並びか区切りの名前 (ノート番号) が変わったかどうか
+        """
+        if len(self.notes) != len(self._loaded_notes):
+            return True
+        if any(note is not loaded for note, loaded in zip(self.notes, self._loaded_notes)):
+            return True
+        # pylint: disable=protected-access
+        return any(note.tag != note._original['Tag'] for note in self.notes)
+
+    def is_modified(self) -> bool:
+        """読み込んだときから、ノートの並びかいずれかのノートの項目が変わったかどうか
+        """
+        return self.is_restructured() or any(note.is_modified() for note in self.notes)
+
+    def to_bytes(self, as_ust: bool = False, minimal: bool = False) -> bytes:
+        """ファイルに書き込むバイト列にする
+
+        as_ust を True にすると、USTファイルとして [#DELETE] のノートを除いてノート番号を振りなおす。
+        minimal を True にすると、変更がないノートを省く。
+        ノートの削除や挿入をしたときは、UTAU が位置を決められるように minimal でもすべて書く。
+        """
+        notes = self.notes
+        minimal = minimal and not self.is_restructured()
+        if as_ust:
+            notes = [note for note in notes if note.tag != DELETE_TAG]
+            for i, note in enumerate(notes):
+                note.tag = f'[#{str(i).zfill(4)}]'
+        chunks = [self._source[:self._head_end]]
+        for note in notes:
+            if not isinstance(note, ProjectedNote):
+                chunks.append((str(note) + '\n').encode(self.encoding))
+                continue
+            if minimal and not note.is_modified():
+                continue
+            chunks.append(note.to_bytes())
+        chunks.append(self._source[self._tail_start:])
+        return b''.join(chunks)
+
+    def close(self):
+        """メモリマップを閉じる。閉じたあとはデコードしていない項目を使えない。
+        """
+        if isinstance(self._source, mmap.mmap):
+            self._source.close()
+
+    def write(self, path: str, as_ust: bool = False) -> bool:
+        """ファイルに書き込む。読み込んだファイルに上書きできるように、先にメモリマップを閉じる。
+
+        何も変更がなければ書き込まない。プラグイン一時ファイルには、ノートの削除や挿入がなければ
+        変更があったノートだけを書く。
+        書き込んだかどうかを返す。
+        """
+        if not self.is_modified():
+            self.close()
+            return False
+        data = self.to_bytes(as_ust=as_ust, minimal=not as_ust)
+        self.close()
+        with open(path, 'wb') as f:
+            f.write(data)
+        return True
+
+
+def load(path: str, keys, encoding: str = 'cp932') -> ProjectedPlugin:
+    """プラグイン一時ファイル (UST) を、keys の項目だけデコードして読み込む
+    """
+    return ProjectedPlugin(path, keys, encoding=encoding)
+
+
+def run(your_function: Callable, keys, option=None, path=None):
+    """utaupy.utauplugin.run と同じように、プラグイン一時ファイルを読み込んで処理して上書きする
+
+    keys: プラグインが使う項目。ほかの項目も使えるが、使うたびにデコードする。
+    """
+    if path is None:
+        path = argv[1]
+    plugin = load(path, keys)
+    if option is None:
+        your_function(plugin)
+    else:
+        your_function(plugin, option)
+    # 拡張子がustの時は、プラグインとしてではなくUSTとして上書き保存する。
+    plugin.write(path, as_ust=splitext(path)[1] in ['.ust', '.UST'])
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+Mode2 ピッチ曲線を一定間隔のフレームの音高 [cent] にする
+
+各ノートの PBS, PBW, PBY, PBM を形状どおりにつなぎ、選択範囲の先頭から frame_period [ms] ごとに
+絶対音高 (ノート番号 × 100 cent) を求める。フレームの音高は、そのフレームを含むノートの曲線で決める。
+PBS が負のノートは、前のノートの終わりの部分も自分の曲線で上書きする。休符のフレームは nan にする。
+
+同じ UST を何度も調べることが多いので、ノートごとの曲線 (ノート番号からの差) を
+ピッチ項目とフレームの位置から作ったキーで保存しておき、変更がなかったノートは保存したものを使う。
+"""
+
+import json
+from hashlib import sha1
+from os import replace
+from os.path import exists
+
+from _common.lazy import lazy_import
+from _common.pitch import (CENTS_PER_HEIGHT, PBM_TO_SHAPE, PBS_SEPARATOR,
+                           segment_values)
+from _common.tempo import TempoMap
+
+np = lazy_import('numpy')
+
+# フレームの間隔 [ms]
+FRAME_PERIOD_MS = 5
+# 休符の歌詞
+REST_LYRIC = 'R'
+# 保存するときの形式。曲線の作り方を変えたら増やす。
+CACHE_VERSION = 1
+# 保存しておくノート数の上限。超えたら使われていない順に消す。
+MAX_CACHED_NOTES = 100000
+
+
+def note_points(note):
+    """ノートのピッチ点の、ノート開始位置からの時刻 [ms]、高さ、各点から始まる区間の形状番号を返す
+
+    PBW がないノートは None を返す。PBY や PBM が PBW より少ないときは、高さ 0、形状 '' とする。
+    """
+    pbw = note.get('PBW')
+    if not pbw:
+        return None
+    widths = [float(w or 0) for w in pbw.split(',')]
+    x0, y0 = 0.0, 0.0
+    if note.get('PBS'):
+        items = PBS_SEPARATOR.split(note['PBS'])
+        x0 = float(items[0])
+        if len(items) > 1 and items[1] != '':
+            y0 = float(items[1])
+    heights = [float(v or 0) for v in note['PBY'].split(',')] if note.get('PBY') else []
+    marks = note['PBM'].split(',') if note.get('PBM') else []
+    m = len(widths)
+    x = x0 + np.concatenate([[0.0], np.cumsum(widths)])
+    y = np.zeros(m + 1)
+    y[0] = y0
+    y[1:len(heights[:m]) + 1] = heights[:m]
+    shapes = np.zeros(m + 1, dtype=int)
+    shapes[:len(marks[:m])] = [PBM_TO_SHAPE.get(v, 0) for v in marks[:m]]
+    return x, y, shapes
+
+
+def note_key(note, frame_period: float, phase: float, n_frames: int) -> str:
+    """ノートの曲線を保存するときのキーを作る
+
+    phase はノートの最初のフレームの、ノート開始位置からの時刻 [ms]。
+    曲線はノート番号からの差で保存するので、ノート番号はキーに含めない。
+    """
+    fields = [note.get(key) for key in ('PBS', 'PBW', 'PBY', 'PBM')]
+    text = json.dumps([CACHE_VERSION, fields, frame_period, round(float(phase), 6), int(n_frames)])
+    return sha1(text.encode('utf-8')).hexdigest()
+
+
+def load_cache(path_cache: str) -> dict:
+    """保存したノートごとの曲線を読み込む。読めないときは空にする。
+    """
+    if not exists(path_cache):
+        return {}
+    try:
+        with np.load(path_cache) as npz:
+            return {key: npz[key] for key in npz.files}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(path_cache: str, cache: dict):
+    """ノートごとの曲線を保存する。上限を超えた分は使われていない順に消す。
+    """
+    keys = list(cache)[-MAX_CACHED_NOTES:]
+    path_temp = f'{path_cache}.tmp'
+    with open(path_temp, 'wb') as f:
+        np.savez(f, **{key: cache[key] for key in keys})
+    # 書き込み中に止まっても壊れないように、書き終わってから置き換える
+    replace(path_temp, path_cache)
+
+
+def frame_owners(notes: list, tempo_map: TempoMap, times):
+    """各フレームの音高を決めるノートのインデックス
+
+    PBS が負のノートは、その分だけ前から始まるものとする。後ろのノートを優先する。
+    """
+    starts = tempo_map.start_ms[:-1].copy()
+    for i, note in enumerate(notes):
+        if note.get('PBW') and note.get('PBS'):
+            starts[i] += min(0.0, float(PBS_SEPARATOR.split(note['PBS'])[0]))
+    # 後ろから見た最小値にすると単調増加になり、「時刻までに始まる最後のノート」を二分探索できる
+    starts = np.minimum.accumulate(starts[::-1])[::-1]
+    owners = np.searchsorted(starts, times, side='right') - 1
+    return np.clip(owners, 0, len(notes) - 1)
+
+
+def rasterize_curves(points: list, taus: list):
+    """複数のノートの曲線を、それぞれの時刻 taus[k] でまとめて評価する
+
+    points[k] は note_points() の結果。全ノートのピッチ点を時刻をずらして1本につなげ、
+    区間の形状ごとにまとめて計算する。ノートごとの値 (ピッチ点の高さの単位) のリストを返す。
+    """
+    x, y, shapes = (np.concatenate([p[k] for p in points]) for k in range(3))
+    t = np.concatenate(taus)
+    n_points = np.array([len(p[0]) for p in points])
+    n_taus = np.array([len(tau) for tau in taus])
+    lasts = np.cumsum(n_points) - 1
+    firsts = lasts - n_points + 1
+    # ノートごとに、最初の点が前のノートの最後の点の 1 ms 後になるようにずらす
+    lengths = x[lasts] - x[firsts] + 1
+    shifts = np.cumsum(lengths) - lengths - x[firsts]
+    x = x + np.repeat(shifts, n_points)
+    t = t + np.repeat(shifts, n_taus)
+    first, last = np.repeat(firsts, n_taus), np.repeat(lasts, n_taus)
+    # ノートの曲線の範囲外は、最初か最後の区間の端の高さになる
+    a = np.clip(np.searchsorted(x, t, side='right') - 1, first, last - 1)
+    values = segment_values(x, y, shapes, a, a + 1, t)
+    return np.split(values, np.cumsum([len(tau) for tau in taus])[:-1])
+
+
+def rasterize(notes: list, frame_period: float = FRAME_PERIOD_MS, cache=None):
+    """選択範囲のピッチ曲線を frame_period [ms] ごとの絶対音高 [cent] の配列にする
+
+    k 番目のフレームは、最初のノートの開始位置から k * frame_period [ms] の位置。
+    cache を渡すと、ノートごとの曲線をそこから使い、新しく作ったものを追加する。
+    音高の配列と、保存した曲線を使ったノートの数を返す。
+    """
+    if len(notes) == 0:
+        return np.array([]), 0
+    tempo_map = TempoMap(notes)
+    n_frames = int(np.ceil(tempo_map.start_ms[-1] / frame_period))
+    times = np.arange(n_frames) * frame_period
+    owners = frame_owners(notes, tempo_map, times)
+    counts = np.bincount(owners, minlength=len(notes))
+    frame_starts = np.cumsum(counts) - counts
+    cents = np.full(n_frames, np.nan)
+    misses, points, taus = [], [], []
+    n_hits = 0
+    for i, note in enumerate(notes):
+        start, count = frame_starts[i], counts[i]
+        if count == 0 or note.lyric == REST_LYRIC:
+            continue
+        base = note.notenum * 100
+        frames = slice(start, start + count)
+        tau = times[frames] - tempo_map.start_ms[i]
+        if not note.get('PBW'):
+            cents[frames] = base
+            continue
+        key = note_key(note, frame_period, tau[0], count) if cache is not None else None
+        if key is not None and key in cache:
+            # 使われた順に並ぶように、いったん取り出して最後に入れなおす
+            cache[key] = cache.pop(key)
+            cents[frames] = base + cache[key]
+            n_hits += 1
+            continue
+        misses.append((frames, base, key))
+        points.append(note_points(note))
+        taus.append(tau)
+    if misses:
+        curves = rasterize_curves(points, taus)
+        for (frames, base, key), curve in zip(misses, curves):
+            relative = curve * CENTS_PER_HEIGHT
+            cents[frames] = base + relative
+            if key is not None:
+                cache[key] = relative
+    return cents, n_hits
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+プラグインを常駐プロセスで実行する
+
+プラグインを実行するたびに python.exe を起動して utaupy などを読み込みなおすと、
+選択範囲が小さいときは実行時間のほとんどが起動にかかる。そこで、よく使うモジュールを
+読み込んだままにしておくサーバーを常駐させておき、バッチファイルからはこのファイルを
+クライアントとして起動して、プラグインのパスと一時ファイルのパスだけを渡す。
+
+    サーバー    : python _common/resident.py --serve [--no-fork]
+    クライアント: python _common/resident.py plugin_name.py [一時ファイルのパス ...]
+
+プラグインごとに組み込み用 Python と必要なライブラリが違うので、サーバーはそれを起動した python.exe の
+プラグインだけを実行する。サーバーは一時フォルダに、python.exe のパスから作った名前で
+アドレスと合言葉を書いたファイルを置く。Windows ではローカルの TCP、それ以外では Unix ソケットを使う。
+クライアントは同じ python.exe のサーバーに接続できなければ、いままでどおり自分のプロセスでプラグインを実行する。
+
+プラグインの標準入出力はソケット越しにクライアントの画面とやりとりする。環境変数はクライアントのものを使う。
+実行ごとに、fork できる環境では子プロセスで実行する。fork できない環境では、
+sys.argv, sys.path, 環境変数, 作業フォルダを戻し、実行中に読み込まれたモジュール (_common を含む) を捨てる。
+この場合は一度に1つしか実行できないので、実行中に来たリクエストは断って、クライアントに自分で実行してもらう。
+
+クライアントは起動を速くするために標準ライブラリの軽いモジュールだけを使う。
+"""
+
+import json
+import os
+import runpy
+import socket
+import sys
+import traceback
+import zlib
+from io import TextIOBase
+from os.path import abspath, dirname, join
+
+# 常駐させておくときに読み込んでおくモジュール。入っていないものは飛ばす。
+WARM_MODULES = ('utaupy', 'tqdm', 'jaconv', 'numpy')
+# サーバーのアドレスを書いておくファイルと、Unix ソケットのファイルの名前。{} は python.exe ごとの値。
+INFO_FILE = 'utau_plugins_resident_{}.json'
+SOCKET_FILE = 'utau_plugins_resident_{}.sock'
+# Unix ソケットが使えないときに使うアドレス
+TCP_HOST = '127.0.0.1'
+# サーバーに接続するときの待ち時間 [s]。超えたら自分で実行する。
+CONNECT_TIMEOUT = 0.5
+
+
+def runtime_dir() -> str:
+    """サーバーとクライアントが共有する一時フォルダ
+
+    クライアントを軽くするため tempfile は使わず、環境変数から決める。
+    """
+    for key in ('TMPDIR', 'TEMP', 'TMP'):
+        if os.environ.get(key):
+            return os.environ[key]
+    return '/tmp'
+
+
+def normalize_executable(executable: str) -> str:
+    """python.exe のパスを比べられる形にする
+    """
+    return os.path.normcase(os.path.abspath(executable))
+
+
+def server_id(executable: str = sys.executable) -> str:
+    """python.exe ごとにサーバーのファイル名を分けるための値
+    """
+    return f'{zlib.crc32(normalize_executable(executable).encode("utf-8")):08x}'
+
+
+class Channel:
+    """1行に1つの JSON をやりとりする
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.file = sock.makefile('rwb')
+
+    def send(self, message: dict):
+        """送る
+        """
+        self.file.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.file.flush()
+
+    def receive(self) -> dict:
+        """受け取る。切断されたときは空の辞書を返す。
+        """
+        line = self.file.readline()
+        if not line:
+            return {}
+        return json.loads(line.decode('utf-8'))
+
+    def close(self):
+        """閉じる
+        """
+        try:
+            self.file.close()
+        finally:
+            self.sock.close()
+
+
+class RemoteOutput(TextIOBase):
+    """プラグインの出力をクライアントに送る sys.stdout, sys.stderr の代わり
+    """
+
+    def __init__(self, channel: Channel, key: str):
+        super().__init__()
+        self.channel = channel
+        self.key = key
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if s:
+            self.channel.send({self.key: s})
+        return len(s)
+
+
+class RemoteInput(TextIOBase):
+    """クライアントの画面から1行ずつ読む sys.stdin の代わり
+    """
+
+    def __init__(self, channel: Channel):
+        super().__init__()
+        self.channel = channel
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+    def readable(self):
+        return True
+
+    def readline(self, size=-1):
+        self.channel.send({'input': True})
+        return self.channel.receive().get('line', '')
+
+
+def execute(script: str, args: list) -> int:
+    """プラグインのスクリプトを __main__ として実行し、終了コードを返す
+
+    スクリプトのフォルダを sys.path の先頭に置く (python script.py としたときと同じ)。
+    """
+    sys.argv = [script] + list(args)
+    sys.path[0] = dirname(script)
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    return 0
+
+
+def execute_isolated(request: dict, channel: Channel) -> int:
+    """リクエストのプラグインを実行する。実行前の状態に戻してから返す。
+    """
+    saved_argv, saved_path, saved_cwd = sys.argv, list(sys.path), os.getcwd()
+    saved_environ = dict(os.environ)
+    saved_modules = set(sys.modules)
+    saved_stdio = sys.stdin, sys.stdout, sys.stderr
+    sys.stdin = RemoteInput(channel)
+    sys.stdout = RemoteOutput(channel, 'out')
+    sys.stderr = RemoteOutput(channel, 'err')
+    try:
+        os.environ.clear()
+        os.environ.update(request['env'])
+        os.chdir(request['cwd'])
+        return execute(request['script'], request['args'])
+    except Exception:  # pylint: disable=broad-except
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = saved_stdio
+        sys.argv, sys.path[:] = saved_argv, saved_path
+        os.environ.clear()
+        os.environ.update(saved_environ)
+        os.chdir(saved_cwd)
+        # 実行中に読み込まれたモジュールは次の実行に残さない
+        for name in set(sys.modules) - saved_modules:
+            del sys.modules[name]
+
+
+def handle(conn: socket.socket, token: str, lock=None):
+    """1回分のリクエストを処理する
+
+    lock: fork しないときに、同時に1つだけ実行するためのロック
+    """
+    channel = Channel(conn)
+    try:
+        request = channel.receive()
+        if request.get('token') != token:
+            return
+        # ほかのプラグインの python.exe から来たときは、クライアントに自分で実行してもらう
+        if normalize_executable(request.get('executable', '')) != normalize_executable(sys.executable):
+            channel.send({'refused': sys.executable})
+            return
+        # ほかのプラグインが入力待ちなどで実行中のときも、クライアントに自分で実行してもらう
+        if lock is not None and not lock.acquire(blocking=False):
+            channel.send({'busy': True})
+            return
+        try:
+            code = execute_isolated(request, channel)
+        finally:
+            if lock is not None:
+                lock.release()
+        channel.send({'exit': code})
+    except OSError:
+        # クライアントの画面が閉じられたとき
+        pass
+    finally:
+        channel.close()
+
+
+def write_info(info: dict):
+    """サーバーのアドレスと合言葉を、本人だけが読めるファイルに書く
+    """
+    path_info = join(runtime_dir(), INFO_FILE.format(server_id()))
+    path_temp = f'{path_info}.tmp'
+    if os.path.exists(path_temp):
+        os.remove(path_temp)
+    fd = os.open(path_temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    os.replace(path_temp, path_info)
+    return path_info
+
+
+def listen():
+    """待ち受けるソケットと、クライアントに知らせる情報を返す
+    """
+    if hasattr(socket, 'AF_UNIX'):
+        address = join(runtime_dir(), SOCKET_FILE.format(server_id()))
+        if os.path.exists(address):
+            os.remove(address)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(address)
+        os.chmod(address, 0o600)
+        info = {'family': 'unix', 'address': address}
+    else:
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind((TCP_HOST, 0))
+        info = {'family': 'inet', 'address': list(server.getsockname())}
+    server.listen()
+    info['token'] = os.urandom(16).hex()
+    return server, info
+
+
+def serve(use_fork=True):
+    """よく使うモジュールを読み込んでから、リクエストを待ち続ける
+    """
+    for name in WARM_MODULES:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+    use_fork = use_fork and hasattr(os, 'fork')
+    # クライアントを軽くするため、サーバーだけで使うモジュールはここで読み込む
+    # pylint: disable=import-outside-toplevel
+    if use_fork:
+        # 終わった子プロセスを自動で片付ける
+        import signal
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    else:
+        # 実行中も次のリクエストを受け付けて断れるように、接続ごとにスレッドで処理する
+        import threading
+        lock = threading.Lock()
+    server, info = listen()
+    path_info = write_info(info)
+    print(f'プラグインの常駐サーバーを起動しました。({info["family"]}: {info["address"]})')
+    try:
+        while True:
+            conn, _ = server.accept()
+            if not use_fork:
+                threading.Thread(target=handle, args=(conn, info['token'], lock),
+                                 daemon=True).start()
+                continue
+            if os.fork() == 0:
+                server.close()
+                handle(conn, info['token'])
+                os._exit(0)  # pylint: disable=protected-access
+            conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        for path in (path_info, info['address']):
+            if isinstance(path, str) and os.path.exists(path):
+                os.remove(path)
+
+
+def connect():
+    """常駐サーバーに接続して (ソケット, 合言葉) を返す。サーバーがなければ None を返す。
+    """
+    try:
+        with open(join(runtime_dir(), INFO_FILE.format(server_id())), encoding='utf-8') as f:
+            info = json.load(f)
+        if info['family'] == 'unix':
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = info['address']
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = tuple(info['address'])
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(address)
+    except (OSError, ValueError, KeyError, AttributeError):
+        return None
+    # 実行中は入力を待つことがあるので、時間制限をなくす
+    sock.settimeout(None)
+    return sock, info['token']
+
+
+def run_remote(sock: socket.socket, token: str, script: str, args: list):
+    """常駐サーバーにプラグインを実行させて、終了コードを返す
+
+    サーバーが違う python.exe で動いているか、ほかのプラグインを実行中で断られたときは None を返す。
+    """
+    channel = Channel(sock)
+    try:
+        channel.send({'token': token, 'script': script, 'args': args, 'cwd': os.getcwd(),
+                      'env': dict(os.environ), 'executable': sys.executable})
+        while True:
+            message = channel.receive()
+            if not message:
+                raise ConnectionError('プラグインの常駐サーバーとの接続が切れました。')
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+                sys.stdout.flush()
+            elif 'err' in message:
+                sys.stderr.write(message['err'])
+                sys.stderr.flush()
+            elif 'input' in message:
+                channel.send({'line': sys.stdin.readline()})
+            elif 'exit' in message:
+                return message['exit']
+            elif 'refused' in message or 'busy' in message:
+                return None
+    finally:
+        channel.close()
+
+
+def main():
+    """サーバーとして起動するか、クライアントとしてプラグインを実行する
+    """
+    if len(sys.argv) >= 2 and sys.argv[1] == '--serve':
+        serve(use_fork='--no-fork' not in sys.argv[2:])
+        return
+    script, args = abspath(sys.argv[1]), sys.argv[2:]
+    connection = connect()
+    code = None if connection is None else run_remote(*connection, script, args)
+    if code is None:
+        # サーバーがないときは、いままでどおりこのプロセスで実行する
+        code = execute(script, args)
+    sys.exit(code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+テンポマップ
+
+ノートごとのテンポと長さから、各ノートの開始位置を Tick と ms の両方で累積しておき、
+Tick と ms を二分探索で相互に変換する。テンポはノートの途中では変わらないので、
+ノートをそのままテンポ区間として扱う。
+"""
+
+from _common.columns import NoteColumns
+from _common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# 4分音符の長さ [Tick]
+TICKS_PER_QUARTER = 480
+
+
+class TempoMap:
+    """ノート列の Tick と ms を相互に変換する
+
+    start_ticks[i], start_ms[i]: i 番目のノートの開始位置。最後の要素は全体の長さ。
+    tempos[i], ms_per_tick[i]  : i 番目のノートのテンポと、1 Tick あたりの長さ [ms]
+    segments                   : テンポが変わるノートのインデックス (最初のノートを含む)
+    """
+
+    def __init__(self, notes: list):
+        columns = NoteColumns(notes)
+        if np.any(np.isnan(columns.tempo)):
+            raise ValueError('テンポが分からないノートがあります。')
+        self.tempos = columns.tempo
+        self.ms_per_tick = 60000 / (self.tempos * TICKS_PER_QUARTER)
+        lengths = columns.length
+        self.start_ticks = np.concatenate([[0], np.cumsum(lengths)])
+        self.start_ms = np.concatenate([[0.0], np.cumsum(lengths * self.ms_per_tick)])
+        self.segments = np.flatnonzero(np.diff(self.tempos, prepend=np.nan) != 0)
+
+    def __len__(self):
+        return len(self.tempos)
+
+    def note_at_tick(self, ticks):
+        """その位置 [Tick] にあるノートのインデックス。範囲外は最初か最後のノートにする。
+        """
+        i = np.searchsorted(self.start_ticks, ticks, side='right') - 1
+        return np.clip(i, 0, len(self) - 1)
+
+    def note_at_ms(self, ms):
+        """その位置 [ms] にあるノートのインデックス。範囲外は最初か最後のノートにする。
+        """
+        i = np.searchsorted(self.start_ms, ms, side='right') - 1
+        return np.clip(i, 0, len(self) - 1)
+
+    def tick_to_ms(self, ticks):
+        """位置 [Tick] を位置 [ms] にする。配列もまとめて変換できる。
+        """
+        i = self.note_at_tick(ticks)
+        return self.start_ms[i] + (np.asarray(ticks) - self.start_ticks[i]) * self.ms_per_tick[i]
+
+    def ms_to_tick(self, ms):
+        """位置 [ms] を位置 [Tick] にする。配列もまとめて変換できる。
+        """
+        i = self.note_at_ms(ms)
+        return self.start_ticks[i] + (np.asarray(ms) - self.start_ms[i]) / self.ms_per_tick[i]
+
+    def note_value_ms(self, note_value: int):
+        """各ノートのテンポでの、note_value 分音符の長さ [ms]
+        """
+        return TICKS_PER_QUARTER * 4 / note_value * self.ms_per_tick
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+_common/compact.py で読み込んだプラグイン一時ファイルが、utaupy で読み込んだものと同じになるか確かめる
+"""
+
+import shutil
+import sys
+from os.path import abspath, dirname, join
+
+import pytest
+from utaupy import utauplugin
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path += [ROOT, join(ROOT, 'copy_all_to_flags')]
+# pylint: disable=wrong-import-position
+from _common import compact  # noqa: E402
+from copy_all_to_flags import copy_all_to_flags  # noqa: E402
+
+SAMPLE = '''\
+[#VERSION]
+UST Version1.2
+[#SETTING]
+Tempo=120.00
+Tracks=1
+Mode2=True
+[#PREV]
+Length=480
+Lyric=R
+NoteNum=60
+[#0000]
+Length=480
+Lyric=あ
+NoteNum=60
+PreUtterance=
+Velocity=100
+Intensity=100
+PBS=-40;0
+PBW=50,80
+PBY=-3.5,0
+PBM=,s
+Flags=g-5B50
+[#0001]
+Length=239.6
+Lyric=い
+NoteNum=62
+Velocity=080
+Tempo=140
+$TimeSignatures=(3/4/2)
+PBS=-20
+PBW=30
+Envelope=0,5,35,0,100,100,0
+[#0002]
+Length=960
+Lyric=R
+NoteNum=64
+[#NEXT]
+Length=480
+Lyric=う
+NoteNum=60
+'''
+
+
+@pytest.fixture(name='path')
+def fixture_path(tmp_path):
+    path = tmp_path / 'sample.tmp'
+    path.write_text(SAMPLE, encoding='cp932')
+    return str(path)
+
+
+def test_same_as_utaupy(path):
+    expected, actual = utauplugin.load(path), compact.load(path)
+    assert str(actual) == str(expected)
+    for x, y in zip(expected.notes, actual.notes):
+        assert isinstance(y, compact.CompactNote)
+        assert list(y) == list(x)
+        assert {key: y[key] for key in y} == {key: x[key] for key in x}
+        assert (y.length, y.notenum, y.lyric, y.velocity) == (x.length, x.notenum, x.lyric, x.velocity)
+        assert (y.tempo, y.timesignatures) == (x.tempo, x.timesignatures)
+        assert (y.pbs, y.pbw, y.pby, y.pbm) == (x.pbs, x.pbw, x.pby, x.pbm)
+
+
+def test_same_after_changes(path):
+    expected, actual = utauplugin.load(path), compact.load(path)
+    for x, y in zip(expected.notes, actual.notes):
+        for note in (x, y):
+            note.pbw = [1, 2.5]
+            note.pby = [0, -3]
+            note.velocity = 80
+            note.lyric = 'z'
+            note.length = 240
+            note['New'] = 'v'
+            note.flags = 'B0'
+        assert str(y) == str(x)
+        x.suppin()
+        y.suppin()
+        assert str(y) == str(x)
+
+
+def test_run_writes_same_file(path, tmp_path, capsys):
+    path_expected = str(tmp_path / 'expected.tmp')
+    shutil.copy(path, path_expected)
+    utauplugin.run(copy_all_to_flags, path=path_expected)
+    expected_stdout = capsys.readouterr().out
+    compact.run(copy_all_to_flags, path=path)
+    assert capsys.readouterr().out == expected_stdout
+    with open(path, 'rb') as f_actual, open(path_expected, 'rb') as f_expected:
+        assert f_actual.read() == f_expected.read()
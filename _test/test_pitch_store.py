@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+memorize_and_recall_pitch_pattern/pitch_store.py の memory.json の取り込みと削除を確かめる
+"""
+
+import json
+import sqlite3
+import sys
+from os.path import abspath, dirname, join
+
+import pytest
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.append(join(ROOT, 'memorize_and_recall_pitch_pattern'))
+import pitch_store  # noqa: E402 pylint: disable=wrong-import-position
+
+PATTERN = {'PBS': [-40, 0], 'PBW': [50, 80], 'PBY': [-3.5, 0], 'PBM': ['', 's']}
+# 古い memory.json に入っているもの
+LEGACY_KEYS = ['480_480_0_あ', '480_480_2_い', '480_960_-2_う']
+# 取り込む前に登録していたもの
+OLDER_KEYS = ['240_480_0_か', '240_480_1_き']
+
+
+@pytest.fixture(name='path_json')
+def fixture_path_json(tmp_path):
+    path = tmp_path / 'memory.json'
+    path.write_text(json.dumps({key: PATTERN for key in LEGACY_KEYS}, ensure_ascii=False),
+                    encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('policy', ['lru', 'lfu'])
+def test_imported_json_is_not_evicted_first(tmp_path, path_json, monkeypatch, policy):
+    clock = iter([1000.0, 2000.0])
+    monkeypatch.setattr(pitch_store.time, 'time', lambda: next(clock))
+    with pitch_store.PitchStore(str(tmp_path / 'memory.db')) as store:
+        store.upsert([(key, PATTERN) for key in OLDER_KEYS])
+        assert store.import_json(path_json) == len(LEGACY_KEYS)
+        store.evict(max_entries=len(LEGACY_KEYS), max_bytes=2 ** 40, policy=policy)
+        # 取り込んだ時点で使われたとみなすので、その前に登録して使われていないものから消える
+        assert sorted(key for key, _ in store.items()) == sorted(LEGACY_KEYS)
+
+
+def test_reopen_does_not_wait_for_writer(tmp_path, path_json):
+    path_db = str(tmp_path / 'memory.db')
+    with pitch_store.PitchStore(path_db) as store:
+        store.import_json(path_json)
+    writer = sqlite3.connect(path_db, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        # 取り込み済みなら、ほかのプロセスが書き込み中でも待たずに開ける
+        with pitch_store.PitchStore(path_db, timeout=0.1) as store:
+            assert store.import_json(path_json) == 0
+            assert len(store) == len(LEGACY_KEYS)
+    finally:
+        writer.execute('ROLLBACK')
+        writer.close()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+_common/resident.py を Unix ソケットで動かして、サーバー経由の実行と自分での実行を確かめる
+"""
+
+import os
+import subprocess
+import sys
+import time
+from os.path import abspath, dirname, join
+from shutil import copyfile
+
+import pytest
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+from _common import resident  # noqa: E402 pylint: disable=wrong-import-position
+
+RESIDENT = resident.__file__
+
+PLUGIN = '''\
+import os
+import sys
+
+import helper
+
+helper.COUNT += 1
+name = input('name? ')
+# サーバーで実行したときは、常駐させておくモジュールがもう読み込まれている
+print(name, helper.COUNT, sys.argv[1:], os.environ.get('CALLER_MARK'), os.environ.get('SERVER_MARK'),
+      'server' if 'utaupy' in sys.modules else 'cold')
+print('warn', file=sys.stderr)
+sys.exit(3)
+'''
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason='Unix ソケットで確かめる')
+
+
+@pytest.fixture(name='plugin_dir')
+def fixture_plugin_dir(tmp_path):
+    plugin_dir = tmp_path / 'plug'
+    plugin_dir.mkdir()
+    (plugin_dir / 'plug.py').write_text(PLUGIN, encoding='utf-8')
+    (plugin_dir / 'helper.py').write_text('COUNT = 0\n', encoding='utf-8')
+    return plugin_dir
+
+
+def client_env(tmp_path, **marks):
+    """クライアントの環境変数
+    """
+    env = dict(os.environ, TMPDIR=str(tmp_path), **marks)
+    env.pop('SERVER_MARK', None)
+    return env
+
+
+def client(plugin_dir, tmp_path, executable=sys.executable, **marks):
+    """クライアントを起動して、入力 alice を渡した結果を返す
+    """
+    return subprocess.run([executable, RESIDENT, str(plugin_dir / 'plug.py'), 'a.tmp'],
+                          input='alice\n', capture_output=True, text=True, encoding='utf-8',
+                          env=client_env(tmp_path, **marks), cwd=str(plugin_dir), timeout=30,
+                          check=False)
+
+
+@pytest.fixture(name='server', params=[[], ['--no-fork']], ids=['fork', 'no-fork'])
+def fixture_server(request, tmp_path):
+    env = dict(os.environ, TMPDIR=str(tmp_path), SERVER_MARK='server')
+    process = subprocess.Popen([sys.executable, RESIDENT, '--serve', *request.param],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while not any(name.endswith('.json') for name in os.listdir(tmp_path)):
+        assert time.time() < deadline, 'サーバーが起動しません。'
+        time.sleep(0.05)
+    yield request.param
+    process.terminate()
+    process.wait(timeout=30)
+
+
+def test_cold_without_server(plugin_dir, tmp_path):
+    result = client(plugin_dir, tmp_path)
+    assert result.returncode == 3
+    assert result.stdout == "name? alice 1 ['a.tmp'] None None cold\n"
+    assert result.stderr == 'warn\n'
+
+
+@pytest.mark.usefixtures('server')
+def test_remote_runs_are_isolated(plugin_dir, tmp_path):
+    for marks, caller_mark in (({'CALLER_MARK': 'first'}, 'first'), ({}, None)):
+        result = client(plugin_dir, tmp_path, **marks)
+        assert result.returncode == 3
+        # サーバーで実行していて、クライアントの環境変数を使い、前の実行の状態が残っていない
+        assert result.stdout == f"name? alice 1 ['a.tmp'] {caller_mark} None server\n"
+        assert result.stderr == 'warn\n'
+
+
+def test_concurrent_client_is_not_blocked(server, plugin_dir, tmp_path):
+    first = subprocess.Popen([sys.executable, RESIDENT, str(plugin_dir / 'plug.py'), 'a.tmp'],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             env=client_env(tmp_path), cwd=str(plugin_dir))
+    try:
+        # 1つ目のプラグインがサーバーで入力を待っている間に、2つ目を実行する
+        assert first.stdout.read(len('name? ')) == b'name? '
+        result = client(plugin_dir, tmp_path)
+        assert result.returncode == 3
+        # fork しないサーバーは実行中なので断り、クライアントが自分で実行する
+        where = 'cold' if '--no-fork' in server else 'server'
+        assert result.stdout == f"name? alice 1 ['a.tmp'] None None {where}\n"
+        stdout, _ = first.communicate(b'bob\n', timeout=30)
+        assert first.returncode == 3
+        assert stdout.decode('utf-8') == "bob 1 ['a.tmp'] None None server\n"
+    finally:
+        first.kill()
+        first.wait()
+
+
+@pytest.mark.usefixtures('server')
+@pytest.mark.parametrize('shared_info', [False, True], ids=['own-server', 'refused'])
+def test_other_python_runs_cold(plugin_dir, tmp_path, shared_info):
+    other_python = tmp_path / 'python'
+    other_python.symlink_to(sys.executable)
+    if shared_info:
+        # 別の python.exe のクライアントがこのサーバーにつないでも、実行を断られる
+        path_info = join(str(tmp_path), resident.INFO_FILE.format(resident.server_id()))
+        copyfile(path_info, join(str(tmp_path), resident.INFO_FILE.format(
+            resident.server_id(str(other_python)))))
+    result = client(plugin_dir, tmp_path, executable=str(other_python))
+    assert result.returncode == 3
+    assert result.stdout == "name? alice 1 ['a.tmp'] None None cold\n"
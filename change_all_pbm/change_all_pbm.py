@@ -3,23 +3,28 @@
 """
 選択範囲のノートのピッチ形状を一括変更する。
 """
-import itertools
+import sys
+from os.path import abspath, dirname
 
-import utaupy
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.lazy import lazy_import  # noqa: E402 pylint: disable=wrong-import-position
+from _common.pitch import PitchPoints  # noqa: E402 pylint: disable=wrong-import-position
+from _common.projection import run  # noqa: E402 pylint: disable=wrong-import-position
+
+np = lazy_import('numpy')
 
 # 「曲線」→「直線」→「R型」→「J型」→「曲線」の順に変更する。
 PBM_TOGGLE_DICT = {'': 's', 's': 'r', 'r': 'j', 'j': ''}
+# 読み込む項目
+KEYS = ('PBM',)
 
 
-def get_global_pbm_set(notes):
+def get_global_pbm_set(pbm: PitchPoints):
     """全ノート内のピッチ形状が同一か否かを返す。
     """
-    # 各ノートからピッチ形状の項目を取り出して2次元リストにする。
-    all_pbm_2d = [note.pbm for note in notes if 'PBM' in note]
-    # 1次元にする。
-    all_pbm_1d = itertools.chain.from_iterable(all_pbm_2d)
     # 選択範囲に含まれるピッチ形状の種類を列挙
-    pbm_types = set(all_pbm_1d)
+    pbm_types = set(np.unique(pbm.values).tolist())
     # 何種類あるかを返す。pbmが含まれない場合は0になるはず。
     return pbm_types
 
@@ -30,8 +35,9 @@ def change_all_pbm(plugin):
     if plugin.setting.get('Mode2') != 'True':
         raise Exception('UTAUのMode2が有効になっていません。')
 
-    notes = plugin.notes
-    pbm_set = get_global_pbm_set(notes)
+    # 全ノートのピッチ形状をつなげて、まとめて処理する
+    pbm = PitchPoints(plugin.notes, 'PBM')
+    pbm_set = get_global_pbm_set(pbm)
     len_pbm_set = len(pbm_set)
 
     # ピッチ形状の情報が選択範囲に一つもない場合は何もしない
@@ -45,10 +51,9 @@ def change_all_pbm(plugin):
         new_pbm = ''
 
     # pbmを置換
-    for note in notes:
-        if 'PBM' in note:
-            note.pbm = [new_pbm] * len(note.pbm)
+    pbm.values = np.full(len(pbm.values), new_pbm)
+    pbm.write_back()
 
 
 if __name__ == "__main__":
-    utaupy.utauplugin.run(change_all_pbm)
+    run(change_all_pbm, KEYS)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+各プラグインの起動時の import にかかる時間を測って、予算を超えていないか調べる。
+
+python -X importtime でプラグインのスクリプトを import し、そのモジュールの累積時間を
+プラグインが処理を始めるまでの時間とみなす。Python の起動時に読み込まれるモジュールは含まない。
+ばらつくので REPEAT 回測って最小値を使う。
+
+usage:
+    python check_import_time.py [プラグインのフォルダ ...]
+
+予算を超えたプラグインがあれば終了コード 1 で終わる。
+この環境に入っていないモジュールを使うプラグインは測らずに飛ばす。
+"""
+
+import re
+import subprocess
+import sys
+from glob import glob
+from os.path import basename, dirname, exists, join
+
+# プラグインごとの予算 [ms]。BUDGETS にないプラグインは DEFAULT_BUDGET_MS にする。
+DEFAULT_BUDGET_MS = 150
+BUDGETS = {
+    # 動作モードを選ぶまでは重いモジュールを読み込まない
+    'memorize_and_recall_pitch_pattern': 60,
+}
+# 1つのプラグインを測る回数
+REPEAT = 5
+# -X importtime の出力行: import time: self [us] | cumulative | imported package
+IMPORTTIME_LINE = re.compile(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)\s*$')
+
+
+def find_entry_point(plugin_dir: str):
+    """プラグインのスクリプトのパスを返す。見つからなければ None を返す。
+
+    フォルダ名と同じ名前のスクリプトを使う。なければ、フォルダにスクリプトが1つだけのときそれを使う。
+    """
+    plugin_dir = plugin_dir.rstrip('/\\')
+    path = join(plugin_dir, f'{basename(plugin_dir)}.py')
+    if exists(path):
+        return path
+    scripts = glob(join(plugin_dir, '*.py'))
+    if len(scripts) == 1:
+        return scripts[0]
+    return None
+
+
+def measure_once(path_script: str):
+    """スクリプトを1回 import して、その累積時間 [ms] を返す。import できなければ例外にする。
+    """
+    module_name = basename(path_script)[:-len('.py')]
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        cwd=dirname(path_script), capture_output=True, text=True, encoding='utf-8', check=False)
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        # インデントなしの行が、-c から直接 import したモジュール
+        if match and match.group(3) == ' ' and match.group(4) == module_name:
+            return int(match.group(2)) / 1000
+    raise ImportError(f'{module_name} の import time が見つかりません。')
+
+
+def measure(path_script: str) -> float:
+    """REPEAT 回測った最小値 [ms] を返す
+    """
+    # 1回目は .pyc を作るので数えない
+    measure_once(path_script)
+    return min(measure_once(path_script) for _ in range(REPEAT))
+
+
+def main(plugin_dirs):
+    """プラグインごとに測って表にする。予算を超えたものがあれば終了コードを 1 にする。
+    """
+    if not plugin_dirs:
+        plugin_dirs = sorted(dirname(path) for path in glob(join('*', 'plugin.txt')))
+    over_budget = []
+    for plugin_dir in plugin_dirs:
+        name = basename(plugin_dir.rstrip('/\\'))
+        budget = BUDGETS.get(name, DEFAULT_BUDGET_MS)
+        path_script = find_entry_point(plugin_dir)
+        if path_script is None:
+            print(f'  {name}: スクリプトが見つからないので飛ばします。')
+            continue
+        try:
+            elapsed = measure(path_script)
+        except ImportError as e:
+            print(f'  {name}: 読み込めないので飛ばします。({e})')
+            continue
+        mark = 'OK  ' if elapsed <= budget else 'OVER'
+        print(f'{mark} {name}: {elapsed:.1f} ms (予算 {budget} ms)')
+        if elapsed > budget:
+            over_budget.append(name)
+    if over_budget:
+        print(f'\n予算を超えたプラグイン: {", ".join(over_budget)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,8 +2,15 @@
 # Copyright (c) 2020 oatsu
 """ノートの全情報をフラグで見れるようにする
 """
-import utaupy as up
+import sys
 from copy import copy
+from os.path import abspath, dirname
+
+import utaupy as up
+
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common import compact  # noqa: E402 pylint: disable=wrong-import-position
 
 def copy_all_to_flags(plugin: up.utauplugin.UtauPlugin):
     """ノートの全情報をフラグにする
@@ -15,4 +22,4 @@ def copy_all_to_flags(plugin: up.utauplugin.UtauPlugin):
         print(note.flags)
 
 if __name__ == '__main__':
-    up.utauplugin.run(copy_all_to_flags)
+    compact.run(copy_all_to_flags)
@@ -4,36 +4,31 @@
 促音が含まれているノートを半分に割る。
 「くっ」→「く」「っ」
 """
-from copy import deepcopy
-from typing import List
+import sys
+from os.path import abspath, dirname
 
 from utaupy.utauplugin import run
-from utaupy.ust import Note
+
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.edit import NoteEditBuffer  # noqa: E402 pylint: disable=wrong-import-position
 
 
 def split_cl_note(plugin):
     """
     ノートに促音が含まれていたら分割してノートを追加し、
-    そうではなかったらそのまま複製する。
+    そうではなかったらそのまま残す。
     """
-    new_notes: List[Note] = []
-    for note in plugin.notes:
+    buffer = NoteEditBuffer(plugin.notes)
+    for i, note in enumerate(plugin.notes):
         if 'っ' in note.lyric:
-            # 半分にした時の長さが2.5とかになった時は2.6を経由して3にする
-            new_note = deepcopy(note)
+            # 半分にした時の長さが2.5とかになった時は、前半は2.6を経由して3に、後半は2.4を経由して2にする
+            new_note, cl_note = buffer.split(
+                i, (round(note.length / 2 + 0.01), round(note.length / 2 - 0.01)))
             new_note.lyric = new_note.lyric.replace('っ', '')
-            new_note.length = round(new_note.length / 2 + 0.01)
-            # 半分にした時の長さが2.5とかになった時は2.4を経由して2にする
-            cl_note = deepcopy(note)
             cl_note.lyric = 'っ'
-            cl_note.length = round(cl_note.length / 2 - 0.01)
-            cl_note.tag = '[#INSERT]'
-            # ノートを追加
-            new_notes.append(new_note)
-            new_notes.append(cl_note)
-        else:
-            new_notes.append(note)
-    plugin.notes = new_notes
+    # ノートの追加をまとめて反映
+    plugin.notes = buffer.apply()
 
 
 if __name__ == '__main__':
@@ -3,20 +3,33 @@
 """
 音程をもとにノートの歌詞を設定する。
 """
-from utaupy.utauplugin import run
+import sys
+from os.path import abspath, dirname
+
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.columns import NoteColumns  # noqa: E402 pylint: disable=wrong-import-position
+from _common.lazy import lazy_import  # noqa: E402 pylint: disable=wrong-import-position
+from _common.projection import run  # noqa: E402 pylint: disable=wrong-import-position
+
+np = lazy_import('numpy')
 
 MOD12NOTENUM_TO_LYRIC = (
     'ど', 'れ', 'れ', 'み', 'み', 'ふぁ', 'そ', 'そ', 'ら', 'ら', 'し', 'し'
 )
+# 読み込む項目
+KEYS = ('NoteNum', 'Lyric')
 
 
 def main(plugin):
     """音高をもとに歌詞を決める。
     """
-    for note in plugin.notes:
+    columns = NoteColumns(plugin.notes)
+    lyrics = np.array(MOD12NOTENUM_TO_LYRIC)[columns.notenum % 12]
+    for note, lyric in zip(plugin.notes, lyrics.tolist()):
         if 'R' not in note.lyric:
-            note.lyric = MOD12NOTENUM_TO_LYRIC[note.notenum % 12]
+            note.lyric = lyric
 
 
 if __name__ == "__main__":
-    run(main)
+    run(main, KEYS)
@@ -21,14 +21,16 @@ usage:
     python open_voicebank_readme.py hogehoge.tmp
 """
 
-from glob import glob
-from os import startfile
-from os.path import exists, join
-from tempfile import TemporaryFile
+import sys
+from os.path import abspath, dirname, exists, join
 from typing import Union
 
 import utaupy
 
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common import compact, projection  # noqa: E402 pylint: disable=wrong-import-position
+
 
 def utf8_to_cp932(path):
     """
@@ -39,6 +41,8 @@ def utf8_to_cp932(path):
         try:
             with open(path, 'r', encoding='utf8') as f:
                 s = f.read()
+            # UTF-8 のファイルがあったときだけ使うので、ここで読み込む
+            from tempfile import TemporaryFile  # pylint: disable=import-outside-toplevel
             with TemporaryFile('w', encoding='cp932') as f:
                 f.write(s)
             with open(path, 'w', encoding='cp932') as f:
@@ -72,12 +76,17 @@ def repair_mojibake_lyrics(plugin):
     path_ust = plugin.setting.get('Project')
     if (path_ust is not None) and exists(path_ust):
         try:
-            # USTファイルの文字コードを直して上書き保存する。
-            ust = utaupy.ust.load(path_ust, encoding='utf-8')
-            # USTファイルから文字化け前の歌詞を取得する
-            ust_lyrics = [note.lyric for note in ust.notes]
+            # USTファイルから文字化け前の歌詞を取得する。歌詞以外はデコードしない。
+            projected_ust = projection.load(path_ust, ('Lyric',), encoding='utf-8')
+            ust_lyrics = [note.lyric for note in projected_ust.notes]
+            # 上書き保存できるように閉じておく
+            projected_ust.close()
             # USTファイルが文字化け歌詞で上書きされているかどうか
             ust_is_mojibaked = any(map(is_mojibake_string, ust_lyrics))
+            # 歌詞が無事なら、テンポと文字コードを直すためにUSTファイル全体を読む。
+            # 歌詞以外 (VoiceDir など) がUTF-8で読めないときは、文字化けしているときと同じ扱いにする。
+            if not ust_is_mojibaked:
+                ust = utaupy.ust.load(path_ust, encoding='utf-8')
         # USTファイルが文字化けしているとそもそも開けないのを回避
         except UnicodeDecodeError:
             ust_is_mojibaked = True
@@ -91,6 +100,7 @@ def repair_mojibake_lyrics(plugin):
             fix_tempo(ust)
             ust.write(path_ust, encoding='cp932')
             print('USTファイルの文字コードを修正しました。USTファイルを開きます。')
+            from os import startfile  # pylint: disable=import-outside-toplevel,no-name-in-module
             startfile(path_ust)
 
         # USTファイルが文字化け歌詞で上書きされており手遅れな時
@@ -135,6 +145,7 @@ def main(plugin):
     path_prefix_map = join(plugin.voicedir, 'prefix.map')
     utf8_to_cp932(path_prefix_map)
     # oto.ini の文字化けを修正する
+    from glob import glob  # pylint: disable=import-outside-toplevel
     otoini_files = glob(join(plugin.voicedir, '*/**/oto.ini'), recursive=True)
     for path_otoini in otoini_files:
         utf8_to_cp932(path_otoini)
@@ -145,4 +156,5 @@ def main(plugin):
 
 
 if __name__ == '__main__':
-    utaupy.utauplugin.run(main)
+    # 全ノートを読み込むので、メモリを節約するノートにする
+    compact.run(main)
@@ -10,10 +10,13 @@ import sys
 from glob import glob
 from os import chdir
 from os.path import basename, dirname, exists, expandvars, join, relpath
-from shutil import copytree
+from shutil import copytree, ignore_patterns
 
 from send2trash import send2trash
 
+# 複数のプラグインで共有する処理のフォルダ。インストール時に各プラグインに複製する。
+COMMON_DIR = '_common'
+
 
 def pip_install_upgrade_pip(python_exe, package_name):
     r"""
@@ -125,6 +128,7 @@ def install_plugin(input_dir, dst_dir):
 
     1. インストール対象のフォルダがすでにある場合はゴミ箱に送る。
     2. プラグインをフォルダごとインストールする。
+    3. 共有する処理 (_common) をプラグインのフォルダ内に複製する。
     """
     # プラグインがインストールされたらできるフォルダ
     output_dir = join(dst_dir, basename(input_dir))
@@ -133,6 +137,10 @@ def install_plugin(input_dir, dst_dir):
         send2trash(output_dir)
     # ソースコードをインストールする
     copytree(input_dir, output_dir)
+    # 共有する処理をインストールする
+    if exists(COMMON_DIR):
+        copytree(COMMON_DIR, join(output_dir, COMMON_DIR),
+                 ignore=ignore_patterns('__pycache__'))
 
     # インストール先のパスを返す
     return output_dir
@@ -178,7 +186,9 @@ def make_wrapper_bat(plugin_installed_dir):
     r"""
     UTAUプラグインとしてちゃんと動くように、wrapper としてのバッチファイルを作成する。
     プラグインのフォルダ名とPythonスクリプト名が一致する必要がある。
-    @python-3.9.5-embed-amd64\python.exe plugin_name.py %*
+    @python-3.9.5-embed-amd64\python.exe _common\resident.py plugin_name.py %*
+
+    _common/resident.py は常駐サーバーがあればそこでプラグインを実行し、なければ自分で実行する。
     """
     # バッチファイルから見たpython.exeの相対パスを一致させるため、作業フォルダを移動する。
     chdir(plugin_installed_dir)
@@ -191,7 +201,11 @@ def make_wrapper_bat(plugin_installed_dir):
     # バッチファイルのパス
     path_bat = join(plugin_installed_dir, f'{plugin_name}.bat')
     # バッチファイルに書き込む文字列
-    s = f'{python_exe} "{plugin_name}.py" %*'
+    path_resident = join(COMMON_DIR, 'resident.py')
+    if exists(path_resident):
+        s = f'{python_exe} "{path_resident}" "{plugin_name}.py" %*'
+    else:
+        s = f'{python_exe} "{plugin_name}.py" %*'
     # バッチファイルに書き込む
     with open(path_bat, 'w', encoding='cp932') as f:
         f.write(s)
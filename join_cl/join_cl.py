@@ -4,8 +4,14 @@
 """
 「っ」を前のノートに結合する。
 """
+import sys
+from os.path import abspath, dirname
+
 import utaupy as up
-from tqdm import tqdm
+
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.edit import NoteEditBuffer  # noqa: E402 pylint: disable=wrong-import-position
 
 
 def join_cl(ust):
@@ -15,18 +21,23 @@ def join_cl(ust):
     2. そのノート長を 直前のノート長に加算する
     3. 直前のノートの歌詞に「っ」を追加する
     """
+    # 起動を速くするため、使うときに読み込む
+    from tqdm import tqdm  # pylint: disable=import-outside-toplevel
+
     notes = ust.notes
+    buffer = NoteEditBuffer(notes)
     for i, note in enumerate(tqdm(notes)):
         if note.lyric == 'っ':
             print(note)
             # 「っ」のノートを削除 ([#DELETE] にする)
-            note.delete()
+            buffer.delete(i)
             # 直前のノート
             previous_note = notes[i - 1]
             # 直前のノート長を伸ばす
             previous_note.length += note.length
             # 直前のノートの歌詞に「っ」を追加する
             previous_note.lyric += 'っ'
+    ust.notes = buffer.apply()
     return ust
 
 
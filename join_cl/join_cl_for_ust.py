@@ -7,7 +7,6 @@
 from os.path import splitext
 
 import utaupy as up
-from tqdm import tqdm
 
 
 def join_cl(ust):
@@ -17,6 +16,9 @@ def join_cl(ust):
     2. そのノート長を 直前のノート長に加算する
     3. 直前のノートの歌詞に「っ」を追加する
     """
+    # 起動を速くするため、使うときに読み込む
+    from tqdm import tqdm  # pylint: disable=import-outside-toplevel
+
     notes = ust.notes
     for i, note in enumerate(tqdm(notes)):
         if note.lyric == 'っ':
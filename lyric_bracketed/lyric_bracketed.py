@@ -5,9 +5,14 @@
 """
 
 import sys
-from os.path import dirname, join
+from os.path import abspath, dirname, join
 
-from utaupy.utauplugin import run
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.projection import run  # noqa: E402 pylint: disable=wrong-import-position
+
+# 読み込む項目
+KEYS = ('Lyric',)
 
 
 def main(plugin):
@@ -31,4 +36,4 @@ def main(plugin):
 
 
 if __name__ == '__main__':
-    run(main)
+    run(main, KEYS)
@@ -18,11 +18,17 @@
 - 子音速度を200にする
 
 """
-from copy import deepcopy
+import sys
+from os.path import abspath, dirname
 # from pprint import pprint
 
 from utaupy import utauplugin
 
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.edit import NoteEditBuffer  # noqa: E402 pylint: disable=wrong-import-position
+from _common.note import clone_note  # noqa: E402 pylint: disable=wrong-import-position
+
 
 def main(plugin: utauplugin.UtauPlugin, num: int):
     """
@@ -31,17 +37,19 @@ def main(plugin: utauplugin.UtauPlugin, num: int):
 
     num: 短いノートをいくつ増やすか
     """
-    # らららららー の「らららら」の部分用のノート
-    short_note = deepcopy(plugin.notes[0])
-    short_note.length = 60
-    short_note.tag = '[#INSERT]'
-    short_note.velocity = 200
+    # らららららー の「らららら」の部分用のノート (書き換えた項目以外は先頭ノートと共有する)
+    short_notes = [clone_note(plugin.notes[0]) for _ in range(num)]
+    for short_note in short_notes:
+        short_note.length = 60
+        short_note.velocity = 200
     # らららららー の「らー」の部分用のノート
     long_note = plugin.notes[0]
     long_note.length -= 60 * num
     long_note.velocity = 200
     # 編集前後のノートをまとめる
-    plugin.notes = [short_note] * num + [long_note] + plugin.notes[1:]
+    buffer = NoteEditBuffer(plugin.notes)
+    buffer.insert_before(0, *short_notes)
+    plugin.notes = buffer.apply()
     # pprint(plugin.notes)  # デバッグ用出力
 
 
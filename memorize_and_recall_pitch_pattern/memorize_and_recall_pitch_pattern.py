@@ -4,56 +4,125 @@
 ピッチパターンを記憶したり呼び出したりする
 """
 
-import json
-from os import remove
-from os.path import dirname, join
-from shutil import copy2
+from __future__ import annotations
 
-import utaupy
+import re
+import sys
+from contextlib import ExitStack
+from glob import glob
+from hashlib import sha1
+from os import makedirs, remove
+from os.path import abspath, basename, dirname, exists, join, splitext
+from shutil import rmtree
+from time import perf_counter
 
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.lazy import lazy_import  # noqa: E402 pylint: disable=wrong-import-position
+
+# 動作モードを選ぶまでは読み込まない。型注釈は評価しない (from __future__ import annotations)。
+np = lazy_import('numpy')
+utaupy = lazy_import('utaupy')
+note_columns = lazy_import('_common.columns')
+pitch_curve = lazy_import('pitch_curve')
+pitch_library = lazy_import('pitch_library')
+pitch_search = lazy_import('pitch_search')
+pitch_sequence = lazy_import('pitch_sequence')
+pitch_store = lazy_import('pitch_store')
+pitch_view = lazy_import('pitch_view')
+
+# 音源を問わない共通のデータベース
+DB_FILE = join(dirname(__file__), 'memory.db')
+# 音源ごとのデータベースを置くフォルダ
+SHARD_DIR = join(dirname(__file__), 'memory_shards')
+# 音源ごとのデータベースで見つからなかったときに、共通のデータベースも探すかどうか
+USE_SHARED_SHARD = True
+# 旧形式のファイル。存在すれば初回に DB_FILE へ取り込む。
 JSON_FILE = join(dirname(__file__), 'memory.json')
+# 記録内容をページに分けて出力するフォルダ
+VIEW_DIR = join(dirname(__file__), 'memory_view')
+# 選択範囲に関係するものだけを出力するファイル
 UST_FILE = join(dirname(__file__), 'memory_view.ust')
 MAX_NOTE_LENGTH = 3840
 MIN_NOTE_LENGTH = 10
+# 呼び出し時にどこまで条件を緩めるか (pitch_store.BACKOFF_LEVELS の番号)
+MAX_BACKOFF_LEVEL = 3
+# データベースごとの登録数とデータ量の上限。超えたら EVICTION_POLICY に従って削除する。
+MAX_ENTRIES = 50000
+MAX_BYTES = 200 * 1024 * 1024
+# 上限を超えたときに削除するものの選び方 (pitch_store.EVICTION_ORDER のどれか)
+#   lru: 最後に使われたのが最も古いもの
+#   lfu: 呼び出された回数が最も少ないもの
+EVICTION_POLICY = 'lru'
+# 呼び出すピッチパターンの種類 (pitch_store.RECALL_MODES のどれか)
+#   latest  : 最後に登録したもの
+#   frequent: 最もよく登録されたもの
+#   centroid: これまでに登録したものの平均の曲線
+RECALL_MODE = 'latest'
+# 前後とのつながりを考えて呼び出すときに、ノートごとに集める候補の数
+SEQUENCE_TOP_K = 8
+# 条件を1段階緩めるごとに加えるコスト。ノートの境目での音高のずれ (10 cent 単位) と比べる。
+LEVEL_COST = 10
+# 検索モードで表示する候補の数
+SEARCH_TOP_K = 5
+
+
+def open_store(path_db: str = DB_FILE) -> pitch_store.PitchStore:
+    """ピッチを記録しているデータベースを開く。
+    共通のデータベースを開くときは、旧形式のjsonファイルがあれば取り込む。
+    """
+    store = pitch_store.PitchStore(path_db)
+    if path_db == DB_FILE:
+        store.import_json(JSON_FILE)
+    return store
+
 
+def shard_path(plugin: utaupy.utauplugin.UtauPlugin):
+    """音源ごとのデータベースのパスを返す。音源が指定されていないときは None を返す。
+
+    ファイル名は音源フォルダ名と、音源フォルダのパスのハッシュ値からつくる。
+    """
+    voicedir = plugin.setting.get('VoiceDir')
+    if not voicedir:
+        return None
+    voicedir = voicedir.strip('\'"').replace('/', '\\').rstrip('\\')
+    digest = sha1(voicedir.lower().encode('utf-8')).hexdigest()[:8]
+    # %VOICE% などの置換文字列を除いた最後のフォルダ名を使う
+    name = [part for part in re.split(r'[\\%]', voicedir) if part][-1]
+    # ファイル名に使えない文字を置換する
+    name = re.sub(r'[/:*?"<>|]', '_', name)
+    return join(SHARD_DIR, f'{name}_{digest}.db')
+
+
+def open_target_store(plugin: utaupy.utauplugin.UtauPlugin) -> pitch_store.PitchStore:
+    """登録先のデータベースを開く。音源が指定されていないときは共通のデータベースを開く。
+    """
+    path_db = shard_path(plugin)
+    if path_db is None:
+        return open_store(DB_FILE)
+    makedirs(SHARD_DIR, exist_ok=True)
+    return open_store(path_db)
 
-def json2ust(path_json, path_ust):
-    """ピッチを記録しているjsonファイルの内容をUTAUで確認できるようにUSTファイルに変換する
-    """
-    with open(path_json, 'r', encoding='utf-8') as f:
-        d = json.load(f)
-    ust = utaupy.ust.Ust()
-    ust.setting['Mode2'] = True
-    ust.setting['Charset'] = 'UTF-8'
-    for key, v in d.items():
-        previous_length, length, delta_notenum, lyric = \
-            key.split('_', maxsplit=3)
-        # 音程変化を確認するための音符を追加
-        note = utaupy.ust.Note()
-        note.lyric = 'dummy'
-        note.length = previous_length
-        note.label = previous_length
-        note.notenum = 60
-        ust.notes.append(note)
-        # 本体
-        note = utaupy.ust.Note()
-        note.length = length
-        note.label = length
-        note.lyric = lyric
-        note.pbw = v['PBW']
-        note.pby = v['PBY']
-        note.pbm = v['PBM']
-        note.pbs = v['PBS']
-        note['Modulation'] = 0
-        note.notenum = 60 + int(delta_notenum)
-        ust.notes.append(note)
-        # 見た目を区切るための休符を追加
-        note = utaupy.ust.Note()
-        note.lyric = 'R'
-        note.length = 1920 - (int(previous_length) + int(length)) % 1920
-        note.notenum = 60
-        ust.notes.append(note)
-    ust.write(path_ust, encoding='utf-8')
+
+def open_search_stores(plugin: utaupy.utauplugin.UtauPlugin, stack: ExitStack) -> list:
+    """呼び出し時に探すデータベースを、探す順に開く。
+
+    音源ごとのデータベースと、必要なら共通のデータベースだけを開く。
+    開いたデータベースは stack を閉じるときに閉じる。
+    """
+    paths = []
+    path_shard = shard_path(plugin)
+    if path_shard is not None and exists(path_shard):
+        paths.append(path_shard)
+    if path_shard is None or USE_SHARED_SHARD:
+        paths.append(DB_FILE)
+    return [stack.enter_context(open_store(path_db)) for path_db in paths]
+
+
+def view_dir(store: pitch_store.PitchStore) -> str:
+    """データベースごとの確認用USTファイルのフォルダを返す
+    """
+    return join(VIEW_DIR, splitext(basename(store.path))[0])
 
 
 def generate_key(note, previous_note, max_length, min_length):
@@ -72,87 +141,325 @@ def generate_key(note, previous_note, max_length, min_length):
     return f'{previous_note_length}_{note_length}_{delta_notenum}_{note.lyric}'
 
 
-def memorize(plugin: utaupy.utauplugin.UtauPlugin):
-    """指定されたノートのピッチパターンを辞書として返す
-    辞書のキーは
+def generate_keys(notes, max_length, min_length) -> list:
+    """2番目以降の各ノートのキーをまとめて生成する
+
+    隣り合うノートすべてに generate_key() を使ったときと同じ結果になる。
+    """
+    columns = note_columns.NoteColumns(notes)
+    # 直前の音高と現在の音高の差
+    delta_notenums = np.diff(columns.notenum)
+    # 直前のノート長を丸める (round() と同じく偶数丸め)
+    previous_note_lengths = np.clip(
+        np.round(columns.length[:-1] / min_length).astype(int) * min_length,
+        min_length, max_length)
+    # 現在のノート長も generate_key() と同じく直前のノート長から求める
+    note_lengths = previous_note_lengths
+    return [f'{previous_note_length}_{note_length}_{delta_notenum}_{note.lyric}'
+            for previous_note_length, note_length, delta_notenum, note
+            in zip(previous_note_lengths.tolist(), note_lengths.tolist(),
+                   delta_notenums.tolist(), notes[1:])]
+
+
+def read_pattern(note) -> dict:
+    """ノートのピッチ情報をピッチパターンの辞書にする
+    """
+    return {
+        'PBS': note.pbs,
+        'PBW': note.pbw,
+        'PBY': note.pby,
+        'PBM': note.pbm
+    }
+
+
+def apply_pattern(note, pattern: dict):
+    """ピッチパターンをノートに適用する
+    """
+    note.pbs = pattern['PBS']
+    note.pbw = pattern['PBW']
+    note.pby = pattern['PBY']
+    note.pbm = pattern['PBM']
+
+
+def extract_patterns(notes) -> list:
+    """ノートのリストからピッチパターンを読み取って、(キー, ピッチパターン) のリストにする
+    キーは
     直前のノート長_現在のノート長_音程変化_直前の歌詞_現在の歌詞
     のようにする(暫定)
     """
-    # 既存のファイルを読み取る
-    try:
-        with open(JSON_FILE, 'r', encoding='utf-8') as f:
-            d = json.load(f)
-        copy2(JSON_FILE, JSON_FILE.replace('.json', '_backup.json'))
-    except FileNotFoundError:
-        d = {}
+    samples = []
+    # ピッチパターンを分類するときのキー
+    keys = generate_keys(notes, max_length=MAX_NOTE_LENGTH, min_length=MIN_NOTE_LENGTH)
+    for note, key in zip(notes[1:], keys):
+        # 登録に必要な情報が一つでもなければスキップ
+        if any(k not in note for k in ['PBS', 'PBW', 'PBY', 'PBM', 'Lyric', 'Length']):
+            continue
+        # ピッチパターンを記録させる内容
+        samples.append((key, read_pattern(note)))
+    return samples
+
+
+def memorize(plugin: utaupy.utauplugin.UtauPlugin):
+    """指定されたノートのピッチパターンを記録する
+    """
     # 各ノートのピッチ情報を読み取って記録していく
     if plugin.previous_note is not None:
         notes = [plugin.previous_note] + plugin.notes
     else:
         notes = plugin.notes
     # UST内からピッチパターンを読み取る
-    d_temp = {}
-    for note, previous_note in zip(notes[1:], notes[:-1]):
-        # 登録に必要な情報が一つでもなければスキップ
-        if any(k not in note for k in ['PBS', 'PBW', 'PBY', 'PBM', 'Lyric', 'Length']):
-            continue
-        # ピッチパターンを分類するときのキー
-        key = generate_key(
-            note, previous_note, max_length=MAX_NOTE_LENGTH, min_length=MIN_NOTE_LENGTH)
-        # ピッチパターンを記録させる内容
-        d_temp[key] = {
-            'PBS': note.pbs,
-            'PBW': note.pbw,
-            'PBY': note.pby,
-            'PBM': note.pbm
-        }
-    d.update(d_temp)
-    with open(JSON_FILE, 'w', encoding='utf-8') as f:
-        json.dump(d, f, sort_keys=True, indent=4, ensure_ascii=False)
-    json2ust(JSON_FILE, UST_FILE)
+    samples = extract_patterns(notes)
+    # 選択範囲の分だけ追記・上書きする
+    with open_target_store(plugin) as store:
+        store.upsert(samples)
+        rowids = store.rowids(key for key, _ in samples)
+        rowids += store.evict(MAX_ENTRIES, MAX_BYTES, EVICTION_POLICY)
+        # 変更があったページだけ確認用USTを書き直す
+        pitch_view.write_pages(store, view_dir(store), rowids)
 
 
 def recall(plugin: utaupy.utauplugin.UtauPlugin):
-    """指定されたノートのピッチパターンを辞書として返す
+    """指定されたノートに記録済みのピッチパターンを適用する
     """
-    # 既存のファイルを読み取る
-    try:
-        with open(JSON_FILE, 'r', encoding='utf-8') as f:
-            d = json.load(f)
-    except FileNotFoundError:
-        d = {}
     # 各ノートのピッチ情報を読み取って記録していく
     if plugin.previous_note is not None:
         notes = [plugin.previous_note] + plugin.notes
     else:
         notes = plugin.notes
-    # UST内からピッチパターンを読み取る
-    for note, previous_note in zip(notes[1:], notes[:-1]):
-        # ピッチ情報を検索する文字列を生成
-        key = generate_key(
-            note, previous_note, max_length=MAX_NOTE_LENGTH, min_length=MIN_NOTE_LENGTH)
-        # 一致するピッチ情報を探して登録
-        if key in d:
-            note.pbs = d[key]['PBS']
-            note.pbw = d[key]['PBW']
-            note.pby = d[key]['PBY']
-            note.pbm = d[key]['PBM']
+    # ピッチ情報を検索する文字列を生成
+    keys = generate_keys(notes, max_length=MAX_NOTE_LENGTH, min_length=MIN_NOTE_LENGTH)
+    # 一致するものがなければ条件を緩めて探す。同じキーは1回だけ検索する。
+    with ExitStack() as stack:
+        stores = open_search_stores(plugin, stack)
+        d = {key: pitch_store.lookup_stores(stores, key, max_level=MAX_BACKOFF_LEVEL,
+                                            mode=RECALL_MODE)
+             for key in set(keys)}
+    levels = []
+    for note, key in zip(notes[1:], keys):
+        level, pattern = d[key]
+        levels.append(level)
+        # 見つかったピッチ情報を登録
+        if pattern is not None:
+            apply_pattern(note, pattern)
+    report_levels(notes[1:], levels)
+
+
+def sequence_recall(plugin: utaupy.utauplugin.UtauPlugin):
+    """前後のノートとピッチ曲線がなめらかにつながるように、記録済みのピッチパターンを適用する
+
+    ノートごとに候補を SEQUENCE_TOP_K 個まで集めて、境目での音高のずれと
+    条件を緩めた段階の合計が最小になる組み合わせを選ぶ。
+    """
+    if plugin.previous_note is not None:
+        notes = [plugin.previous_note] + plugin.notes
+    else:
+        notes = plugin.notes
+    keys = generate_keys(notes, max_length=MAX_NOTE_LENGTH, min_length=MIN_NOTE_LENGTH)
+    # 選択範囲の前後のノートは今のピッチのまま、つながりだけを考える
+    chain = notes + ([plugin.next_note] if plugin.next_note is not None else [])
+    with ExitStack() as stack:
+        stores = open_search_stores(plugin, stack)
+        found = {key: pitch_store.candidates_stores(stores, key, SEQUENCE_TOP_K,
+                                                    max_level=MAX_BACKOFF_LEVEL, mode=RECALL_MODE)
+                 for key in set(keys)}
+        candidates = [[(0.0, read_pattern(note))] for note in chain]
+        for i, key in enumerate(keys, start=1):
+            # 見つからなかったノートは今のピッチのままにする
+            if len(found[key]) > 0:
+                candidates[i] = [(level * LEVEL_COST, pattern)
+                                 for level, _, _, pattern in found[key]]
+        # 休符をはさむところはつながりを考えない
+        connected = [note.lyric != 'R' and next_note.lyric != 'R'
+                     for note, next_note in zip(chain[:-1], chain[1:])]
+        path = pitch_sequence.choose_sequence(candidates, [note.notenum for note in chain],
+                                              connected, SEQUENCE_TOP_K)
+        levels = []
+        for i, (note, key) in enumerate(zip(notes[1:], keys), start=1):
+            if len(found[key]) == 0:
+                levels.append(None)
+                continue
+            level, store, matched, pattern = found[key][path[i]]
+            levels.append(level)
+            apply_pattern(note, pattern)
+            store.record_hit(matched)
+    report_levels(notes[1:], levels)
+
+
+def report_levels(notes, levels):
+    """各ノートがどの段階で一致したかを表示する
+    """
+    for note, level in zip(notes, levels):
+        result = '一致なし' if level is None else pitch_store.BACKOFF_LEVELS[level]
+        print(f'{note.tag}\t{note.lyric}\t{result}')
+    print('------------------------')
+    for level, name in enumerate(pitch_store.BACKOFF_LEVELS):
+        print(f'{name}: {levels.count(level)}')
+    print(f'一致なし: {levels.count(None)}')
+
+
+def load_ust_patterns(path_ust: str):
+    """USTファイルを読み取って、ノート数と (キー, ピッチパターン) のリストを返す
+    """
+    try:
+        ust = utaupy.ust.load(path_ust)
+    except Exception as e:  # pylint: disable=broad-except
+        print(f'読み取れなかったのでスキップします。: {path_ust} ({e})')
+        return 0, []
+    return len(ust.notes), extract_patterns(ust.notes)
+
+
+def ingest(input_dirs):
+    """フォルダ内のUSTファイルをすべて読み取って、ピッチパターンをまとめて登録する
+
+    USTファイルの読み取りは複数のプロセスで並列に行い、登録は1回で書き込む。
+    """
+    # multiprocessing を読み込むので、このモードのときだけ使う
+    from concurrent.futures import ProcessPoolExecutor  # pylint: disable=import-outside-toplevel
+
+    paths = sorted(path for input_dir in input_dirs
+                   for path in glob(join(input_dir, '**', '*.ust'), recursive=True))
+    print(f'{len(paths)} 個のUSTファイルを読み取ります。')
+    t_start = perf_counter()
+    n_notes = 0
+    samples = []
+    with ProcessPoolExecutor() as executor:
+        for n, file_samples in executor.map(load_ust_patterns, paths, chunksize=8):
+            n_notes += n
+            samples += file_samples
+    t_read = perf_counter() - t_start
+    # 音源を問わない共通のデータベースに登録する
+    with open_store(DB_FILE) as store:
+        store.upsert(samples)
+        rowids = store.rowids(key for key, _ in samples)
+        rowids += store.evict(MAX_ENTRIES, MAX_BYTES, EVICTION_POLICY)
+        pitch_view.write_pages(store, view_dir(store), rowids)
+    t_total = perf_counter() - t_start
+    print(f'{n_notes} ノートから {len(samples)} 件のピッチパターンを登録しました。')
+    print(f'読み取り: {t_read:.2f} 秒 ({n_notes / max(t_read, 1e-9):.0f} notes/sec)')
+    print(f'合計    : {t_total:.2f} 秒 ({n_notes / max(t_total, 1e-9):.0f} notes/sec)')
+
+
+def merge_into_shared(policy: str, paths):
+    """ライブラリ (memory.json や .db) を共通のデータベースに取り込む
+    """
+    if policy not in pitch_store.MERGE_POLICIES:
+        print(f'衝突したときの扱いは {", ".join(pitch_store.MERGE_POLICIES)} のどれかを指定してください。')
+        return
+    t_start = perf_counter()
+    with open_store(DB_FILE) as store:
+        n = pitch_library.merge_libraries(store, paths, policy)
+        store.evict(MAX_ENTRIES, MAX_BYTES, EVICTION_POLICY)
+        # 取り込んだキーは全体に散らばるので全ページを書き直す
+        pitch_view.write_pages(store, view_dir(store))
+    print(f'{len(paths)} 個のライブラリから {n} 件のピッチパターンを取り込みました。'
+          f' ({perf_counter() - t_start:.2f} 秒)')
+
+
+def export_shared(path_json: str):
+    """共通のデータベースの中身を memory.json と同じ形式で書き出す
+    """
+    with open_store(DB_FILE) as store:
+        n = pitch_library.export_json(store, path_json)
+    print(f'{n} 件のピッチパターンを書き出しました。: {path_json}')
+
+
+def search(plugin: utaupy.utauplugin.UtauPlugin):
+    """選択範囲の各ノートのピッチ曲線と形が最も似ているピッチパターンを適用する
+    """
+    notes = [note for note in plugin.notes if 'PBS' in note and 'PBW' in note]
+    if len(notes) == 0:
+        print('ピッチ情報のあるノートが選択されていません。')
+        return
+    # 全ノートの曲線を並べて1回で検索する
+    queries = np.stack([pitch_curve.rasterize(read_pattern(note)) for note in notes])
+    with ExitStack() as stack:
+        stores = open_search_stores(plugin, stack)
+        # 全データベースの曲線を1つの行列にまとめる
+        owners, keys, matrices = [], [], []
+        for store in stores:
+            store_keys, matrix = store.vectors()
+            owners += [store] * len(store_keys)
+            keys += store_keys
+            matrices.append(matrix)
+        if len(keys) == 0:
+            print('ピッチパターンが記録されていません。')
+            return
+        indices, distances = pitch_search.nearest_neighbors(
+            np.concatenate(matrices), queries, k=SEARCH_TOP_K)
+        for note, row, row_distances in zip(notes, indices, distances):
+            candidates = ', '.join(f'{keys[i]} ({distance:.1f})'
+                                   for i, distance in zip(row, row_distances))
+            print(f'{note.tag}\t{note.lyric}\t{candidates}')
+            best = row[0]
+            apply_pattern(note, owners[best].get_many([keys[best]])[keys[best]])
+            owners[best].record_hit(keys[best])
+
+
+def view(plugin: utaupy.utauplugin.UtauPlugin):
+    """選択範囲の歌詞と音程変化に関係するピッチパターンだけを確認用USTに出力する
+    """
+    if plugin.previous_note is not None:
+        notes = [plugin.previous_note] + plugin.notes
+    else:
+        notes = plugin.notes
+    keys = generate_keys(notes, max_length=MAX_NOTE_LENGTH, min_length=MIN_NOTE_LENGTH)
+    with open_target_store(plugin) as store:
+        n = pitch_view.write_filtered_view(store, keys, UST_FILE)
+    print(f'{n} 件のピッチパターンを出力しました。: {UST_FILE}')
+
+
+def undo_memorize(plugin: utaupy.utauplugin.UtauPlugin):
+    """直前の登録を取り消す
+    """
+    with open_target_store(plugin) as store:
+        rowids = store.undo()
+        pitch_view.write_pages(store, view_dir(store), rowids)
+    print(f'{len(rowids)} 件の登録を取り消しました。')
 
 
 def clean_data():
     """ピッチデータを記録しているファイルを削除する
     """
-    copy2(JSON_FILE, JSON_FILE.replace('.json', '_backup.json'))
-    remove(JSON_FILE)
-    remove(UST_FILE)
+    with open_store(DB_FILE) as store:
+        store.backup(DB_FILE.replace('.db', '_backup.db'))
+    # 音源ごとのデータベースもバックアップする
+    path_shards = glob(join(SHARD_DIR, '*.db'))
+    if len(path_shards) > 0:
+        makedirs(f'{SHARD_DIR}_backup', exist_ok=True)
+    for path_db in path_shards:
+        with open_store(path_db) as store:
+            store.backup(join(f'{SHARD_DIR}_backup', basename(path_db)))
+    # 旧形式のjsonファイルは取り込み済みなので一緒に削除する
+    for path in (DB_FILE, f'{DB_FILE}-wal', f'{DB_FILE}-shm', JSON_FILE, UST_FILE):
+        if exists(path):
+            remove(path)
+    for path in (SHARD_DIR, VIEW_DIR):
+        if exists(path):
+            rmtree(path)
 
 
 def main():
     """機能の分岐
     """
+    # python memorize_and_recall_pitch_pattern.py --ingest フォルダ1 フォルダ2 ...
+    if len(sys.argv) > 2 and sys.argv[1] == '--ingest':
+        ingest(sys.argv[2:])
+        return
+    # python memorize_and_recall_pitch_pattern.py --merge newest ライブラリ1 ライブラリ2 ...
+    if len(sys.argv) > 3 and sys.argv[1] == '--merge':
+        merge_into_shared(sys.argv[2], sys.argv[3:])
+        return
+    # python memorize_and_recall_pitch_pattern.py --export 出力先.json
+    if len(sys.argv) == 3 and sys.argv[1] == '--export':
+        export_shared(sys.argv[2])
+        return
     s = '動作モードを選択して下さい\n'\
         '1: Memorize mode / ピッチ登録モード\n'\
         '2: Recall mode / ピッチ呼び出しモード\n'\
+        '3: View mode / 選択範囲に関係するピッチパターンを確認用USTに出力\n'\
+        '4: Search mode / ピッチ曲線の形が似ているピッチパターンを適用\n'\
+        '5: Sequence recall mode / 前後とのつながりを考えてピッチ呼び出し\n'\
+        '98: Undo mode / 直前の登録を取り消す\n'\
         '99: Clean mode / プラグインデータ初期化\n'\
         '>>> '
     mode = input(s).strip()
@@ -160,6 +467,17 @@ def main():
         utaupy.utauplugin.run(memorize)
     elif mode in ['2', '２']:
         utaupy.utauplugin.run(recall)
+        input('\nエンターキーを押すと終了します。')
+    elif mode in ['3', '３']:
+        utaupy.utauplugin.run(view)
+    elif mode in ['4', '４']:
+        utaupy.utauplugin.run(search)
+        input('\nエンターキーを押すと終了します。')
+    elif mode in ['5', '５']:
+        utaupy.utauplugin.run(sequence_recall)
+        input('\nエンターキーを押すと終了します。')
+    elif mode in ['98', '９８']:
+        utaupy.utauplugin.run(undo_memorize)
     elif mode in ['99', '９９']:
         if input('Really? / 本当に削除していいですか？(yes/no)\n>>> ') == 'yes':
             clean_data()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+ピッチパターン (PBS, PBW, PBY, PBM) を、形を比べるための一定の点数の曲線にする
+
+ピッチ点を形状どおりにつなぐ計算は、ほかのプラグインと同じ _common/pitch.py と _common/raster.py のものを使う。
+"""
+
+import sys
+from itertools import accumulate
+from os.path import abspath, dirname
+
+import numpy as np
+
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+# pylint: disable=wrong-import-position
+from _common.pitch import PBM_TO_SHAPE  # noqa: E402
+from _common.raster import rasterize_curves  # noqa: E402
+
+# ピッチパターンを比較するときの曲線のサンプル数
+RASTER_SIZE = 64
+# 平均の曲線をピッチパターンに戻すときのピッチ点の数
+CENTROID_POINTS = 16
+
+
+def pattern_points(pattern: dict):
+    """ピッチ点の時刻[ms]、高さ[cent]、各点から始まる区間の形状番号を返す
+
+    _common.raster.note_points() と同じ形にする。PBY や PBM が PBW より少ないときは、高さ 0、形状 '' とする。
+    PBW がないときは、最初の点だけの幅 0 の区間にする。
+    """
+    pbs = pattern.get('PBS') or [0, 0]
+    pbw = pattern.get('PBW') or []
+    pby = pattern.get('PBY') or []
+    pbm = pattern.get('PBM') or []
+    # PBS の2項目目は省略されていることがある
+    x0, y0 = float(pbs[0]), float(pbs[1]) if len(pbs) > 1 else 0.0
+    if not pbw:
+        return np.array([x0, x0]), np.array([y0, y0]), np.zeros(2, dtype=int)
+    # パターンごとに呼ぶので、NumPy の配列は最後にまとめて作る
+    m = len(pbw)
+    x = [x0, *(x0 + w for w in accumulate(float(w) for w in pbw))]
+    y = [y0, *(float(v) for v in pby[:m])] + [0.0] * (m - min(len(pby), m))
+    shapes = [PBM_TO_SHAPE.get(v, 0) for v in pbm[:m]] + [0] * (m + 1 - min(len(pbm), m))
+    return np.array(x), np.array(y), np.array(shapes)
+
+
+def rasterize_many(patterns, size: int = RASTER_SIZE):
+    """複数のピッチパターンをまとめて rasterize() する
+
+    (パターン数, size) の曲線の行列と、各パターンの最初の点の時刻[ms]と長さ[ms]を返す。
+    """
+    points = [pattern_points(pattern) for pattern in patterns]
+    if len(points) == 0:
+        return np.zeros((0, size), dtype=np.float32), np.zeros(0), np.zeros(0)
+    starts = np.array([x[0] for x, _, _ in points])
+    spans = np.array([x[-1] for x, _, _ in points]) - starts
+    # 長さの違うパターン同士でも形を比べられるように、最初の点から最後の点までを size 点で標本化する
+    u = np.linspace(0, 1, size)
+    curves = rasterize_curves(points, [start + span * u for start, span in zip(starts, spans)])
+    return np.array(curves, dtype=np.float32), starts, spans
+
+
+def rasterize(pattern: dict, size: int = RASTER_SIZE) -> np.ndarray:
+    """ピッチパターンの最初の点から最後の点までを size 点で標本化した曲線[cent]を返す
+
+    長さの違うパターン同士でも形を比べられるように、時間方向は正規化する。
+    """
+    return rasterize_many([pattern], size)[0][0]
+
+
+def endpoints_many(patterns):
+    """複数のピッチパターンの、最初の点と最後の点の高さ[cent]をまとめて返す
+    """
+    points = [pattern_points(pattern) for pattern in patterns]
+    return np.array([y[0] for _, y, _ in points]), np.array([y[-1] for _, y, _ in points])
+
+
+def pattern_span(pattern: dict):
+    """ピッチパターンの最初の点の時刻[ms]と、最後の点までの長さ[ms]を返す
+    """
+    x, _, _ = pattern_points(pattern)
+    return float(x[0]), float(x[-1] - x[0])
+
+def vector_to_pattern(vector, start: float, span: float, n_points: int = CENTROID_POINTS):
+    """標本化した曲線を、等間隔のピッチ点を直線でつないだピッチパターンに戻す
+    """
+    y = np.interp(np.linspace(0, 1, n_points), np.linspace(0, 1, len(vector)), vector)
+    width = round(span / (n_points - 1), 1)
+    return {
+        'PBS': [round(start, 1), round(float(y[0]), 1)],
+        'PBW': [width] * (n_points - 1),
+        'PBY': [round(float(value), 1) for value in y[1:]],
+        'PBM': ['s'] * (n_points - 1)
+    }
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+ほかの人が記録したピッチパターンのライブラリ (memory.json や .db) を取り込む・書き出す
+
+ライブラリはそれぞれキー順に読み出し、heapq.merge で1本の列にまとめてから
+同じキーのものを集めて衝突を解決する (k-way マージ)。
+全ライブラリを1つの辞書に読み込まないので、件数に比例した時間で取り込める。
+"""
+
+import json
+import sqlite3
+from heapq import merge
+from itertools import groupby
+from operator import attrgetter
+from os.path import getmtime, splitext
+
+from pitch_store import Entry, PitchStore, read_entries
+
+
+def read_json_library(path_json: str):
+    """旧形式の memory.json の中身を Entry としてキー順に返す
+
+    登録日時の記録がないので、ファイルの更新日時を登録日時とみなす。
+    """
+    with open(path_json, 'r', encoding='utf-8') as f:
+        d = json.load(f)
+    updated_at = getmtime(path_json)
+    for key in sorted(d):
+        pattern = json.dumps(d[key], ensure_ascii=False)
+        yield Entry(key, pattern, updated_at, 1, ((pattern, 1),), None, 0.0, 0.0)
+
+
+def read_db_library(path_db: str):
+    """データベースの中身を Entry としてキー順に返す。ライブラリのファイルは書き換えない。
+    """
+    conn = sqlite3.connect(f'file:{path_db}?mode=ro', uri=True)
+    try:
+        yield from read_entries(conn)
+    finally:
+        conn.close()
+
+
+def read_library(path: str):
+    """拡張子に応じてライブラリを読む
+    """
+    if splitext(path)[1].lower() == '.json':
+        return read_json_library(path)
+    return read_db_library(path)
+
+
+def merge_libraries(store: PitchStore, paths, policy: str = 'newest') -> int:
+    """複数のライブラリをキー順にマージしながら store に取り込む
+
+    policy: pitch_store.MERGE_POLICIES のどれか
+    取り込んだキーの数を返す。
+    """
+    # 同じキーのものはライブラリの指定順に並ぶ
+    entries = merge(*(read_library(path) for path in paths), key=attrgetter('key'))
+    groups = ((key, list(group)) for key, group in groupby(entries, key=attrgetter('key')))
+    return store.merge(groups, policy)
+
+
+def export_json(store: PitchStore, path_json: str) -> int:
+    """記録しているピッチパターンを旧形式の memory.json と同じ形式で書き出す
+
+    1件ずつ書き出すので、全体を1つの辞書にしない。書き出した件数を返す。
+    """
+    n = 0
+    with open(path_json, 'w', encoding='utf-8') as f:
+        f.write('{')
+        for key, pattern in store.items():
+            f.write(',\n' if n > 0 else '\n')
+            f.write(f'{json.dumps(key, ensure_ascii=False)}: '
+                    f'{json.dumps(pattern, ensure_ascii=False)}')
+            n += 1
+        f.write('\n}\n')
+    return n
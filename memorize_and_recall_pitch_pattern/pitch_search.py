@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+ピッチ曲線の形が似ているピッチパターンを探す
+
+記録済みのピッチパターンは比較用の曲線 (pitch_curve.rasterize) を並べた行列として読み込み、
+選択範囲の全ノート分の曲線との距離を行列演算でまとめて計算する。
+"""
+
+import numpy as np
+
+# 一度に距離を計算する曲線の数。大きくするとメモリを多く使う。
+QUERY_BATCH_SIZE = 64
+
+
+def nearest_neighbors(matrix: np.ndarray, queries: np.ndarray, k: int = 5):
+    """queries の各行について、matrix の中で距離が近い行を k 個ずつ探す
+
+    近い順に並べた行番号と、曲線1点あたりの距離(RMS)[cent]を返す。
+    """
+    n, size = matrix.shape
+    k = min(k, n)
+    queries = np.asarray(queries, dtype=matrix.dtype).reshape(-1, size)
+    # |q - m|^2 = |q|^2 + |m|^2 - 2 q・m の |m|^2 は使いまわす
+    matrix_sqnorm = np.einsum('ij,ij->i', matrix, matrix)
+    all_indices = np.empty((len(queries), k), dtype=int)
+    all_distances = np.empty((len(queries), k))
+    for start in range(0, len(queries), QUERY_BATCH_SIZE):
+        batch = queries[start:start + QUERY_BATCH_SIZE]
+        sqdist = (np.einsum('ij,ij->i', batch, batch)[:, None]
+                  + matrix_sqnorm[None, :]
+                  - 2 * batch @ matrix.T)
+        # 上位 k 個だけを取り出してから並べ替える
+        indices = np.argpartition(sqdist, k - 1, axis=1)[:, :k]
+        rows = np.arange(len(batch))[:, None]
+        order = np.argsort(sqdist[rows, indices], axis=1)
+        indices = indices[rows, order]
+        all_indices[start:start + len(batch)] = indices
+        all_distances[start:start + len(batch)] = np.sqrt(
+            np.maximum(sqdist[rows, indices], 0) / size)
+    return all_indices, all_distances
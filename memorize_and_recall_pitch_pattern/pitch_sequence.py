@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+隣り合うノートのピッチ曲線がつながるように、ピッチパターンの候補を選ぶ
+
+ノートごとに候補を K 個まで集め、ノートの境目での音高のずれが最小になる組み合わせを
+動的計画法 (ビタビアルゴリズム) で求める。計算量は O(ノート数 × K^2)。
+境目のコストは全ノート分を (ノート数 - 1, K, K) の配列としてまとめて計算する。
+"""
+
+import numpy as np
+from pitch_curve import endpoints_many
+
+# 半音あたりの PBS, PBY の高さ (PBS, PBY は 10 cent 単位)
+NOTE_HEIGHT = 10
+
+
+def boundary_costs(starts, ends, notenums):
+    """隣り合うノートの候補同士の、境目での音高のずれを全ノート分まとめて計算する
+
+    starts, ends: (ノート数, K) 各候補の最初の点と最後の点の高さ
+    notenums    : (ノート数,) 各ノートの音高
+    (ノート数 - 1, K, K) の配列を返す。
+    [i, a, b] はノート i の候補 a の終わりと、ノート i + 1 の候補 b の始まりのずれ。
+    """
+    offsets = np.asarray(notenums, dtype=float)[:, None] * NOTE_HEIGHT
+    previous_ends = ends[:-1] + offsets[:-1]
+    next_starts = starts[1:] + offsets[1:]
+    return np.abs(previous_ends[:, :, None] - next_starts[:, None, :])
+
+
+def viterbi(unary, transitions):
+    """候補ごとのコストと境目のコストの合計が最小になる候補の選び方を返す
+
+    unary      : (ノート数, K) 候補ごとのコスト。候補がないところは inf にする。
+    transitions: (ノート数 - 1, K, K) boundary_costs() の結果
+    ノートごとに選んだ候補の番号を返す。
+    """
+    n, k = unary.shape
+    backpointers = np.zeros((n, k), dtype=int)
+    total = unary[0].copy()
+    columns = np.arange(k)
+    for i in range(1, n):
+        # 前のノートのどの候補から来るのが最もよいか
+        scores = total[:, None] + transitions[i - 1]
+        backpointers[i] = np.argmin(scores, axis=0)
+        total = scores[backpointers[i], columns] + unary[i]
+    path = np.empty(n, dtype=int)
+    path[-1] = np.argmin(total)
+    for i in range(n - 1, 0, -1):
+        path[i - 1] = backpointers[i, path[i]]
+    return path
+
+
+def choose_sequence(candidates, notenums, connected, k: int):
+    """ノートごとの候補から、境目がなめらかにつながる組み合わせを選ぶ
+
+    candidates: ノートごとの (コスト, ピッチパターン) のリスト。候補がないノートは空にせず、
+                今のピッチを候補として入れておく。
+    notenums  : 各ノートの音高
+    connected : 各ノートと次のノートの境目を評価するかどうか。休符をはさむところは False にする。
+    ノートごとに選んだ候補の番号を返す。
+    """
+    n = len(candidates)
+    unary = np.full((n, k), np.inf)
+    starts = np.zeros((n, k))
+    ends = np.zeros((n, k))
+    # 全候補の最初と最後の点をまとめて計算してから並べる
+    rows = np.repeat(np.arange(n), [len(c) for c in candidates])
+    columns = np.concatenate([np.arange(len(c)) for c in candidates]).astype(int)
+    flat = [candidate for c in candidates for candidate in c]
+    unary[rows, columns] = [cost for cost, _ in flat]
+    starts[rows, columns], ends[rows, columns] = endpoints_many([pattern for _, pattern in flat])
+    transitions = boundary_costs(starts, ends, notenums)
+    transitions *= np.asarray(connected, dtype=float)[:, None, None]
+    return viterbi(unary, transitions)
@@ -0,0 +1,816 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+ピッチパターンを記録するデータベース
+
+memory.json を毎回まるごと読み書きすると、登録数が増えたときに遅くなる。
+そこでキーに索引をつけた SQLite のデータベースに、選択範囲の分だけ追記・上書きする。
+複数のUTAUから同時に実行されても壊れないように、書き込みはトランザクションで行う。
+"""
+
+import json
+import math
+import sqlite3
+import time
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from itertools import islice
+from operator import attrgetter
+from os.path import exists
+
+import numpy as np
+from pitch_curve import RASTER_SIZE, rasterize_many, vector_to_pattern
+
+# SQLite に一度に渡せるパラメータ数の上限を超えないようにするための値
+CHUNK_SIZE = 500
+# キーごとに記録しておくピッチパターンの種類の上限
+MAX_VARIANTS = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patterns (
+    key TEXT PRIMARY KEY,
+    previous_length INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    delta_notenum INTEGER NOT NULL,
+    lyric TEXT NOT NULL,
+    pattern TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    vector BLOB,
+    count INTEGER NOT NULL DEFAULT 1,
+    mean_vector BLOB,
+    mean_start REAL,
+    mean_span REAL,
+    last_used REAL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_lyric_delta ON patterns (lyric, delta_notenum);
+CREATE INDEX IF NOT EXISTS idx_backoff_1
+    ON patterns (previous_length, length, delta_notenum, updated_at);
+CREATE INDEX IF NOT EXISTS idx_backoff_2 ON patterns (length, delta_notenum, updated_at);
+CREATE INDEX IF NOT EXISTS idx_backoff_3 ON patterns (delta_notenum, length, updated_at);
+CREATE TABLE IF NOT EXISTS variants (
+    key TEXT NOT NULL,
+    pattern TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (key, pattern)
+);
+CREATE TABLE IF NOT EXISTS replaced (
+    key TEXT PRIMARY KEY,
+    pattern TEXT,
+    updated_at REAL,
+    count INTEGER,
+    mean_vector BLOB,
+    mean_start REAL,
+    mean_span REAL
+);
+CREATE TABLE IF NOT EXISTS replaced_variants (
+    key TEXT NOT NULL,
+    pattern TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# データベースの形式 (PRAGMA user_version に記録する)。SCHEMA や ADDED_COLUMNS を変えたら増やす。
+#   2: memory.json から取り込んで last_used が NULL のままのものに updated_at を入れる
+SCHEMA_VERSION = 2
+# 古いバージョンのデータベースに追加する列
+ADDED_COLUMNS = {
+    'patterns': (
+        ('vector', 'BLOB'),
+        ('count', 'INTEGER NOT NULL DEFAULT 1'),
+        ('mean_vector', 'BLOB'),
+        ('mean_start', 'REAL'),
+        ('mean_span', 'REAL'),
+        ('last_used', 'REAL'),
+        ('hits', 'INTEGER NOT NULL DEFAULT 0'),
+    ),
+    'replaced': (
+        ('count', 'INTEGER'),
+        ('mean_vector', 'BLOB'),
+        ('mean_start', 'REAL'),
+        ('mean_span', 'REAL'),
+    ),
+}
+
+# 追加した列に対する索引。列を追加してから作る。
+ADDED_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_lru ON patterns (last_used);
+CREATE INDEX IF NOT EXISTS idx_lfu ON patterns (hits, last_used);
+"""
+
+# 登録数の上限を超えたときに削除するものの選び方
+#   lru: 最後に使われたのが最も古いもの
+#   lfu: 呼び出された回数が最も少ないもの (同じ回数なら最後に使われたのが古いもの)
+EVICTION_ORDER = {
+    'lru': 'last_used ASC',
+    'lfu': 'hits ASC, last_used ASC',
+}
+
+# 呼び出し時に返すピッチパターンの種類
+#   latest  : 最後に登録したもの
+#   frequent: 最もよく登録されたもの
+#   centroid: これまでに登録したものの平均の曲線
+RECALL_MODES = ('latest', 'frequent', 'centroid')
+
+# ライブラリを取り込むときに、同じキーのピッチパターンが衝突したときの扱い
+#   newest  : 最も新しく登録されたものを使う
+#   frequent: 最もよく登録されたものを使う
+#   variants: 最も新しいものを使い、ほかのものもすべて候補 (variants) として残す
+MERGE_POLICIES = ('newest', 'frequent', 'variants')
+
+# 1キー分の記録内容。ライブラリの取り込みに使う。
+#   pattern    : 最後に登録したピッチパターンのJSON
+#   variants   : (ピッチパターンのJSON, 登録回数) のタプル
+#   mean_vector: 平均の曲線。記録されていなければ None
+Entry = namedtuple('Entry', ('key', 'pattern', 'updated_at', 'count', 'variants',
+                             'mean_vector', 'mean_start', 'mean_span'))
+
+# 呼び出し時に一致しなかったときに条件を緩める順番
+BACKOFF_LEVELS = (
+    '完全一致',
+    '歌詞を無視',
+    '直前のノート長を無視',
+    '最も近いノート長',
+)
+
+
+def split_key(key: str):
+    """generate_key() で作ったキーを要素に分解する
+    """
+    previous_length, length, delta_notenum, lyric = key.split('_', maxsplit=3)
+    return int(previous_length), int(length), int(delta_notenum), lyric
+
+
+def chunks(items, size: int = CHUNK_SIZE):
+    """一定の個数ごとに区切ったリストを返す。イテレータも少しずつ読み進める。
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def read_entries(conn, keys=None):
+    """データベースの記録内容を Entry としてキー順に返す
+
+    keys を指定したときはそのキーだけを返す。
+    古いバージョンで作ったデータベースにない列は既定値で補う。
+    patterns と variants をそれぞれキー順に読んで突き合わせるので、全体を一度に読み込まない。
+    """
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(patterns)')}
+    # 曲線のサンプル数が違うものは使えない
+    raster_size = None
+    if 'meta' in tables:
+        row = conn.execute("SELECT value FROM meta WHERE name = 'raster_size'").fetchone()
+        raster_size = None if row is None else int(row[0])
+    defaults = {'count': 1, 'mean_vector': 'NULL', 'mean_start': 0.0, 'mean_span': 0.0}
+    if raster_size != RASTER_SIZE:
+        columns.discard('mean_vector')
+    selected = ', '.join(name if name in columns else f'{default} AS {name}'
+                         for name, default in defaults.items())
+    where, params = '', ()
+    if keys is not None:
+        keys = list(keys)
+        where, params = f'WHERE key IN ({",".join("?" * len(keys))})', keys
+    rows = conn.execute(
+        f'SELECT key, pattern, updated_at, {selected} FROM patterns {where} ORDER BY key', params)
+    variant_rows = iter(())
+    if 'variants' in tables:
+        variant_rows = conn.execute(
+            f'SELECT key, pattern, count FROM variants {where} ORDER BY key', params)
+    variant_row = next(variant_rows, None)
+    for key, pattern, updated_at, count, mean_vector, mean_start, mean_span in rows:
+        variants = []
+        while variant_row is not None and variant_row[0] <= key:
+            if variant_row[0] == key:
+                variants.append(variant_row[1:])
+            variant_row = next(variant_rows, None)
+        if mean_vector is not None:
+            mean_vector = np.frombuffer(mean_vector, dtype=np.float32).astype(float)
+        yield Entry(key, pattern, updated_at, count, tuple(variants) or ((pattern, count),),
+                    mean_vector, mean_start, mean_span)
+
+
+def combine_entries(entries: list, policy: str = 'newest') -> Entry:
+    """同じキーの記録内容を policy (MERGE_POLICIES のどれか) に従って1つにまとめる
+
+    登録回数は合計し、平均の曲線は登録回数で重みをつけて平均する。
+    entries の mean_vector はすべて計算済みであること。
+    """
+    # 新しい順。同じ時刻なら後ろにあるものを優先する。
+    ordered = sorted(entries, key=attrgetter('updated_at'))[::-1]
+    newest = ordered[0]
+    count = sum(entry.count for entry in ordered)
+    if len(ordered) == 1:
+        mean_vector, mean_start, mean_span = newest.mean_vector, newest.mean_start, newest.mean_span
+    else:
+        mean_vector = sum(entry.count * entry.mean_vector for entry in ordered) / count
+        mean_start = float(sum(entry.count * entry.mean_start for entry in ordered)) / count
+        mean_span = float(sum(entry.count * entry.mean_span for entry in ordered)) / count
+    variant_counts = Counter()
+    for entry in ordered:
+        for pattern, variant_count in entry.variants:
+            variant_counts[pattern] += variant_count
+    pattern = newest.pattern
+    if policy == 'frequent':
+        # 回数が同じなら新しいほうを選ぶ
+        pattern = variant_counts.most_common(1)[0][0]
+    if policy != 'variants' and len(variant_counts) > MAX_VARIANTS:
+        # Misra-Gries の集計同士をまとめるときは、MAX_VARIANTS + 1 番目の回数を全体から引く
+        ranked = variant_counts.most_common()
+        cut = ranked[MAX_VARIANTS][1]
+        variant_counts = Counter({p: c - cut for p, c in ranked[:MAX_VARIANTS] if c > cut})
+    return Entry(newest.key, pattern, newest.updated_at, count,
+                 tuple(variant_counts.items()), mean_vector, mean_start, mean_span)
+
+
+def lookup_stores(stores: list, key: str, max_level: int = len(BACKOFF_LEVELS) - 1,
+                  mode: str = 'latest'):
+    """複数のデータベースから、条件を段階的に緩めながらピッチパターンを探す
+
+    同じ段階の条件では stores の順に探し、どれにもなければ次の段階に進む。
+    一致した段階 (BACKOFF_LEVELS の番号) とピッチパターンを返す。
+    見つからなかったときは (None, None) を返す。
+    """
+    for level in range(max_level + 1):
+        for store in stores:
+            pattern = store.lookup_level(key, level, mode)
+            if pattern is not None:
+                return level, pattern
+    return None, None
+
+
+def candidates_stores(stores: list, key: str, k: int,
+                      max_level: int = len(BACKOFF_LEVELS) - 1, mode: str = 'latest') -> list:
+    """複数のデータベースから、条件を段階的に緩めながらピッチパターンの候補を k 個まで集める
+
+    lookup_stores() と同じ順に探し、(段階, データベース, 一致したキー, ピッチパターン) のリストを返す。
+    緩めた条件では前の段階で見つかったものも一致するので、同じピッチパターンは1つにする。
+    """
+    result = []
+    for level in range(max_level + 1):
+        for store in stores:
+            for matched, pattern in store.candidates(key, level, k, mode):
+                if any(pattern == found for *_, found in result):
+                    continue
+                result.append((level, store, matched, pattern))
+                if len(result) >= k:
+                    return result
+    return result
+
+
+class PitchStore:
+    """ピッチパターンの保存先
+
+    キーは generate_key() で作った文字列で、値は PBS, PBW, PBY, PBM をもつ辞書。
+    """
+
+    def __init__(self, path_db: str, timeout: float = 30.0):
+        self.path = path_db
+        # トランザクションは自分で管理する
+        self.conn = sqlite3.connect(path_db, timeout=timeout, isolation_level=None)
+        # 読み込み中でも別のプロセスが書き込めるようにする
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        # 形式が古いときだけ書き込む。呼び出しなどでは書き込みロックを取らない。
+        if self.needs_migration():
+            self.migrate()
+        # 呼び出されたキー。close() するときにまとめて記録する。
+        self.hits = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """呼び出された記録を書き込んでからデータベースを閉じる
+        """
+        self.flush_hits()
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """書き込み用のトランザクション
+
+        開始時に書き込みロックを取るので、同時に実行されたプラグインは順番待ちになる。
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def needs_migration(self) -> bool:
+        """データベースの形式や曲線のサンプル数が今のバージョンと違うかどうか (読み込みだけで調べる)
+        """
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            return True
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'raster_size'").fetchone()
+        return row is None or int(row[0]) != RASTER_SIZE
+
+    def migrate(self):
+        """新しいデータベースを作るか、古いバージョンで作ったデータベースを今のバージョンに合わせる
+        """
+        # CREATE TABLE IF NOT EXISTS なので、同時に実行されても問題ない
+        self.conn.executescript(SCHEMA)
+        with self.transaction() as conn:
+            # 順番待ちの間に別のプロセスが済ませていれば何もしない
+            if not self.needs_migration():
+                return
+            for table, added_columns in ADDED_COLUMNS.items():
+                columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+                for column, declaration in added_columns:
+                    if column not in columns:
+                        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+            conn.execute('UPDATE patterns SET last_used = updated_at WHERE last_used IS NULL')
+            # 曲線のサンプル数が変わったら作り直す
+            row = conn.execute("SELECT value FROM meta WHERE name = 'raster_size'").fetchone()
+            if row is None or int(row[0]) != RASTER_SIZE:
+                conn.execute('UPDATE patterns SET vector = NULL, mean_vector = NULL')
+                conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('raster_size', ?)",
+                             (str(RASTER_SIZE),))
+            # executescript はトランザクションを終えてしまうので、1文ずつ実行する
+            for statement in ADDED_INDEXES.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM patterns').fetchone()[0]
+
+    def upsert(self, samples):
+        """ピッチパターンを追加する
+
+        samples: (キー, ピッチパターン) のリスト。同じキーが何回出てきてもよい。
+        キーごとに、最後に登録したピッチパターンのほかに、登録回数と平均の曲線、
+        よく登録されるピッチパターン (最大 MAX_VARIANTS 種類) を逐次更新して記録する。
+        個々の登録内容は残さないので、登録回数が増えてもキーあたりのデータ量は増えない。
+        上書きされる前の状態は replaced テーブルに退避しておき、undo() で戻せるようにする。
+        """
+        samples = list(samples)
+        # 比較用の曲線は全サンプル分をまとめて計算しておく
+        vectors, starts, spans = rasterize_many([pattern for _, pattern in samples])
+        grouped = {}
+        for i, (key, pattern) in enumerate(samples):
+            grouped.setdefault(key, []).append((pattern, vectors[i], starts[i], spans[i]))
+        now = time.time()
+        with self.transaction() as conn:
+            self._clear_replaced(conn)
+            self._save_replaced(conn, list(grouped))
+            rows = []
+            for key, patterns in grouped.items():
+                rows.append((key, *split_key(key),
+                             *self._accumulate(conn, key, patterns), now, now))
+            conn.executemany(
+                'INSERT INTO patterns '
+                '(key, previous_length, length, delta_notenum, lyric, pattern, vector, '
+                'count, mean_vector, mean_start, mean_span, updated_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET '
+                'pattern = excluded.pattern, vector = excluded.vector, '
+                'count = excluded.count, mean_vector = excluded.mean_vector, '
+                'mean_start = excluded.mean_start, mean_span = excluded.mean_span, '
+                'updated_at = excluded.updated_at, last_used = excluded.last_used',
+                rows)
+
+    @staticmethod
+    def _clear_replaced(conn):
+        """前回の登録で退避した状態を消す
+        """
+        conn.execute('DELETE FROM replaced')
+        conn.execute('DELETE FROM replaced_variants')
+
+    @staticmethod
+    def _save_replaced(conn, keys):
+        """上書きする前の状態を replaced テーブルに退避する。新規登録のキーは pattern を NULL にする。
+        """
+        for chunk in chunks(keys):
+            placeholders = ','.join('?' * len(chunk))
+            conn.executemany('INSERT INTO replaced (key) VALUES (?)', [(key,) for key in chunk])
+            conn.execute(
+                'UPDATE replaced SET '
+                '(pattern, updated_at, count, mean_vector, mean_start, mean_span) = '
+                '(SELECT pattern, updated_at, count, mean_vector, mean_start, mean_span '
+                'FROM patterns WHERE patterns.key = replaced.key) '
+                f'WHERE key IN ({placeholders})', chunk)
+            conn.execute(
+                'INSERT INTO replaced_variants (key, pattern, count) '
+                f'SELECT key, pattern, count FROM variants WHERE key IN ({placeholders})', chunk)
+
+    def _accumulate(self, conn, key: str, patterns: list):
+        """登録済みの統計情報に新しいピッチパターンを加える
+
+        patterns: (ピッチパターン, 曲線, 開始時刻, 長さ) のリスト
+
+        最後のピッチパターンとその曲線、登録回数、平均の曲線、平均の開始時刻と長さを返す。
+        """
+        row = conn.execute(
+            'SELECT pattern, count, mean_vector, mean_start, mean_span '
+            'FROM patterns WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            count, mean_vector, mean_start, mean_span = 0, np.zeros(RASTER_SIZE), 0.0, 0.0
+        else:
+            old_pattern, count, old_mean_vector, mean_start, mean_span = row
+            # 統計情報を記録する前のバージョンで登録されたものは、最後の登録内容から始める
+            if old_mean_vector is None:
+                old_vectors, old_starts, old_spans = rasterize_many([json.loads(old_pattern)])
+                mean_vector = old_vectors[0].astype(float)
+                mean_start, mean_span = float(old_starts[0]), float(old_spans[0])
+            else:
+                mean_vector = np.frombuffer(old_mean_vector, dtype=np.float32).astype(float)
+            has_variants = conn.execute(
+                'SELECT 1 FROM variants WHERE key = ? LIMIT 1', (key,)).fetchone()
+            if has_variants is None:
+                conn.execute('INSERT INTO variants (key, pattern, count) VALUES (?, ?, ?)',
+                             (key, old_pattern, count))
+        for pattern, vector, start, span in patterns:
+            count += 1
+            # 平均を逐次更新する
+            mean_vector += (vector - mean_vector) / count
+            mean_start += (start - mean_start) / count
+            mean_span += (span - mean_span) / count
+            self._add_variant(conn, key, json.dumps(pattern, ensure_ascii=False))
+        return (json.dumps(pattern, ensure_ascii=False), vector.tobytes(),
+                count, mean_vector.astype(np.float32).tobytes(), mean_start, mean_span)
+
+    def merge(self, groups, policy: str = 'newest') -> int:
+        """ライブラリの記録内容を取り込む
+
+        groups: (キー, [Entry, ...]) のイテラブル
+        すでに登録されているものも含めて、キーごとに policy に従って1つにまとめる。
+        CHUNK_SIZE キーずつ処理するので、groups を一度にすべて読み込まない。
+        取り込む前の状態は replaced テーブルに退避しておき、undo() で戻せるようにする。
+        取り込んだキーの数を返す。
+        """
+        if policy not in MERGE_POLICIES:
+            raise ValueError(f'policy must be one of {MERGE_POLICIES}.')
+        n = 0
+        with self.transaction() as conn:
+            self._clear_replaced(conn)
+            for chunk in chunks(groups):
+                keys = [key for key, _ in chunk]
+                self._save_replaced(conn, keys)
+                existing = {entry.key: entry for entry in read_entries(conn, keys)}
+                chunk = [([existing[key]] if key in existing else []) + list(entries)
+                         for key, entries in chunk]
+                # 曲線は同じピッチパターンごとに1回だけ計算する
+                curves = {}
+                self._rasterize_into(curves, [entry.pattern for entries in chunk
+                                              for entry in entries])
+                # 平均の曲線がないものは、最後に登録したピッチパターンの曲線で代用する
+                chunk = [[entry if entry.mean_vector is not None else entry._replace(
+                    mean_vector=curves[entry.pattern][0].astype(float),
+                    mean_start=curves[entry.pattern][1], mean_span=curves[entry.pattern][2])
+                    for entry in entries] for entries in chunk]
+                merged = [combine_entries(entries, policy) for entries in chunk]
+                # frequent のときは、どの記録の最新でもないピッチパターンが選ばれることがある
+                self._rasterize_into(curves, [entry.pattern for entry in merged])
+                vectors = [curves[entry.pattern][0] for entry in merged]
+                conn.executemany(
+                    'INSERT INTO patterns '
+                    '(key, previous_length, length, delta_notenum, lyric, pattern, vector, '
+                    'count, mean_vector, mean_start, mean_span, updated_at, last_used) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT(key) DO UPDATE SET '
+                    'pattern = excluded.pattern, vector = excluded.vector, '
+                    'count = excluded.count, mean_vector = excluded.mean_vector, '
+                    'mean_start = excluded.mean_start, mean_span = excluded.mean_span, '
+                    'updated_at = excluded.updated_at',
+                    [(entry.key, *split_key(entry.key), entry.pattern, vector.tobytes(),
+                      entry.count, entry.mean_vector.astype(np.float32).tobytes(),
+                      entry.mean_start, entry.mean_span, entry.updated_at, entry.updated_at)
+                     for entry, vector in zip(merged, vectors)])
+                conn.executemany('DELETE FROM variants WHERE key = ?', [(key,) for key in keys])
+                conn.executemany(
+                    'INSERT INTO variants (key, pattern, count) VALUES (?, ?, ?)',
+                    [(entry.key, pattern, count)
+                     for entry in merged for pattern, count in entry.variants])
+                n += len(merged)
+        return n
+
+    @staticmethod
+    def _rasterize_into(curves: dict, patterns: list):
+        """まだ curves にないピッチパターン (JSON) の曲線、開始時刻、長さをまとめて計算して追加する
+        """
+        patterns = [pattern for pattern in dict.fromkeys(patterns) if pattern not in curves]
+        vectors, starts, spans = rasterize_many([json.loads(pattern) for pattern in patterns])
+        curves.update(zip(patterns, zip(vectors, starts, spans)))
+
+    @staticmethod
+    def _add_variant(conn, key: str, pattern: str):
+        """よく登録されるピッチパターンの集計を更新する
+
+        種類が MAX_VARIANTS を超えるときは全種類の回数を1ずつ減らし、0回になったものを消す。
+        (Misra-Gries の頻出要素の集計方法)
+        """
+        cursor = conn.execute(
+            'UPDATE variants SET count = count + 1 WHERE key = ? AND pattern = ?',
+            (key, pattern))
+        if cursor.rowcount > 0:
+            return
+        n = conn.execute('SELECT COUNT(*) FROM variants WHERE key = ?', (key,)).fetchone()[0]
+        if n < MAX_VARIANTS:
+            conn.execute('INSERT INTO variants (key, pattern, count) VALUES (?, ?, 1)',
+                         (key, pattern))
+        else:
+            conn.execute('UPDATE variants SET count = count - 1 WHERE key = ?', (key,))
+            conn.execute('DELETE FROM variants WHERE key = ? AND count <= 0', (key,))
+
+    def undo(self) -> list:
+        """直前の upsert() を取り消す。戻したピッチパターンの rowid を返す。
+        """
+        with self.transaction() as conn:
+            rowids = [rowid for (rowid,) in conn.execute(
+                'SELECT rowid FROM patterns WHERE key IN (SELECT key FROM replaced)')]
+            # 新規登録だったものは削除する
+            conn.execute(
+                'DELETE FROM patterns WHERE key IN '
+                '(SELECT key FROM replaced WHERE pattern IS NULL)')
+            # 上書きだったものは元に戻す
+            conn.execute(
+                'UPDATE patterns SET '
+                '(pattern, updated_at, vector, count, mean_vector, mean_start, mean_span) = '
+                '(SELECT pattern, updated_at, NULL, count, mean_vector, mean_start, mean_span '
+                'FROM replaced WHERE replaced.key = patterns.key) '
+                'WHERE key IN (SELECT key FROM replaced WHERE pattern IS NOT NULL)')
+            conn.execute('DELETE FROM variants WHERE key IN (SELECT key FROM replaced)')
+            conn.execute(
+                'INSERT INTO variants (key, pattern, count) '
+                'SELECT key, pattern, count FROM replaced_variants')
+            conn.execute('DELETE FROM replaced')
+            conn.execute('DELETE FROM replaced_variants')
+        return rowids
+
+    def record_hit(self, key: str):
+        """ピッチパターンが呼び出されたことを記録する。書き込みは flush_hits() でまとめて行う。
+        """
+        self.hits.append(key)
+
+    def flush_hits(self):
+        """呼び出された記録をまとめて書き込む
+        """
+        if len(self.hits) == 0:
+            return
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany(
+                'UPDATE patterns SET hits = hits + 1, last_used = ? WHERE key = ?',
+                [(now, key) for key in self.hits])
+        self.hits = []
+
+    def evict(self, max_entries: int, max_bytes: int, policy: str = 'lru') -> list:
+        """登録数またはデータ量が上限を超えていたら、policy に従って古いものから削除する
+
+        policy: EVICTION_ORDER のキー
+        削除したピッチパターンの rowid を返す。
+        """
+        if policy not in EVICTION_ORDER:
+            raise ValueError(f'policy must be one of {tuple(EVICTION_ORDER)}.')
+        with self.transaction() as conn:
+            n = conn.execute('SELECT COUNT(*) FROM patterns').fetchone()[0]
+            n_excess = n - max_entries
+            # 空き領域を除いたデータ量
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+            freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            n_bytes = (page_count - freelist_count) * page_size
+            if n_bytes > max_bytes:
+                # 1件あたりのデータ量は同じくらいとみなして削除する件数を決める
+                n_excess = max(n_excess, math.ceil(n * (1 - max_bytes / n_bytes)))
+            if n_excess <= 0:
+                return []
+            rows = conn.execute(
+                f'SELECT rowid, key FROM patterns ORDER BY {EVICTION_ORDER[policy]} LIMIT ?',
+                (n_excess,)).fetchall()
+            keys = [(key,) for _, key in rows]
+            conn.executemany('DELETE FROM patterns WHERE key = ?', keys)
+            conn.executemany('DELETE FROM variants WHERE key = ?', keys)
+        return [rowid for rowid, _ in rows]
+
+    def get_many(self, keys) -> dict:
+        """指定したキーのピッチパターンをまとめて取得する
+        """
+        keys = list(set(keys))
+        result = {}
+        for chunk in chunks(keys):
+            placeholders = ','.join('?' * len(chunk))
+            cursor = self.conn.execute(
+                f'SELECT key, pattern FROM patterns WHERE key IN ({placeholders})', chunk)
+            result.update((key, json.loads(pattern)) for key, pattern in cursor)
+        return result
+
+    def match_keys(self, key: str, level: int, limit: int = 1) -> list:
+        """BACKOFF_LEVELS の指定した段階の条件に一致するキーを、優先する順に limit 個まで返す
+
+        どの段階も索引を使うので、登録数が増えても1回の検索は O(log n) で済む。
+        """
+        previous_length, length, delta_notenum, _ = split_key(key)
+        if level == 0:
+            rows = self.conn.execute(
+                'SELECT key FROM patterns WHERE key = ?', (key,)).fetchall()
+        elif level == 1:
+            rows = self.conn.execute(
+                'SELECT key FROM patterns WHERE previous_length = ? AND length = ? '
+                'AND delta_notenum = ? ORDER BY updated_at DESC LIMIT ?',
+                (previous_length, length, delta_notenum, limit)).fetchall()
+        elif level == 2:
+            rows = self.conn.execute(
+                'SELECT key FROM patterns WHERE length = ? AND delta_notenum = ? '
+                'ORDER BY updated_at DESC LIMIT ?',
+                (length, delta_notenum, limit)).fetchall()
+        elif level == 3:
+            # 音程変化が同じもののうち、ノート長が近いものを前後から limit 個ずつ探す
+            longer = self.conn.execute(
+                'SELECT length, key FROM patterns WHERE delta_notenum = ? AND length >= ? '
+                'ORDER BY length ASC, updated_at DESC LIMIT ?',
+                (delta_notenum, length, limit)).fetchall()
+            shorter = self.conn.execute(
+                'SELECT length, key FROM patterns WHERE delta_notenum = ? AND length <= ? '
+                'ORDER BY length DESC, updated_at DESC LIMIT ?',
+                (delta_notenum, length, limit)).fetchall()
+            # ちょうど同じ長さのものは両方に入るので重複を除く
+            rows = sorted(dict.fromkeys(longer + shorter), key=lambda row: abs(row[0] - length))
+            rows = [row[1:] for row in rows]
+        else:
+            raise ValueError(f'level must be 0 to {len(BACKOFF_LEVELS) - 1}.')
+        return [matched for (matched,) in rows[:limit]]
+
+    def lookup_level(self, key: str, level: int, mode: str = 'latest'):
+        """BACKOFF_LEVELS の指定した段階の条件でピッチパターンを探す
+
+        mode: RECALL_MODES のどれか
+        見つからなかったときは None を返す。
+        """
+        matched = self.match_keys(key, level)
+        if len(matched) == 0:
+            return None
+        self.record_hit(matched[0])
+        return self.representative(matched[0], mode)
+
+    def candidates(self, key: str, level: int, k: int, mode: str = 'latest') -> list:
+        """BACKOFF_LEVELS の指定した段階の条件で、ピッチパターンの候補を k 個まで探す
+
+        一致したキーごとに、mode で選んだもののあとによく登録されるもの (variants) を並べる。
+        (一致したキー, ピッチパターン) のリストを返す。
+        """
+        result = {}
+        for matched in self.match_keys(key, level, k):
+            patterns = [json.dumps(self.representative(matched, mode), ensure_ascii=False)]
+            patterns += [pattern for (pattern,) in self.conn.execute(
+                'SELECT pattern FROM variants WHERE key = ? ORDER BY count DESC', (matched,))]
+            for pattern in patterns:
+                result.setdefault(pattern, matched)
+                if len(result) >= k:
+                    break
+            if len(result) >= k:
+                break
+        return [(matched, json.loads(pattern)) for pattern, matched in result.items()]
+
+    def representative(self, key: str, mode: str = 'latest'):
+        """キーに対応するピッチパターンを mode に応じて1つ返す
+        """
+        pattern, mean_vector, mean_start, mean_span = self.conn.execute(
+            'SELECT pattern, mean_vector, mean_start, mean_span FROM patterns WHERE key = ?',
+            (key,)).fetchone()
+        if mode == 'frequent':
+            row = self.conn.execute(
+                'SELECT pattern FROM variants WHERE key = ? ORDER BY count DESC LIMIT 1',
+                (key,)).fetchone()
+            if row is not None:
+                pattern = row[0]
+        elif mode == 'centroid':
+            if mean_vector is not None:
+                return vector_to_pattern(
+                    np.frombuffer(mean_vector, dtype=np.float32), mean_start, mean_span)
+        elif mode != 'latest':
+            raise ValueError(f'mode must be one of {RECALL_MODES}.')
+        return json.loads(pattern)
+
+    def lookup(self, key: str, max_level: int = len(BACKOFF_LEVELS) - 1,
+               mode: str = 'latest'):
+        """条件を段階的に緩めながらピッチパターンを探す
+
+        一致した段階 (BACKOFF_LEVELS の番号) とピッチパターンを返す。
+        見つからなかったときは (None, None) を返す。
+        """
+        return lookup_stores([self], key, max_level, mode)
+
+    def rowids(self, keys) -> list:
+        """指定したキーの rowid を返す。rowid は上書きしても変わらない。
+        """
+        keys = list(set(keys))
+        result = []
+        for chunk in chunks(keys):
+            placeholders = ','.join('?' * len(chunk))
+            cursor = self.conn.execute(
+                f'SELECT rowid FROM patterns WHERE key IN ({placeholders})', chunk)
+            result.extend(rowid for (rowid,) in cursor)
+        return result
+
+    def max_rowid(self) -> int:
+        """いちばん大きい rowid を返す。何も登録されていないときは 0 を返す。
+        """
+        return self.conn.execute('SELECT IFNULL(MAX(rowid), 0) FROM patterns').fetchone()[0]
+
+    def items_between(self, first_rowid: int, last_rowid: int):
+        """rowid が指定した範囲にあるピッチパターンを rowid 順に返す
+        """
+        cursor = self.conn.execute(
+            'SELECT key, pattern FROM patterns WHERE rowid BETWEEN ? AND ? ORDER BY rowid',
+            (first_rowid, last_rowid))
+        for key, pattern in cursor:
+            yield key, json.loads(pattern)
+
+    def find(self, lyrics, min_delta: int, max_delta: int, limit: int):
+        """歌詞と音程変化の範囲で絞り込んだピッチパターンをキー順に返す
+        """
+        lyrics = list(set(lyrics))
+        placeholders = ','.join('?' * len(lyrics))
+        cursor = self.conn.execute(
+            'SELECT key, pattern FROM patterns '
+            f'WHERE lyric IN ({placeholders}) AND delta_notenum BETWEEN ? AND ? '
+            'ORDER BY key LIMIT ?',
+            (*lyrics, min_delta, max_delta, limit))
+        for key, pattern in cursor:
+            yield key, json.loads(pattern)
+
+    def fill_vectors(self):
+        """比較用の曲線がまだ計算されていないピッチパターンについて計算する
+        """
+        rows = self.conn.execute(
+            'SELECT key, pattern FROM patterns WHERE vector IS NULL').fetchall()
+        if len(rows) == 0:
+            return
+        vectors, _, _ = rasterize_many([json.loads(pattern) for _, pattern in rows], RASTER_SIZE)
+        with self.transaction() as conn:
+            conn.executemany('UPDATE patterns SET vector = ? WHERE key = ?',
+                             [(vector.tobytes(), key) for vector, (key, _) in zip(vectors, rows)])
+
+    def vectors(self):
+        """全ピッチパターンのキーと、比較用の曲線を並べた行列を返す
+        """
+        self.fill_vectors()
+        rows = self.conn.execute('SELECT key, vector FROM patterns ORDER BY rowid').fetchall()
+        keys = [key for key, _ in rows]
+        matrix = np.frombuffer(b''.join(vector for _, vector in rows), dtype=np.float32)
+        return keys, matrix.reshape(len(rows), RASTER_SIZE)
+
+    def items(self):
+        """登録されているピッチパターンをキー順に返す
+        """
+        cursor = self.conn.execute('SELECT key, pattern FROM patterns ORDER BY key')
+        for key, pattern in cursor:
+            yield key, json.loads(pattern)
+
+    def imported_json(self) -> bool:
+        """旧形式の memory.json を取り込み済みかどうか
+        """
+        return self.conn.execute(
+            "SELECT value FROM meta WHERE name = 'imported_json'").fetchone() is not None
+
+    def import_json(self, path_json: str) -> int:
+        """旧形式の memory.json を取り込む。取り込みは一度だけ行う。
+
+        取り込んだ件数を返す。
+        呼び出しなどで開くたびに実行されるので、取り込み済みなら書き込みロックを取らない。
+        """
+        if not exists(path_json) or self.imported_json():
+            return 0
+        with self.transaction() as conn:
+            # 順番待ちの間に別のプロセスが取り込んでいれば何もしない
+            if self.imported_json():
+                return 0
+            with open(path_json, 'r', encoding='utf-8') as f:
+                d = json.load(f)
+            now = time.time()
+            # 取り込んだ時点で使われたものとみなす。NULL だと削除するときに真っ先に選ばれる。
+            rows = [(key, *split_key(key), json.dumps(value, ensure_ascii=False), now, now)
+                    for key, value in d.items()]
+            # すでに登録されているもののほうが新しいので上書きしない
+            conn.executemany(
+                'INSERT OR IGNORE INTO patterns '
+                '(key, previous_length, length, delta_notenum, lyric, pattern, updated_at, '
+                'last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows)
+            conn.execute(
+                "INSERT INTO meta (name, value) VALUES ('imported_json', ?)", (path_json,))
+        return len(rows)
+
+    def backup(self, path_backup: str):
+        """データベース全体を別のファイルに複製する
+        """
+        with sqlite3.connect(path_backup) as dst:
+            self.conn.backup(dst)
+        dst.close()
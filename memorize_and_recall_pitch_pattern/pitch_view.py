@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 oatsu
+"""
+記録したピッチパターンをUTAUで確認するためのUSTファイルを作る
+
+登録数が増えると1つのUSTファイルでは重くて開けなくなるので、
+PAGE_SIZE 件ずつのページに分けて出力する。
+登録・取り消しのときは、変更があったページだけを書き直す。
+"""
+
+from glob import glob
+from os import makedirs, remove
+from os.path import exists, join
+
+import utaupy
+from pitch_store import PitchStore, split_key
+
+# 1ページに含めるピッチパターンの数
+PAGE_SIZE = 100
+
+
+def page_path(view_dir: str, page: int) -> str:
+    """ページ番号に対応するUSTファイルのパスを返す
+    """
+    return join(view_dir, f'memory_view_{page + 1:04d}.ust')
+
+
+def items2ust(items, path_ust):
+    """ピッチパターンをUTAUで確認できるようにUSTファイルに変換する
+    """
+    ust = utaupy.ust.Ust()
+    ust.setting['Mode2'] = True
+    ust.setting['Charset'] = 'UTF-8'
+    for key, v in items:
+        previous_length, length, delta_notenum, lyric = split_key(key)
+        # 音程変化を確認するための音符を追加
+        note = utaupy.ust.Note()
+        note.lyric = 'dummy'
+        note.length = previous_length
+        note.label = previous_length
+        note.notenum = 60
+        ust.notes.append(note)
+        # 本体
+        note = utaupy.ust.Note()
+        note.length = length
+        note.label = length
+        note.lyric = lyric
+        note.pbw = v['PBW']
+        note.pby = v['PBY']
+        note.pbm = v['PBM']
+        note.pbs = v['PBS']
+        note['Modulation'] = 0
+        note.notenum = 60 + int(delta_notenum)
+        ust.notes.append(note)
+        # 見た目を区切るための休符を追加
+        note = utaupy.ust.Note()
+        note.lyric = 'R'
+        note.length = 1920 - (previous_length + length) % 1920
+        note.notenum = 60
+        ust.notes.append(note)
+    ust.write(path_ust, encoding='utf-8')
+
+
+def write_pages(store: PitchStore, view_dir: str, rowids=None):
+    """指定した rowid を含むページだけを書き直す。
+
+    rowids を省略したときや、まだページがひとつもないときは全ページを書き直す。
+    """
+    last_page = (store.max_rowid() - 1) // PAGE_SIZE
+    if rowids is None or not exists(view_dir):
+        makedirs(view_dir, exist_ok=True)
+        # 不要になったページを消してから全ページを書き出す
+        for path in glob(join(view_dir, 'memory_view_*.ust')):
+            remove(path)
+        pages = range(last_page + 1)
+    else:
+        pages = sorted({(rowid - 1) // PAGE_SIZE for rowid in rowids})
+    for page in pages:
+        items = list(store.items_between(page * PAGE_SIZE + 1, (page + 1) * PAGE_SIZE))
+        path_ust = page_path(view_dir, page)
+        # 中身がなくなったページは削除する
+        if len(items) == 0:
+            if exists(path_ust):
+                remove(path_ust)
+            continue
+        items2ust(items, path_ust)
+
+
+def write_filtered_view(store: PitchStore, keys, path_ust: str, limit: int = PAGE_SIZE):
+    """選択範囲の歌詞と音程変化の範囲に一致するピッチパターンだけをUSTファイルに出力する
+
+    出力した件数を返す。
+    """
+    parts = [split_key(key) for key in keys]
+    if len(parts) == 0:
+        return 0
+    lyrics = [lyric for _, _, _, lyric in parts]
+    deltas = [delta_notenum for _, _, delta_notenum, _ in parts]
+    items = list(store.find(lyrics, min(deltas), max(deltas), limit))
+    items2ust(items, path_ust)
+    return len(items)
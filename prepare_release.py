@@ -17,7 +17,7 @@ from install import (find_python_exe, pip_install_requirements,
 
 RELEASE_DIR = '_release'
 RELEASE_NAME = 'utau_plugins_v---'
-IGNORE_LIST = [RELEASE_DIR, basename(__file__), '__pycache__',
+IGNORE_LIST = [RELEASE_DIR, basename(__file__), 'check_import_time.py', '__pycache__',
                '_archive', '_test', '.git', '.gitignore', '.gitattribute']
 REMOVE_LIST = ['__pycache__', '.mypy']
 
@@ -85,9 +85,8 @@ def prepare_offline_installer(offline_release_dir, ignore_list):
     print('\nPreparing offline installer----------------------------')
     copy_files_to_release_dir(offline_release_dir, ignore_list)
     python_embed_dir = dirname(find_python_exe())
-    # pythonのフォルダを除いた子フォルダをプラグインフォルダとみなす
-    plugin_dirs = [path for path in glob(join(offline_release_dir, '*', ''))
-                   if path != python_embed_dir]
+    # plugin.txt がある子フォルダをプラグインフォルダとみなす
+    plugin_dirs = [dirname(path) for path in glob(join(offline_release_dir, '*', 'plugin.txt'))]
     # 各プラグインに必要なパッケージをインストールする。
     basename_python_embed_dir = basename(python_embed_dir)
     for plugin_dir in plugin_dirs:
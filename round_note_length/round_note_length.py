@@ -3,21 +3,36 @@
 """
 ノート長を10で丸める
 """
+import sys
+from os.path import abspath, dirname
 
-from utaupy.utauplugin import run
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.columns import NoteColumns  # noqa: E402 pylint: disable=wrong-import-position
+from _common.edit import NoteEditBuffer  # noqa: E402 pylint: disable=wrong-import-position
+from _common.lazy import lazy_import  # noqa: E402 pylint: disable=wrong-import-position
+from _common.projection import run  # noqa: E402 pylint: disable=wrong-import-position
+
+np = lazy_import('numpy')
 
 UNIT_LENGTH = 10
+# 読み込む項目
+KEYS = ('Length',)
 
 
 def round_note_length(plugin, unit):
     """
     ノート長を10で割って丸めて10をかける
     """
-    for note in plugin.notes:
-        note.length = round(note.length / unit) * unit
-        if note.length == 0:
-            note.delete()
+    columns = NoteColumns(plugin.notes)
+    # round() と同じく偶数丸め
+    columns.length = np.round(columns.length / unit).astype(int) * unit
+    columns.write_back()
+    buffer = NoteEditBuffer(plugin.notes)
+    for i in np.flatnonzero(columns.length == 0):
+        buffer.delete(i)
+    plugin.notes = buffer.apply()
 
 
 if __name__ == '__main__':
-    run(round_note_length, option=UNIT_LENGTH)
+    run(round_note_length, KEYS, option=UNIT_LENGTH)
@@ -3,84 +3,72 @@
 """
 ピッチ点の高さを丸める。全て半音レベルにする。EnuPitchを使った後に使用する想定。
 """
+import sys
+from os.path import abspath, dirname
+
 from utaupy.utauplugin import run
 
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.lazy import lazy_import  # noqa: E402 pylint: disable=wrong-import-position
+from _common.pitch import PitchPoints, round_to_grid  # noqa: E402 pylint: disable=wrong-import-position
+from _common.pitch import simplify_notes  # noqa: E402 pylint: disable=wrong-import-position
+from _common.tempo import TempoMap  # noqa: E402 pylint: disable=wrong-import-position
+
+np = lazy_import('numpy')
+
 # PBW丸める単位
 PBW_UNIT_BY_NOTELENGTH = 32  # 分音符
+# ピッチ点を間引くときの許容誤差 (高さ[cent], 時間[ms])。0 なら曲線が変わらない点だけを削除する。
+DEFAULT_CENT_TOLERANCE = 0
+DEFAULT_MS_TOLERANCE = 0
+# 起動時に許容誤差を入力するかどうか。False なら入力せずに初期値を使う。
+ASK_TOLERANCE = False
+# 間引く前後の曲線のずれを調べる間隔[ms]
+SIMPLIFY_STEP_MS = 1
 
 
 def round_pbw(plugin):
-    """音高を丸める
+    """ピッチ点の間隔を丸める。全ノートの PBW をまとめて処理する。
     """
-    for note in plugin.notes:
-        try:
-            # 丸める単位
-            unit_ms = (60 / note.tempo) / (PBW_UNIT_BY_NOTELENGTH / 4)
-            # PBWが無かったら何も処理せず次のノートに進む
-            if 'PBW' not in note:
-                continue
-            # PBSが無かったらオフセット無し
-            if 'PBS' not in note:
-                offset = 0
-            # PBSにオフセットの値が入っているとき (基本的には負の値が入っていることに注意)
-            # 負の値だとノート開始より前にピッチ点があり、正の値だと遅れた位置にピッチ点がある。
-            else:
-                offset = round(note.pbs[0] / unit_ms) * unit_ms
-                note.pbs[0] = offset
-                note.pbw = [round(x / unit_ms) * unit_ms for x in note.pbw]
+    notes = plugin.notes
+    # 丸める単位は、テンポマップのテンポからまとめて求める
+    unit_ms_list = (60 / TempoMap(notes).tempos) / (PBW_UNIT_BY_NOTELENGTH / 4)
+    # PBWが無いノートと、PBSが無い (オフセット無しの) ノートは何もしない
+    pbw = PitchPoints(notes, 'PBW')
+    pbw.select([('PBS' in note) for note in notes])
+    pbw.values = round_to_grid(pbw.values, np.repeat(unit_ms_list[pbw.indices], pbw.counts))
+    pbw.write_back()
 
-        except Exception as e:
-            print('Exception in note below ----------------------------------------')
-            print(note)
-            print('----------------------------------------------------------------')
-            raise e
 
-
-def reduce_pitch_points(plugin):
-    """不要なピッチ点を削除する。具体的には、同じPBYが連続しているときに削除する。
+def reduce_pitch_points(plugin, cent_tolerance, ms_tolerance):
+    """不要なピッチ点を削除する。具体的には、曲線の形のずれが許容誤差に収まる点を削除する。
+    許容誤差が 0 のときは、同じPBYが連続しているときなど、曲線が変わらない点だけを削除する。
     """
-    for note in plugin.notes:
-        # PBYがない場合はSkip
-        if 'PBY' not in note:
-            continue
-        # 削減しようがない場合はSkip
-        if len(note.pby) <= 2:
-            continue
-        assert len('PBY') == len('PBW') == len('PBM')
-
-        # ピッチ点を削減する
-        temp_pby = [note.pby[0]]
-        temp_pbw = [note.pbw[0]]
-        temp_pbm = [note.pbm[0]]
+    n_removed, max_deviation = simplify_notes(
+        plugin.notes, cent_tolerance, ms_tolerance, SIMPLIFY_STEP_MS)
+    print(f'ピッチ点を {n_removed} 個削除しました。(曲線のずれは最大 {max_deviation:.1f} cent)')
 
-        # PBWの繰り越し量
-        pbw_carry_over = 0
-        for i, _ in enumerate(note.pby[1:-1], 1):
-            if not note.pby[i-1] == note.pby[i] == note.pby[i+1]:
-                temp_pby.append(note.pby[i])
-                temp_pbw.append(note.pbw[i] + pbw_carry_over)
-                temp_pbm.append(note.pbm[i])
-                pbw_carry_over = 0
-            else:
-                print('ピッチ点を削除しました。')
-                pbw_carry_over += note.pbw[i]
 
-        # ノート内の最後のピッチ点を復元
-        temp_pby.append(note.pby[-1])
-        temp_pbw.append(note.pbw[-1] + pbw_carry_over)
-        temp_pbm.append(note.pbm[-1])
-        # 削減後のピッチ点でノート情報を上書き
-        note.pby = temp_pby
-        note.pbw = temp_pbw
-        note.pbm = temp_pbm
+def input_tolerance(message: str, default: float) -> float:
+    """許容誤差を入力してもらう。空欄のときは初期値にする。
+    """
+    s = input(f'{message}(空欄なら {default})\n>>> ').strip()
+    return float(s) if s else default
 
 
-def main(plugin):
+def main(plugin, tolerances):
     # ピッチ点を削減
-    reduce_pitch_points(plugin)
+    reduce_pitch_points(plugin, *tolerances)
     # PBWを丸める
     round_pbw(plugin)
 
 
 if __name__ == "__main__":
-    run(main)
+    cent_tolerance, ms_tolerance = DEFAULT_CENT_TOLERANCE, DEFAULT_MS_TOLERANCE
+    if ASK_TOLERANCE:
+        cent_tolerance = input_tolerance(
+            'ピッチ点を間引くときの、高さの許容誤差[cent]を入力してください。', cent_tolerance)
+        ms_tolerance = input_tolerance(
+            'ピッチ点を間引くときの、時間の許容誤差[ms]を入力してください。', ms_tolerance)
+    run(main, option=(cent_tolerance, ms_tolerance))
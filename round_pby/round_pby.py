@@ -3,15 +3,45 @@
 """
 ピッチ点の高さを丸める。全て半音レベルにする。EnuPitchを使った後に使用する想定。
 """
+import sys
+from os.path import abspath, dirname
+
 from utaupy.utauplugin import run
 
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.lazy import lazy_import  # noqa: E402 pylint: disable=wrong-import-position
+from _common.pitch import PitchPoints, read_pbs, round_to_grid  # noqa: E402 pylint: disable=wrong-import-position
+from _common.raster import rasterize  # noqa: E402 pylint: disable=wrong-import-position
+
+np = lazy_import('numpy')
+
+# 丸めでピッチ曲線が最大何 cent 変わったかを表示するかどうか
+REPORT_PITCH_CHANGE = False
+
 
 def round_pitches(plugin):
-    """音高を丸める
+    """音高を丸める。全ノートのピッチ点をまとめて処理する。
     """
-    for note in plugin.notes:
-        note.pbs = [note.pbs[0], round(note.pbs[1] / 10) * 10]
-        note.pby = [round(x/10) * 10 for x in note.pby]
+    notes = plugin.notes
+    if REPORT_PITCH_CHANGE:
+        # 丸めても変わらないノートの曲線は、丸めたあとにもう一度作らない
+        cache = {}
+        before, _ = rasterize(notes, cache=cache)
+    # PBS の高さ
+    indices, pbs = read_pbs(notes)
+    heights = np.round(pbs[:, 1] / 10).astype(int) * 10
+    for i, start, height in zip(indices.tolist(), pbs[:, 0].tolist(), heights.tolist()):
+        notes[i]['PBS'] = f'{int(start)};{height}'
+    # PBY
+    pby = PitchPoints(notes, 'PBY')
+    pby.values = round_to_grid(pby.values, 10)
+    pby.write_back()
+    if REPORT_PITCH_CHANGE:
+        after, _ = rasterize(notes, cache=cache)
+        voiced = ~np.isnan(before)
+        if np.any(voiced):
+            print(f'ピッチ曲線の変化は最大 {np.max(np.abs(after - before)[voiced]):.1f} cent です。')
 
 
 if __name__ == "__main__":
@@ -3,16 +3,23 @@
 """
 調声晒し用に休符の音程を低くする
 """
+import sys
+from os.path import abspath, dirname
+
 import utaupy
 
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.columns import NoteColumns  # noqa: E402 pylint: disable=wrong-import-position
+
 
 def set_rest_notenum_24(plugin):
     """
     休符の音程をUTAUで最低の24にする。
     """
-    for note in plugin.notes:
-        if note.lyric == 'R':
-            note.notenum = 24
+    columns = NoteColumns(plugin.notes)
+    columns.notenum[columns.is_rest] = 24
+    columns.write_back()
 
 
 if __name__ == '__main__':
@@ -6,7 +6,15 @@
 休符 'R' は処理しない。
 """
 
-import utaupy as up
+import sys
+from os.path import abspath, dirname
+
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.projection import run  # noqa: E402 pylint: disable=wrong-import-position
+
+# 読み込む項目
+KEYS = ('Lyric', 'Velocity')
 
 
 def main(plugin):
@@ -16,9 +24,9 @@ def main(plugin):
     notes = plugin.notes
     for note in notes:
         if ('R' != note.lyric) and ('R' in note.lyric):
-            note.set_by_key('Velocity', 100)
+            note.velocity = 100
 
 
 if __name__ == '__main__':
     print('_____ξ・ヮ・) < set_R_vel100 v1.0.0 ________')
-    up.utauplugin.run(main)
+    run(main, KEYS)
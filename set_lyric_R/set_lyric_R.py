@@ -3,7 +3,15 @@
 """
 選択範囲を休符にするプラグイン
 """
-from utaupy.utauplugin import run
+import sys
+from os.path import abspath, dirname
+
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.projection import run  # noqa: E402 pylint: disable=wrong-import-position
+
+# 読み込む項目 (すっぴん化で歌詞・ノート長・音程を使う)
+KEYS = ('Lyric', 'Length', 'NoteNum')
 
 
 def set_lyric_R(plugin):
@@ -16,4 +24,4 @@ def set_lyric_R(plugin):
 
 
 if __name__ == '__main__':
-    run(set_lyric_R)
+    run(set_lyric_R, KEYS)
@@ -3,72 +3,38 @@
 """
 超歌詞すっぴんプラグイン
 """
-import jaconv
-import utaupy
-
+import sys
+from os.path import abspath, dirname
 
-def force_lyric_zenkaku_hiragana(plugin):
-    """
-    歌詞に含まれるカタカナとひらがなを、全角ひらがなにする。
-    破壊的処理
-    """
-    for note in plugin.notes:
-        lyric = note.lyric
-        # 半角カタカナを全角カタカナにする
-        lyric = jaconv.h2z(lyric, kana=True, ascii=False, digit=False)
-        # カタカナをひらがなにする
-        lyric = jaconv.kata2hira(lyric)
-        # 無声化とかにつかう歌詞を適当に変更
-        # 歌詞を上書きする
-        note.lyric = lyric
+import utaupy
 
+# インストール後はプラグインフォルダ内の、開発中はリポジトリ直下の _common を使う
+sys.path += [dirname(abspath(__file__)), dirname(dirname(abspath(__file__)))]
+from _common.lyric import LyricNormalizer  # noqa: E402 pylint: disable=wrong-import-position
 
-def replace_special_lyric(plugin):
-    """
-    ブレスや語尾音素などの特殊歌詞を置換する
-    """
-    d_replace = {
-        'ゔ': 'ヴ',
-        ' n': 'ん', ' s': ' す', ' t': ' っ', ' k': ' っ', ' p': ' っ', ' f': ' っ',
-        ' h': ' R', ' -': ' R',
-        '息': 'R', 'ぶれす': 'R', 'br': 'R',
-        'づ': 'ず', 'を': 'お'
-    }
-    for note in plugin.notes:
-        lyric = note.lyric
-        for k, v in d_replace.items():
-            lyric = lyric.replace(k, v)
-        note.lyric = lyric
+# ブレスや語尾音素などの特殊歌詞の置換表
+D_REPLACE = {
+    'ゔ': 'ヴ',
+    ' n': 'ん', ' s': ' す', ' t': ' っ', ' k': ' っ', ' p': ' っ', ' f': ' っ',
+    ' h': ' R', ' -': ' R',
+    '息': 'R', 'ぶれす': 'R', 'br': 'R',
+    'づ': 'ず', 'を': 'お'
+}
+NORMALIZER = LyricNormalizer(D_REPLACE)
 
 
 def suppin_lyric(plugin):
     """
-    平仮名以外の文字を歌詞から削除する。
+    歌詞を全角ひらがなにしてから特殊歌詞を置換し、平仮名以外の文字を削除する。
     """
-    hiragana_set = {chr(i) for i in range(12353, 12436)}
     for note in plugin.notes:
-        original_lyric = note.lyric
-        # 休符のとき
-        if 'R' in original_lyric:
-            new_lyric = 'R'
-        # 休符でないときは平仮名以外の文字をすべて削除
-        else:
-            new_lyric = ''.join(
-                [character for character in original_lyric if character in hiragana_set]
-            )
-        # すっぴん化で歌詞が消滅した場合は元の歌詞を使う
-        if len(new_lyric) == 0:
-            note.lyric = original_lyric
-        else:
-            note.lyric = new_lyric
+        note.lyric = NORMALIZER.normalize(note.lyric)
 
 
 def main(plugin):
     """
     平仮名にしてからすっぴん化する。
     """
-    force_lyric_zenkaku_hiragana(plugin)
-    replace_special_lyric(plugin)
     suppin_lyric(plugin)
 
 